@@ -1,34 +1,21 @@
-from heapq import heappop, heappush
-import networkx as nx
-
-def dijsktra(G, source_node):
-    routes = {}
-    unvisited = [(0, source_node, source_node)]
-    visited = set()
+from __future__ import print_function
 
-    while unvisited:
-        (cost, dst, nh) = heappop(unvisited)
-        if dst not in visited or cost == routes[dst][0][1]:
-            visited.add(dst)
-            if nh == source_node: 
-                nh = dst
+import os
+import sys
 
-            if dst in routes:
-                routes[dst].append((nh, cost))
-            else:
-                routes[dst] = [(nh, cost)]
+import networkx as nx
 
-            for n in G.neighbors(dst):
-                heappush(unvisited, (cost+G[dst][n]['cost'], n, nh))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'controllers'))
 
-    return routes
+# The single pass shortest path DAG used by the controllers
+from ecmp import dijsktra
 
 
 
 def mk_topo(pods, bw):
-    num_hosts         = (pods ** 3)/4
+    num_hosts         = (pods ** 3)//4
     num_agg_switches  = pods * pods
-    num_core_switches = (pods * pods)/4
+    num_core_switches = (pods * pods)//4
 
     hosts = [('h' + str(i), {'type':'host'})
              for i in range (1, num_hosts + 1)]
@@ -47,35 +34,35 @@ def mk_topo(pods, bw):
     host_offset = 0
     for pod in range(pods):
         core_offset = 0
-        for sw in range(pods/2):
+        for sw in range(pods//2):
             switch = agg_switches[(pod*pods) + sw][0]
             # Connect to core switches
-            for port in range(pods/2):
+            for port in range(pods//2):
                 core_switch = core_switches[core_offset][0]
                 g.add_edge(switch,core_switch,
-                           {'src_port':port,'dst_port':pod,'capacity':bw,'cost':1})
+                           src_port=port,dst_port=pod,capacity=bw,cost=1)
                 g.add_edge(core_switch,switch,
-                           {'src_port':pod,'dst_port':port,'capacity':bw,'cost':1})
+                           src_port=pod,dst_port=port,capacity=bw,cost=1)
                 core_offset += 1
 
             # Connect to aggregate switches in same pod
-            for port in range(pods/2,pods):
+            for port in range(pods//2,pods):
                 lower_switch = agg_switches[(pod*pods) + port][0]
                 g.add_edge(switch,lower_switch,
-                           {'src_port':port,'dst_port':sw,'capacity':bw,'cost':1})
+                           src_port=port,dst_port=sw,capacity=bw,cost=1)
                 g.add_edge(lower_switch,switch,
-                           {'src_port':sw,'dst_port':port,'capacity':bw,'cost':1})
+                           src_port=sw,dst_port=port,capacity=bw,cost=1)
 
-        for sw in range(pods/2,pods):
+        for sw in range(pods//2,pods):
             switch = agg_switches[(pod*pods) + sw][0]
             # Connect to hosts
-            for port in range(pods/2,pods): # First k/2 pods connect to upper layer
+            for port in range(pods//2,pods): # First k/2 pods connect to upper layer
                 host = hosts[host_offset][0]
                 # All hosts connect on port 0
                 g.add_edge(switch,host,
-                           {'src_port':port,'dst_port':0,'capacity':bw,'cost':1})
+                           src_port=port,dst_port=0,capacity=bw,cost=1)
                 g.add_edge(host,switch,
-                           {'src_port':0,'dst_port':port,'capacity':bw,'cost':1})
+                           src_port=0,dst_port=port,capacity=bw,cost=1)
                 host_offset += 1
 
     return g
@@ -120,13 +107,13 @@ if __name__ == "__main__":
 
     for x in G:
         for y in G.neighbors(x):
-            print x,y, G[x][y]['cost']
+            print(x,y, G[x][y]['cost'])
 
-    print "DIJSKTRA---------"
+    print("DIJSKTRA---------")
 
     r = dijsktra(G, "h1")
 
-    print r
+    print(r)
 
 
 
@@ -0,0 +1,263 @@
+"""
+Packet-in storm against SimpleSwitch on a topogen fat tree with fake
+datapaths (fakedp.py), with and without admission control: the packet-in
+meters of the switches (PACKET_IN_RATE) and the priority queue of the
+controller (PACKET_IN_QUEUE).
+
+Once the topology converged, one host floods the fabric for --duration
+seconds at --rate frames per second, either with ARP requests from random
+source MACs ('arp', a broadcast storm) or with TCP packets from random
+source MACs to the other hosts ('scan'). Meanwhile the other hosts set up
+new flows (ARP request, ARP reply, one TCP packet, each sent again every
+--retry seconds until it arrives) and a fabric cable fails.
+
+Events reach the app through a bounded queue served by one green thread,
+as in a Ryu app (RyuApp.events holds 128): while it is full the switches
+cannot hand over more events, the storm included. Reported are the flows
+set up within --timeout and their setup time, the time the port status of
+the failed cable waited for the event loop, and the storm packet-ins
+dropped by the meters and by the controller queue.
+
+    python benchmarks/admission_bench.py -k 4 --storm scan
+    python benchmarks/admission_bench.py --storm arp --configs off both
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import random
+import sys
+
+from ryu.lib import hub
+
+import controller_bench
+import fakedp
+import topogen
+
+# Events a Ryu app queues before the senders block
+EVENT_QUEUE = 128
+
+CONFIGS = ('off', 'meter', 'queue', 'both')
+
+
+class LoopFabric(fakedp.Fabric):
+    """Fabric whose events, once started, go through a bounded queue
+    served by one green thread."""
+
+    def __init__(self, app, topo):
+        fakedp.Fabric.__init__(self, app, topo)
+        self.events = None
+        self.threads = []
+        # Seconds events of a type waited in the queue
+        self.waits = collections.defaultdict(list)
+
+    def start(self):
+        self.events = hub.Queue(EVENT_QUEUE)
+        self.threads = [hub.spawn(self._event_loop), hub.spawn(self._wire)]
+
+    def stop(self):
+        for thread in self.threads:
+            hub.kill(thread)
+        self.events = None
+
+    def dispatch(self, ev):
+        if self.events is None:
+            count = fakedp.Fabric.dispatch(self, ev)
+            # Until started, queued packet-ins are handled right away
+            queue = self.app.packet_in_queue
+            while queue is not None and len(queue):
+                self.app.handle_queued_packet_in()
+            return count
+        self.events.put((ev, fakedp.clock()))
+        return 1
+
+    def queued_packet_ins(self):
+        # Once started the app's worker runs alongside the hosts, a walk
+        # does not wait for it to empty the queue
+        if self.events is not None:
+            return 0
+        return fakedp.Fabric.queued_packet_ins(self)
+
+    def _event_loop(self):
+        while True:
+            (ev, queued) = self.events.get()
+            self.waits[type(ev).__name__].append(fakedp.clock() - queued)
+            fakedp.Fabric.dispatch(self, ev)
+
+    def _wire(self):
+        # Packet-outs and stats replies of the handlers
+        while True:
+            self.forward()
+            hub.sleep(0.001)
+
+
+def storm_frame(kind, attacker, target, n):
+    mac = '02:00:%02x:%02x:%02x:%02x' % tuple((n >> s) & 0xff for s in (24, 16, 8, 0))
+    if kind == 'arp':
+        frame = fakedp.arp_frame(attacker, target, 1)
+    else:
+        frame = fakedp.tcp_frame(attacker, target, 1024 + n % 60000)
+    frame.eth_src = mac
+    return frame
+
+
+def config_overrides(config, overrides):
+    """overrides with the admission control of config, the rate and queue
+    bound given in overrides or 100 packet-ins/s and 200 packet-ins."""
+    settings = dict(overrides)
+    out = [(n, v) for (n, v) in overrides if n not in ('PACKET_IN_RATE', 'PACKET_IN_QUEUE')]
+    if config in ('meter', 'both'):
+        out.append(('PACKET_IN_RATE', settings.get('PACKET_IN_RATE') or 100))
+    if config in ('queue', 'both'):
+        out.append(('PACKET_IN_QUEUE', settings.get('PACKET_IN_QUEUE') or 200))
+    return out
+
+
+def run(config, kind, k, storm, rate, duration, flows, timeout, retry, seed, overrides):
+    (module, cls, contexts) = controller_bench.load_app('simple',
+                                                        config_overrides(config, overrides))
+    app = cls(**contexts)
+    fabric = LoopFabric(app, controller_bench.make_topo(kind, k))
+    module.get_switch = fabric.get_switch
+    module.get_link = fabric.get_link
+    fabric.connect()
+    fabric.converge('enter')
+
+    rnd = random.Random(seed)
+    numbers = sorted(fabric.hosts)
+    attacker = numbers[0]
+    others = numbers[1:]
+    # Every host is known, as in a running fabric, the new flows need ARP
+    # and IPv4 packet-ins at their switches all the same
+    for host in numbers:
+        controller_bench.learn(fabric, host, rnd.choice([h for h in numbers if h != host]), 1)
+    pairs = [tuple(rnd.sample(others, 2)) for _ in range(flows)]
+    cable = sorted(fabric.links)[0]
+    fabric.start()
+    packet_ins = sum(fabric.packet_ins.values())
+    start = fakedp.clock()
+    sent = [0]
+    setup = []
+
+    def flood():
+        n = 0
+        while fakedp.clock() - start < duration:
+            # The host does not wait for the controller, the frames the
+            # switch could not hand over meanwhile are lost
+            due = int((fakedp.clock() - start) * rate)
+            n = max(n, due - EVENT_QUEUE)
+            while n < due:
+                fabric.inject(attacker, storm_frame(storm, attacker, rnd.choice(others), n))
+                n += 1
+                sent[0] += 1
+            hub.sleep(1.0 / rate)
+
+    def until(key, send, deadline):
+        seen = fabric.delivered[key]
+        while True:
+            send()
+            resend = fakedp.clock() + retry
+            while fakedp.clock() < min(resend, deadline):
+                if fabric.delivered[key] > seen:
+                    return True
+                hub.sleep(0.005)
+            if fakedp.clock() >= deadline:
+                return False
+
+    def flow(src, dst, sport):
+        t = fakedp.clock()
+        deadline = t + timeout
+        steps = (((dst, topogen.host_mac(src), fakedp.ETH_TYPE_ARP), src,
+                  fakedp.arp_frame(src, dst, 1)),
+                 ((src, topogen.host_mac(dst), fakedp.ETH_TYPE_ARP), dst,
+                  fakedp.arp_frame(dst, src, 2)),
+                 ((dst, topogen.host_mac(src), fakedp.ETH_TYPE_IP), src,
+                  fakedp.tcp_frame(src, dst, sport)))
+        for (key, host, frame) in steps:
+            if not until(key, lambda: fabric.inject(host, frame), deadline):
+                return
+        setup.append(fakedp.clock() - t)
+
+    threads = [hub.spawn(flood)]
+    for (i, (src, dst)) in enumerate(pairs):
+        hub.sleep(max(start + duration * i / len(pairs) - fakedp.clock(), 0))
+        if i == len(pairs) // 2:
+            fabric.fail_link(*cable)
+        threads.append(hub.spawn(flow, src, dst, 40000 + i))
+    for thread in threads:
+        thread.wait()
+    # Whatever is still queued is handled before the counters are read
+    queue = app.packet_in_queue
+    while not fabric.events.empty() or (queue is not None and len(queue)):
+        hub.sleep(0.01)
+    elapsed = fakedp.clock() - start
+    fabric.stop()
+
+    meter_drops = sum(m['dropped'] for dp in fabric.datapaths.values()
+                      for m in dp.meters.values())
+    queue = queue.stats() if queue is not None else {}
+    waits = fabric.waits['EventOFPPacketIn']
+    return {
+        'config': config,
+        'storm_sent': sent[0],
+        'storm_rate': sent[0] / float(duration),
+        'packet_ins': sum(fabric.packet_ins.values()) - packet_ins,
+        'meter_drops': meter_drops,
+        'queue_drops': sum(queue.get('dropped', {}).values()),
+        'queue_drops_by_class': queue.get('dropped', {}),
+        'duplicates': queue.get('duplicates', 0),
+        'flows': len(pairs),
+        'setup': float(len(setup)) / len(pairs),
+        'setup_p50_s': controller_bench.percentile(setup, 50),
+        'setup_p99_s': controller_bench.percentile(setup, 99),
+        'port_status_wait_s': max(fabric.waits['EventOFPPortStatus'] or [0.0]),
+        'event_wait_p99_s': controller_bench.percentile(waits, 99),
+        'elapsed_s': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-k', type=int, default=4)
+    parser.add_argument('--topo', choices=('fattree', 'leafspine', 'jellyfish'), default='fattree')
+    parser.add_argument('--storm', choices=('arp', 'scan'), default='scan')
+    parser.add_argument('--rate', type=float, default=2000, help='storm frames per second')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--flows', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=5, help='seconds to set up a flow')
+    parser.add_argument('--retry', type=float, default=1, help='seconds between two resends')
+    parser.add_argument('--configs', choices=CONFIGS, nargs='+', default=list(CONFIGS),
+                        help='off, meters only (PACKET_IN_RATE, 100 unless set), queue '
+                             'only (PACKET_IN_QUEUE, 200 unless set) or both')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a module constant of the app, e.g. PACKET_IN_BURST=20')
+    parser.add_argument('--json', action='store_true', help='machine readable output')
+    args = parser.parse_args()
+
+    overrides = [controller_bench.parse_override(o) for o in args.set]
+    results = []
+    for config in args.configs:
+        result = run(config, args.topo, args.k, args.storm, args.rate, args.duration, args.flows,
+                     args.timeout, args.retry, args.seed, overrides)
+        result.update({'k': args.k, 'storm': args.storm})
+        results.append(result)
+        if not args.json:
+            print('%-5s k=%d %s storm %d frames (%.0f/s) pkt-in=%d dropped: meters=%d queue=%d '
+                  '(%s) duplicates=%d | flows set up=%.0f%% p50=%.2fs p99=%.2fs port status waited %.3fs '
+                  'pkt-in event p99=%.3fs'
+                  % (config, args.k, args.storm, result['storm_sent'], result['storm_rate'],
+                     result['packet_ins'], result['meter_drops'], result['queue_drops'],
+                     ' '.join('%s=%d' % (c, n) for (c, n) in sorted(result['queue_drops_by_class'].items())),
+                     result['duplicates'],
+                     result['setup'] * 100, result['setup_p50_s'], result['setup_p99_s'],
+                     result['port_status_wait_s'], result['event_wait_p99_s']))
+            sys.stdout.flush()
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
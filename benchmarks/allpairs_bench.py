@@ -0,0 +1,100 @@
+"""
+Full recomputation time of the vectorised all-pairs backend
+(controllers/allpairs.py) against one ecmp.dijsktra per source, on the
+switch graph of topogen.fat_tree(k). routes_s is the conversion of the
+results into the route dicts of every source, which IncrementalSPF stores;
+it is timed at every k and dominates a full recomputation on large fabrics.
+With --kpaths the routes include the
+loop-free alternates of controllers/kpaths.py and are checked against
+kpaths.KPathsBackend.
+
+    python benchmarks/allpairs_bench.py -k 4 8 16 32 48
+    python benchmarks/allpairs_bench.py -k 8 16 --kpaths 4 --stretch 0.5 --weighted
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+
+from util import add_paths
+
+add_paths()
+
+import allpairs
+import ecmp
+import kpaths
+import topogen
+
+
+def switch_graph(k):
+    G = topogen.fat_tree(k).graph()
+    G.graph['version'] = 1
+    return G
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-k', type=int, nargs='+', default=[4, 8, 16, 24, 32, 48])
+    parser.add_argument('--dag-kmax', type=int, default=16,
+                        help='skip the per-source dijsktra above this k')
+    parser.add_argument('--weighted', action='store_true',
+                        help='use cost 2 on core links to exercise the heap fallback')
+    parser.add_argument('--kpaths', type=int, default=1,
+                        help='next hops per switch pair, alternates included')
+    parser.add_argument('--stretch', type=float, default=0.5,
+                        help='longest alternate path, relative to the shortest')
+    args = parser.parse_args()
+
+    print('%4s %6s %7s | %10s %10s %10s | %10s | %5s %s' % (
+        'k', 'nodes', 'edges', 'snapshot_s', 'compute_s', 'routes_s', 'per_src_s', 'paths', 'same'))
+    for k in args.k:
+        G = switch_graph(k)
+        if args.weighted:
+            for (u, v) in G.edges():
+                # Core switches are dpids 1..(k/2)^2
+                if u <= k * k // 4 or v <= k * k // 4:
+                    G[u][v]['cost'] = 2
+
+        start = time.time()
+        snap = allpairs.Snapshot(G)
+        snap_time = time.time() - start
+        start = time.time()
+        result = allpairs.AllPairs(snap)
+        compute_time = time.time() - start
+
+        # The routes of every source are only kept for the comparison, they
+        # outgrow the memory of the benchmark host at k = 48
+        check = k <= args.dag_kmax
+        routes = {}
+        routes_time = 0.0
+        (pairs, next_hops) = (0, 0)
+        for n in G:
+            start = time.time()
+            dsts = result.routes(n, args.kpaths, args.stretch)
+            routes_time += time.time() - start
+            pairs += len(dsts) - 1
+            next_hops += sum(len(r) for (d, r) in dsts.items() if d != n)
+            if check:
+                routes[n] = dsts
+        paths = '%5.2f' % (float(next_hops) / max(pairs, 1))
+
+        dag = '-'
+        same = '-'
+        if check:
+            route_fn = ecmp.dijsktra
+            if args.kpaths > 1:
+                route_fn = kpaths.KPathsBackend(args.kpaths, args.stretch)
+            start = time.time()
+            expected = dict((n, route_fn(G, n)) for n in G)
+            dag = '%10.3f' % (time.time() - start)
+            same = routes == expected
+        print('%4d %6d %7d | %10.3f %10.3f %10.3f | %10s | %5s %s' % (
+            k, G.number_of_nodes(), G.number_of_edges(), snap_time, compute_time,
+            routes_time, dag, paths, same))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""
+Offline throughput of the controller apps on topogen fat trees (or
+leaf-spine/Jellyfish fabrics of the same k), with fake datapaths instead of
+Mininet/OVS (see fakedp.py).
+
+Every app is connected to the fabric, converges on the topology through
+synthetic EventSwitchEnter/EventLinkAdd events, then serves a stream of
+new flows (ARP request, ARP reply, one TCP packet) between random host
+pairs. Packet-ins are generated wherever a frame hits a table-miss entry.
+With --fail-links, random switch cables then go down and the TCP packets
+of every flow are sent again, once right after the port status events and
+once after the controller repaired the routes. With --restart the app is
+closed once the flows are set up and a new instance takes over the same
+switches, from scratch (cold) or from the snapshot the old one saved (warm).
+
+    python benchmarks/controller_bench.py --kmin 4 --kmax 16 --flows 200
+    python benchmarks/controller_bench.py --app simple --set PROACTIVE=True --json
+    python benchmarks/controller_bench.py --app simple --kmin 16 --kmax 16 --set AGGREGATE=True
+    python benchmarks/controller_bench.py --app simple --fail-links 4 --set FAST_FAILOVER=True
+    python benchmarks/controller_bench.py --app simple --kmin 8 --kmax 8 --set SEGMENT_ROUTING=True
+    python benchmarks/controller_bench.py --app simple --kmin 8 --kmax 8 --restart warm
+"""
+
+from __future__ import print_function
+
+import argparse
+import ast
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from util import add_paths, load_source
+
+add_paths()
+
+import fakedp
+import topogen
+
+APPS = {
+    'simple': ('simple_controller', 'controllers/simple-controller.py'),
+    'controller': ('controller', 'controllers/controller.py'),
+    'shortest-path': ('shortest_path', 'controllers/shortest-path.py'),
+}
+
+
+def load_app(name, overrides):
+    (module_name, path) = APPS[name]
+    module = load_source(module_name, path)
+    for (key, value) in overrides:
+        setattr(module, key, value)
+    # The RyuApp defined by the module, with its _CONTEXTS instantiated
+    cls = [c for c in vars(module).values()
+           if isinstance(c, type) and c.__module__ == module.__name__ and hasattr(c, 'OFP_VERSIONS')][0]
+    contexts = dict((key, ctx()) for (key, ctx) in getattr(cls, '_CONTEXTS', {}).items())
+    return (module, cls, contexts)
+
+
+def make_topo(kind, k):
+    if kind == 'leafspine':
+        return topogen.leaf_spine(k, k // 2, k // 2)
+    if kind == 'jellyfish':
+        # As many k-port switches as the fat tree
+        hosts = max(1, k // 4)
+        return topogen.jellyfish(5 * k * k // 4, k - hosts, hosts)
+    return topogen.fat_tree(k)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def resend(fabric, pairs):
+    """Sends the TCP packet of every flow again, returns the delivered share."""
+    delivered = 0
+    for (i, (src, dst)) in enumerate(pairs):
+        key = (dst, topogen.host_mac(src), fakedp.ETH_TYPE_IP)
+        seen = fabric.delivered[key]
+        fabric.inject(src, fakedp.tcp_frame(src, dst, 40000 + i % 20000))
+        if fabric.delivered[key] > seen:
+            delivered += 1
+    return float(delivered) / max(len(pairs), 1)
+
+
+def learn(fabric, src, dst, sport):
+    """ARP request, ARP reply and one TCP packet from host src to dst,
+    returns whether the TCP packet was delivered."""
+    request = (dst, topogen.host_mac(src), fakedp.ETH_TYPE_ARP)
+    seen = fabric.delivered[request]
+    fabric.inject(src, fakedp.arp_frame(src, dst, 1))
+    if fabric.delivered[request] > seen:
+        # The target only replies to requests that reached it
+        fabric.inject(dst, fakedp.arp_frame(dst, src, 2))
+    key = (dst, topogen.host_mac(src), fakedp.ETH_TYPE_IP)
+    seen = fabric.delivered[key]
+    fabric.inject(src, fakedp.tcp_frame(src, dst, sport))
+    return fabric.delivered[key] > seen
+
+
+def restart(name, overrides, fabric, app, pairs, discovery, mode, path):
+    """Closes app and connects a new instance to the switches, which keep
+    their entries. Returns the new app and the time until its routes are
+    installed and until every flow is delivered again. Flows that are not
+    delivered right away are learned again from ARP, as after their hosts'
+    ARP caches expired."""
+    if mode == 'cold':
+        overrides = overrides + [('SNAPSHOT_FILE', None)]
+    start = fakedp.clock()
+    app.close()
+    snapshot_s = fakedp.clock() - start
+    # The old process is gone, its pending timers must not reach the switches
+    app.datapaths.clear()
+    before = fabric.messages()
+    packet_ins = len(fabric.latencies)
+
+    start = fakedp.clock()
+    (module, cls, contexts) = load_app(name, overrides)
+    app = cls(**contexts)
+    module.get_switch = fabric.get_switch
+    module.get_link = fabric.get_link
+    fabric.app = app
+    fabric.handlers = {}
+    fabric.entered = set()
+    fabric.discovered = []
+    fabric.connect()
+    fabric.converge(discovery)
+    restart_s = fakedp.clock() - start
+    msgs = fabric.messages()
+    msgs.subtract(before)
+
+    delivered = resend(fabric, pairs)
+    learned = delivered
+    if delivered < 1:
+        learned = float(sum(learn(fabric, src, dst, 40000 + i % 20000)
+                            for (i, (src, dst)) in enumerate(pairs))) / max(len(pairs), 1)
+    result = {
+        'restart': mode,
+        'snapshot_s': snapshot_s,
+        'snapshot_bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+        'restart_s': restart_s,
+        'restart_flow_mods': msgs['OFPFlowMod'] + msgs['OFPGroupMod'],
+        'delivered_after_restart': delivered,
+        'delivered_after_learning': learned,
+        'forwarding_s': fakedp.clock() - start,
+        'restart_packet_ins': len(fabric.latencies) - packet_ins,
+    }
+    return (app, result)
+
+
+def run(name, kind, k, flows, seed, discovery, overrides, fail_links=0, restart_mode=None):
+    snapshot_dir = None
+    if restart_mode:
+        # The app saves its state in both modes, only a warm restart reads it
+        snapshot_dir = tempfile.mkdtemp()
+        overrides = overrides + [('SNAPSHOT_FILE', os.path.join(snapshot_dir, 'snapshot'))]
+    (module, cls, contexts) = load_app(name, overrides)
+    topo = make_topo(kind, k)
+    app = cls(**contexts)
+    fabric = fakedp.Fabric(app, topo)
+    # The topology API is served by the fabric instead of ryu.topology
+    module.get_switch = fabric.get_switch
+    module.get_link = fabric.get_link
+
+    fabric.connect()
+    convergence = fabric.converge(discovery)
+    setup = fabric.messages()
+    fabric.latencies = []
+    fabric.packet_ins.clear()
+
+    rnd = random.Random(seed)
+    numbers = sorted(fabric.hosts)
+    delivered = 0
+    pairs = []
+    # Time to deliver the first TCP packet, packet-ins on the way included
+    first_packet = []
+    for i in range(flows):
+        (src, dst) = rnd.sample(numbers, 2)
+        pairs.append((src, dst))
+        request = (dst, topogen.host_mac(src), fakedp.ETH_TYPE_ARP)
+        seen = fabric.delivered[request]
+        fabric.inject(src, fakedp.arp_frame(src, dst, 1))
+        if fabric.delivered[request] > seen:
+            # The target only replies to requests that reached it
+            fabric.inject(dst, fakedp.arp_frame(dst, src, 2))
+        start = fakedp.clock()
+        fabric.inject(src, fakedp.tcp_frame(src, dst, 40000 + i % 20000))
+        first_packet.append(fakedp.clock() - start)
+        if fabric.delivered[(dst, topogen.host_mac(src), fakedp.ETH_TYPE_IP)]:
+            delivered += 1
+
+    msgs = fabric.messages()
+    msgs.subtract(setup)
+    # Flow table occupancy, the largest table of each switch role
+    occupancy = {}
+    # and of the entries matching MPLS labels
+    label_occupancy = {}
+    for (dpid, dp) in fabric.datapaths.items():
+        role = topo.roles[dpid]
+        occupancy[role] = max(occupancy.get(role, 0), dp.flow_count())
+        label_occupancy[role] = max(label_occupancy.get(role, 0), dp.flow_count('mpls_label'))
+    latencies = fabric.latencies
+    busy = sum(latencies)
+    result = {
+        'app': name,
+        'topo': topo.name,
+        'k': k,
+        'switches': len(topo.switches),
+        'hosts': len(topo.hosts),
+        'flows': flows,
+        'convergence_s': convergence,
+        'max_stall_s': fabric.max_stall,
+        'setup_flow_mods': setup['OFPFlowMod'] + setup['OFPGroupMod'],
+        'packet_ins': len(latencies),
+        'packet_ins_by_type': dict(('0x%04x' % t, n) for (t, n) in fabric.packet_ins.items()),
+        'packet_ins_per_flow': float(len(latencies)) / flows,
+        'packet_ins_per_s': len(latencies) / busy if busy else 0.0,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'first_packet_p50_us': percentile(first_packet, 50) * 1e6,
+        'first_packet_p99_us': percentile(first_packet, 99) * 1e6,
+        'flow_mods_per_flow': float(msgs['OFPFlowMod'] + msgs['OFPGroupMod']) / flows,
+        'packet_outs_per_flow': float(msgs['OFPPacketOut']) / flows,
+        'delivered': float(delivered) / flows,
+        'ttl_drops': fabric.ttl_drops,
+        'flow_entries': sum(dp.flow_count() for dp in fabric.datapaths.values()),
+        'flow_entries_max': max(occupancy.values()),
+        'flow_entries_max_by_role': occupancy,
+        'label_entries_max_by_role': label_occupancy,
+    }
+
+    if restart_mode:
+        (app, restarted) = restart(name, overrides, fabric, app, pairs, discovery, restart_mode,
+                                   os.path.join(snapshot_dir, 'snapshot'))
+        result.update(restarted)
+        shutil.rmtree(snapshot_dir)
+
+    if fail_links:
+        # Before the app's green threads run only the switches react
+        for (a, pa, b, pb) in rnd.sample(topo.links, fail_links):
+            fabric.fail_link(a, pa)
+        result['failed_links'] = fail_links
+        result['delivered_before_repair'] = resend(fabric, pairs)
+        fabric.settle()
+        result['delivered_after_repair'] = resend(fabric, pairs)
+    return result
+
+
+def parse_override(text):
+    (key, value) = text.split('=', 1)
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return (key, value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', action='append', choices=sorted(APPS),
+                        help='app to run, repeatable (default: all)')
+    parser.add_argument('--topo', choices=('fattree', 'leafspine', 'jellyfish'), default='fattree')
+    parser.add_argument('--kmin', type=int, default=4)
+    parser.add_argument('--kmax', type=int, default=16)
+    parser.add_argument('--flows', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--discovery', choices=('enter', 'links'), default='enter',
+                        help="links known when a switch enters, or one EventLinkAdd per link")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a module constant of the app, e.g. PROACTIVE=True')
+    parser.add_argument('--fail-links', type=int, default=0, metavar='N',
+                        help='take N random cables down once the flows are set up')
+    parser.add_argument('--restart', choices=('cold', 'warm'),
+                        help='restart the app once the flows are set up, warm from a snapshot')
+    parser.add_argument('--json', action='store_true', help='machine readable output')
+    args = parser.parse_args()
+
+    overrides = [parse_override(o) for o in args.set]
+    results = []
+    k = args.kmin
+    while k <= args.kmax:
+        for name in args.app or sorted(APPS):
+            try:
+                results.append(run(name, args.topo, k, args.flows, args.seed, args.discovery,
+                                   overrides, args.fail_links, args.restart))
+            except SyntaxError as e:
+                # an app that does not compile on this interpreter
+                results.append({'app': name, 'k': k, 'error': 'cannot load: %s' % e})
+            if not args.json:
+                print_result(results[-1])
+                sys.stdout.flush()
+        k *= 2
+
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+
+
+def print_result(r):
+    if 'error' in r:
+        print('%-13s k=%-3d %s' % (r['app'], r['k'], r['error']))
+        return
+    print('%-13s k=%-3d switches=%-5d converge=%.3fs (stall %.3fs) pkt-in=%d (%.1f/flow) %.0f/s '
+          'p50=%.0fus p99=%.0fus first-pkt=%.0fus flow-mods/flow=%.1f delivered=%.0f%% entries=%d (max %s)'
+          % (r['app'], r['k'], r['switches'], r['convergence_s'], r['max_stall_s'], r['packet_ins'],
+             r['packet_ins_per_flow'], r['packet_ins_per_s'], r['p50_us'], r['p99_us'],
+             r['first_packet_p50_us'], r['flow_mods_per_flow'], r['delivered'] * 100, r['flow_entries'],
+             ' '.join('%s=%d' % item for item in sorted(r['flow_entries_max_by_role'].items()))))
+    print('%-13s k=%-3d label entries (max %s) pkt-in/flow by type %s'
+          % (r['app'], r['k'],
+             ' '.join('%s=%d' % item for item in sorted(r['label_entries_max_by_role'].items())),
+             ' '.join('%s=%.1f' % (t, float(n) / r['flows'])
+                      for (t, n) in sorted(r['packet_ins_by_type'].items()))))
+    if 'restart' in r:
+        print('%-13s k=%-3d %s restart: snapshot %.3fs %d bytes, routes in %.3fs, flow-mods=%d, '
+              'delivered %.0f%% right away, %.0f%% in %.3fs, pkt-in=%d'
+              % (r['app'], r['k'], r['restart'], r['snapshot_s'], r['snapshot_bytes'],
+                 r['restart_s'], r['restart_flow_mods'], r['delivered_after_restart'] * 100,
+                 r['delivered_after_learning'] * 100, r['forwarding_s'], r['restart_packet_ins']))
+    if 'failed_links' in r:
+        print('%-13s k=%-3d %d links down: delivered %.0f%% before repair, %.0f%% after'
+              % (r['app'], r['k'], r['failed_links'], r['delivered_before_repair'] * 100,
+                 r['delivered_after_repair'] * 100))
+
+
+if __name__ == '__main__':
+    main()
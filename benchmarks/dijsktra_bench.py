@@ -0,0 +1,112 @@
+"""
+Heap size and runtime of the legacy per-path dijsktra against the single
+pass shortest path DAG (controllers/ecmp.py) on mk_topo(k) fat trees.
+
+    python benchmarks/dijsktra_bench.py --kmin 4 --kmax 32
+"""
+
+from __future__ import print_function
+
+import argparse
+import heapq
+import sys
+import time
+
+from util import add_paths, load_source
+
+add_paths()
+
+import ecmp
+
+topo = load_source('two_dijsktra', '2_dijsktra.py')
+
+
+class HeapStats(object):
+    """Wraps heappush to record the number of pushes and the peak heap size."""
+
+    def __init__(self):
+        self.pushes = 0
+        self.max_size = 0
+
+    def heappush(self, heap, item):
+        self.pushes += 1
+        heapq.heappush(heap, item)
+        if len(heap) > self.max_size:
+            self.max_size = len(heap)
+
+
+def legacy_dijsktra(G, source_node, heappush=heapq.heappush):
+    # The original implementation from SimpleSwitch.dijsktra
+    routes = {}
+    unvisited = [(0, source_node, source_node)]
+    visited = set()
+
+    while unvisited:
+        (cost, dst, nh) = heapq.heappop(unvisited)
+        if dst not in visited or cost == routes[dst][0][1]:
+            visited.add(dst)
+            if nh == source_node:
+                nh = dst
+
+            if dst in routes:
+                routes[dst].append((nh, cost))
+            else:
+                routes[dst] = [(nh, cost)]
+
+            for n in G.neighbors(dst):
+                heappush(unvisited, (cost+G[dst][n]['cost'], n, nh))
+
+    return routes
+
+
+def run(fn, G, source):
+    stats = HeapStats()
+    start = time.time()
+    routes = fn(G, source, stats)
+    return routes, stats, time.time() - start
+
+
+def run_legacy(G, source, stats):
+    return legacy_dijsktra(G, source, stats.heappush)
+
+
+def run_dag(G, source, stats):
+    orig = ecmp.heappush
+    ecmp.heappush = stats.heappush
+    try:
+        return ecmp.dijsktra(G, source)
+    finally:
+        ecmp.heappush = orig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--kmin', type=int, default=4)
+    parser.add_argument('--kmax', type=int, default=32)
+    parser.add_argument('--legacy-kmax', type=int, default=32,
+                        help='skip the legacy implementation above this k')
+    parser.add_argument('--source', default='h1')
+    args = parser.parse_args()
+
+    print('%4s %7s %8s | %12s %12s %9s | %8s %9s %9s | %s' % (
+        'k', 'nodes', 'edges', 'legacy_push', 'legacy_heap', 'legacy_s',
+        'dag_heap', 'dag_s', 'speedup', 'same_hops'))
+    for k in range(args.kmin, args.kmax + 1, 2):
+        G = topo.mk_topo(k, 1)
+        dag_routes, dag_stats, dag_time = run(run_dag, G, args.source)
+        if k <= args.legacy_kmax:
+            old_routes, old_stats, old_time = run(run_legacy, G, args.source)
+            same = all(set(old_routes[d]) == set(dag_routes[d]) for d in old_routes)
+            print('%4d %7d %8d | %12d %12d %9.3f | %8d %9.4f %8.0fx | %s' % (
+                k, G.number_of_nodes(), G.number_of_edges(),
+                old_stats.pushes, old_stats.max_size, old_time,
+                dag_stats.max_size, dag_time, old_time / max(dag_time, 1e-9), same))
+        else:
+            print('%4d %7d %8d | %12s %12s %9s | %8d %9.4f %9s | %s' % (
+                k, G.number_of_nodes(), G.number_of_edges(), '-', '-', '-',
+                dag_stats.max_size, dag_time, '-', '-'))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,621 @@
+"""
+Fake OpenFlow 1.3 datapaths and fabric for running the controller apps
+without Mininet or OVS.
+
+FakeDatapath records every message an app sends, through send_msg() or the
+coalesced Datapath.send() path of controllers/southbound.py, and keeps a
+minimal flow, group and meter table. Fabric wires the datapaths into a
+topology, dispatches Ryu events to the app handlers, and walks frames hop
+by hop: a table hit applies the entry's actions, meters drop the packets
+above their rate, an output to the controller becomes a packet-in, and the
+app's packet-outs are injected back into the fabric.
+Flow stats and group description requests are answered the same way.
+"""
+
+import collections
+import struct
+import time
+import zlib
+
+from util import add_paths
+
+add_paths()
+
+from ryu.controller import ofp_event
+from ryu.lib import hub
+from ryu.lib.packet import arp
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import packet
+from ryu.lib.packet import tcp
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+from ryu.topology import event
+
+import pktdecode
+from topogen import host_ip, host_mac
+
+clock = getattr(time, 'perf_counter', time.time)
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_MPLS = 0x8847
+
+# Frames are dropped after this many hops (forwarding loops)
+MAX_HOPS = 64
+# Entries per part of a multipart stats reply
+REPLY_PART = 500
+
+Port = collections.namedtuple('Port', 'dpid port_no')
+Link = collections.namedtuple('Link', 'src dst')
+Switch = collections.namedtuple('Switch', 'dp')
+
+
+def _mac_int(mac):
+    return int(mac.replace(':', ''), 16)
+
+
+def _ip_int(ip):
+    return struct.unpack('!I', struct.pack('!4B', *[int(b) for b in ip.split('.')]))[0]
+
+
+def _masked(value, mask):
+    if ':' in str(mask):
+        return _mac_int(value) & _mac_int(mask)
+    if '.' in str(mask):
+        return _ip_int(value) & _ip_int(mask)
+    return value & mask
+
+
+class Frame(object):
+    __slots__ = ('eth_dst', 'eth_src', 'ethertype', 'labels', 'payload')
+
+    def __init__(self, eth_dst, eth_src, ethertype, payload, labels=()):
+        self.eth_dst = eth_dst
+        self.eth_src = eth_src
+        # Ethertype of the payload below the label stack
+        self.ethertype = ethertype
+        self.labels = list(labels)
+        self.payload = payload
+
+    def copy(self):
+        return Frame(self.eth_dst, self.eth_src, self.ethertype, self.payload, self.labels)
+
+    def data(self):
+        eth_type = ETH_TYPE_MPLS if self.labels else self.ethertype
+        head = (struct.pack('!6s6sH', bytes(bytearray.fromhex(self.eth_dst.replace(':', ''))),
+                            bytes(bytearray.fromhex(self.eth_src.replace(':', ''))), eth_type))
+        stack = b''
+        for (i, label) in enumerate(self.labels):
+            bos = 1 if i == len(self.labels) - 1 else 0
+            stack += struct.pack('!I', (label << 12) | (bos << 8) | 64)
+        return head + stack + self.payload
+
+    def fields(self, in_port):
+        """OXM fields of the frame as matched by a flow entry."""
+        hdr = pktdecode.decode(self.data())
+        fields = {'in_port': in_port, 'eth_dst': self.eth_dst, 'eth_src': self.eth_src,
+                  'eth_type': hdr.ethertype}
+        if hdr.mpls_label is not None:
+            fields['mpls_label'] = hdr.mpls_label
+            fields['mpls_bos'] = 1 if len(self.labels) == 1 else 0
+        elif hdr.ip_src is not None:
+            fields.update(ipv4_src=hdr.ip_src, ipv4_dst=hdr.ip_dst, ip_proto=hdr.ip_proto)
+            if hdr.ip_proto == pktdecode.IPPROTO_TCP:
+                fields.update(tcp_src=hdr.l4_src, tcp_dst=hdr.l4_dst)
+            elif hdr.ip_proto == pktdecode.IPPROTO_UDP:
+                fields.update(udp_src=hdr.l4_src, udp_dst=hdr.l4_dst)
+        elif hdr.arp_op is not None:
+            fields.update(arp_op=hdr.arp_op, arp_spa=hdr.arp_spa, arp_tpa=hdr.arp_tpa)
+        return fields
+
+    @classmethod
+    def parse(cls, data):
+        (dst, src, eth_type) = struct.unpack_from('!6s6sH', data, 0)
+        mac = lambda b: ':'.join('%02x' % c for c in bytearray(b))
+        offset = 14
+        labels = []
+        while eth_type == ETH_TYPE_MPLS:
+            word = struct.unpack_from('!I', data, offset)[0]
+            labels.append(word >> 12)
+            offset += 4
+            if word & 0x100:
+                # Only IPv4 is carried over MPLS here
+                eth_type = ETH_TYPE_IP
+        return cls(mac(dst), mac(src), eth_type, bytes(data[offset:]), labels)
+
+
+def arp_frame(src, dst, opcode=1):
+    """ARP request from host src for host dst (numbers), or the reply."""
+    if opcode == 1:
+        (eth_dst, tha) = ('ff:ff:ff:ff:ff:ff', '00:00:00:00:00:00')
+    else:
+        (eth_dst, tha) = (host_mac(dst), host_mac(dst))
+    pkt = packet.Packet()
+    pkt.add_protocol(arp.arp(opcode=opcode, src_mac=host_mac(src), src_ip=host_ip(src),
+                             dst_mac=tha, dst_ip=host_ip(dst)))
+    pkt.serialize()
+    return Frame(eth_dst, host_mac(src), ETH_TYPE_ARP, bytes(pkt.data))
+
+
+def tcp_frame(src, dst, sport=40000, dport=80):
+    pkt = packet.Packet()
+    pkt.add_protocol(ipv4.ipv4(src=host_ip(src), dst=host_ip(dst), proto=pktdecode.IPPROTO_TCP))
+    pkt.add_protocol(tcp.tcp(src_port=sport, dst_port=dport))
+    pkt.serialize()
+    return Frame(host_mac(dst), host_mac(src), ETH_TYPE_IP, bytes(pkt.data))
+
+
+class FlowTable(object):
+    """Flow entries indexed by the set of matched fields, so a lookup costs
+    one dict access per distinct match layout instead of a scan."""
+
+    def __init__(self):
+        # sig -> {key: {priority: entry}}, sig is ((field, mask), ...)
+        self.index = {}
+        self.count = 0
+
+    @staticmethod
+    def split(match):
+        sig = []
+        key = []
+        for (name, value) in sorted(match.items()):
+            if isinstance(value, tuple):
+                sig.append((name, value[1]))
+                key.append(_masked(value[0], value[1]))
+            else:
+                sig.append((name, None))
+                key.append(value)
+        return (tuple(sig), tuple(key))
+
+    def entries(self):
+        for keys in self.index.values():
+            for prios in keys.values():
+                for entry in prios.values():
+                    yield entry
+
+    def add(self, entry):
+        (sig, key) = self.split(entry['match'])
+        prios = self.index.setdefault(sig, {}).setdefault(key, {})
+        if entry['priority'] not in prios:
+            self.count += 1
+        prios[entry['priority']] = entry
+
+    def remove(self, entry):
+        (sig, key) = self.split(entry['match'])
+        del self.index[sig][key][entry['priority']]
+        self.count -= 1
+
+    def strict(self, match, priority):
+        (sig, key) = self.split(match)
+        return self.index.get(sig, {}).get(key, {}).get(priority)
+
+    def lookup(self, fields):
+        best = None
+        for (sig, keys) in self.index.items():
+            key = []
+            for (name, mask) in sig:
+                if name not in fields:
+                    break
+                key.append(fields[name] if mask is None else _masked(fields[name], mask))
+            else:
+                prios = keys.get(tuple(key))
+                if prios:
+                    priority = max(prios)
+                    if best is None or priority > best['priority']:
+                        best = prios[priority]
+        return best
+
+
+def _covers(match, entry_match):
+    """Non strict match: every field of match is in the entry's match."""
+    entry_fields = dict(entry_match.items())
+    for (name, value) in match.items():
+        if entry_fields.get(name) != value:
+            return False
+    return True
+
+
+class FakeDatapath(object):
+    ofproto = ofproto_v1_3
+    ofproto_parser = ofproto_v1_3_parser
+
+    def __init__(self, dpid, ports, fabric=None):
+        self.id = dpid
+        self.ports = ports
+        self.fabric = fabric
+        self.xid = 0
+        self.tables = collections.defaultdict(FlowTable)
+        # group_id -> (type, buckets)
+        self.groups = {}
+        # meter_id -> token bucket of its drop band
+        self.meters = {}
+        self.msgs = collections.Counter()
+        self.writes = 0
+        self.bytes = 0
+
+    # ryu.controller.controller.Datapath interface
+    def set_xid(self, msg):
+        # Called by Southbound.flush() for every message of a write
+        self.xid += 1
+        msg.set_xid(self.xid)
+        self.receive(msg)
+
+    def send(self, buf):
+        self.writes += 1
+        self.bytes += len(buf)
+
+    def send_msg(self, msg):
+        self.writes += 1
+        self.receive(msg)
+
+    def receive(self, msg):
+        ofp = self.ofproto
+        parser = self.ofproto_parser
+        self.msgs[type(msg).__name__] += 1
+        if isinstance(msg, parser.ONFBundleAddMsg):
+            self.receive(msg.message)
+        elif isinstance(msg, parser.OFPFlowMod):
+            self.flow_mod(msg)
+        elif isinstance(msg, parser.OFPGroupMod):
+            if msg.command == ofp.OFPGC_DELETE:
+                self.groups.pop(msg.group_id, None)
+            else:
+                self.groups[msg.group_id] = (msg.type, msg.buckets)
+        elif isinstance(msg, parser.OFPMeterMod):
+            if msg.command == ofp.OFPMC_DELETE:
+                self.meters.pop(msg.meter_id, None)
+            else:
+                band = msg.bands[0]
+                meter = self.meters.setdefault(msg.meter_id, {'tokens': band.burst_size,
+                                                              'time': clock(), 'dropped': 0})
+                meter.update(rate=band.rate, burst=max(band.burst_size, 1))
+        elif isinstance(msg, parser.OFPPacketOut) and self.fabric is not None:
+            self.fabric.packet_outs.append((self, msg))
+        elif isinstance(msg, parser.OFPFlowStatsRequest) and self.fabric is not None:
+            body = [parser.OFPFlowStats(table_id=table_id, duration_sec=0, duration_nsec=0,
+                                        priority=e['priority'], idle_timeout=e['idle_timeout'],
+                                        hard_timeout=e['hard_timeout'], flags=e['flags'],
+                                        cookie=e['cookie'], packet_count=e['packets'],
+                                        byte_count=e['bytes'], match=e['match'],
+                                        instructions=e['instructions'])
+                    for (table_id, table) in sorted(self.tables.items())
+                    for e in table.entries()]
+            self.reply(parser.OFPFlowStatsReply, body, ofp_event.EventOFPFlowStatsReply)
+        elif isinstance(msg, parser.OFPGroupDescStatsRequest) and self.fabric is not None:
+            body = [parser.OFPGroupDescStats(type_=group_type, group_id=group_id, buckets=buckets)
+                    for (group_id, (group_type, buckets)) in sorted(self.groups.items())]
+            self.reply(parser.OFPGroupDescStatsReply, body, ofp_event.EventOFPGroupDescStatsReply)
+
+    def reply(self, cls, body, event_cls):
+        """Queues the multipart reply to a stats request."""
+        parts = [body[i:i + REPLY_PART] for i in range(0, len(body), REPLY_PART)] or [[]]
+        for (i, part) in enumerate(parts):
+            more = self.ofproto.OFPMPF_REPLY_MORE if i < len(parts) - 1 else 0
+            self.fabric.replies.append(event_cls(cls(self, body=part, flags=more)))
+
+    def tables_of(self, table_id):
+        if table_id == self.ofproto.OFPTT_ALL:
+            return list(self.tables.values())
+        return [self.tables[table_id]]
+
+    def selected(self, msg, table):
+        """Entries of table selected by a non strict modify/delete."""
+        mask = msg.cookie_mask
+        out = []
+        for entry in table.entries():
+            if mask and (entry['cookie'] & mask) != (msg.cookie & mask):
+                continue
+            if _covers(msg.match, entry['match']):
+                out.append(entry)
+        return out
+
+    def flow_mod(self, msg):
+        ofp = self.ofproto
+        if msg.command == ofp.OFPFC_ADD:
+            self.tables[msg.table_id].add({'match': msg.match, 'priority': msg.priority,
+                                           'cookie': msg.cookie, 'instructions': msg.instructions,
+                                           'idle_timeout': msg.idle_timeout,
+                                           'hard_timeout': msg.hard_timeout,
+                                           'flags': msg.flags, 'packets': 0, 'bytes': 0})
+        elif msg.command in (ofp.OFPFC_DELETE_STRICT, ofp.OFPFC_MODIFY_STRICT):
+            for table in self.tables_of(msg.table_id):
+                entry = table.strict(msg.match, msg.priority)
+                if entry is None:
+                    continue
+                if msg.command == ofp.OFPFC_DELETE_STRICT:
+                    table.remove(entry)
+                else:
+                    entry['instructions'] = msg.instructions
+        elif msg.command in (ofp.OFPFC_DELETE, ofp.OFPFC_MODIFY):
+            for table in self.tables_of(msg.table_id):
+                for entry in self.selected(msg, table):
+                    if msg.command == ofp.OFPFC_DELETE:
+                        table.remove(entry)
+                    else:
+                        entry['instructions'] = msg.instructions
+
+    def meter(self, meter_id):
+        """Takes a token of the packets per second meter, False if the
+        packet is dropped."""
+        meter = self.meters.get(meter_id)
+        if meter is None:
+            return True
+        now = clock()
+        meter['tokens'] = min(meter['burst'], meter['tokens'] + (now - meter['time']) * meter['rate'])
+        meter['time'] = now
+        if meter['tokens'] < 1:
+            meter['dropped'] += 1
+            return False
+        meter['tokens'] -= 1
+        return True
+
+    def flow_count(self, field=None):
+        """Number of entries, of those matching field if given."""
+        if field is None:
+            return sum(table.count for table in self.tables.values())
+        return sum(1 for table in self.tables.values() for entry in table.entries()
+                   if field in entry['match'])
+
+
+class Fabric(object):
+    """The FakeDatapaths of a topogen.Topology, driven through the handlers
+    of one app."""
+
+    def __init__(self, app, topo):
+        self.app = app
+        self.links = topo.link_map()
+        self.hosts = topo.host_map()
+        self.host_ports = dict((loc, host) for (host, loc) in self.hosts.items())
+        self.datapaths = dict((dpid, FakeDatapath(dpid, ports, self))
+                              for (dpid, ports) in topo.switch_ports().items())
+        self.packet_outs = []
+        # Stats reply events, dispatched like the packet-outs
+        self.replies = []
+        self.entered = set()
+        self.discovered = []
+        self.handlers = {}
+        self.latencies = []
+        self.packet_ins = collections.Counter()
+        self.delivered = collections.Counter()
+        self.ttl_drops = 0
+        self.max_stall = 0.0
+        # (dpid, port) of both ends of the failed cables
+        self.down = set()
+
+    # ryu.topology.api replacements, installed on the app module
+    def get_switch(self, app, dpid=None):
+        return [Switch(self.datapaths[d]) for d in sorted(self.entered)
+                if dpid is None or d == dpid]
+
+    def get_link(self, app, dpid=None):
+        return [l for l in self.discovered if dpid is None or l.src.dpid == dpid]
+
+    def dispatch(self, ev):
+        cls = type(ev)
+        if cls not in self.handlers:
+            handlers = []
+            for name in dir(self.app):
+                method = getattr(self.app, name, None)
+                if cls in getattr(method, 'callers', {}):
+                    handlers.append(method)
+            self.handlers[cls] = handlers
+        for handler in self.handlers[cls]:
+            handler(ev)
+        return len(self.handlers[cls])
+
+    def connect(self):
+        parser = ofproto_v1_3_parser
+        for (dpid, dp) in sorted(self.datapaths.items()):
+            msg = parser.OFPSwitchFeatures(dp, datapath_id=dpid, n_buffers=0, n_tables=254,
+                                           auxiliary_id=0, capabilities=0)
+            self.dispatch(ofp_event.EventOFPSwitchFeatures(msg))
+
+    def converge(self, discovery='enter'):
+        """Switch enter and link add events of the whole topology, links are
+        either known when a switch enters ('enter') or discovered one by
+        one once every switch is up ('links'). Returns the elapsed time,
+        the longest event handler run is kept in max_stall."""
+        start = clock()
+        events = []
+        for dpid in sorted(self.datapaths):
+            self.entered.add(dpid)
+            if discovery == 'enter':
+                self.discover(dpid)
+            events.append(event.EventSwitchEnter(Switch(self.datapaths[dpid])))
+            if discovery == 'links' and dpid == max(self.datapaths):
+                events.extend(event.EventLinkAdd(link) for link in self.discover())
+            for ev in events:
+                t = clock()
+                self.dispatch(ev)
+                self.max_stall = max(self.max_stall, clock() - t)
+                self.forward()
+            events = []
+        self.settle()
+        return clock() - start
+
+    def settle(self):
+        """Runs the app's green threads until its route workers are idle."""
+        hub.sleep(0)
+        pool = getattr(self.app, 'route_pool', None)
+        while pool is not None and pool.busy():
+            hub.sleep(0.001)
+        self.forward()
+
+    def fail_link(self, dpid, port):
+        """Takes the cable at (dpid, port) down and sends the OFPPortStatus
+        of both ends to the app. The links stay discovered, as until LLDP
+        times out."""
+        parser = ofproto_v1_3_parser
+        ofp = ofproto_v1_3
+        for (d, p) in ((dpid, port), self.links[(dpid, port)]):
+            self.down.add((d, p))
+            desc = parser.OFPPort(port_no=p, hw_addr='00:00:00:00:00:00', name=b'', config=0,
+                                  state=ofp.OFPPS_LINK_DOWN, curr=0, advertised=0, supported=0,
+                                  peer=0, curr_speed=0, max_speed=0)
+            msg = parser.OFPPortStatus(self.datapaths[d], reason=ofp.OFPPR_MODIFY, desc=desc)
+            self.dispatch(ofp_event.EventOFPPortStatus(msg))
+
+    def discover(self, dpid=None):
+        """Marks the links between entered switches (touching dpid) as
+        discovered, returns the new ones."""
+        new = []
+        for ((a, pa), (b, pb)) in sorted(self.links.items()):
+            if dpid is not None and dpid not in (a, b):
+                continue
+            if a in self.entered and b in self.entered:
+                new.append(Link(Port(a, pa), Port(b, pb)))
+        self.discovered.extend(new)
+        return new
+
+    def packet_in(self, dp, in_port, frame, table_id=0, reason=None):
+        parser = ofproto_v1_3_parser
+        ofp = ofproto_v1_3
+        if reason is None:
+            reason = ofp.OFPR_NO_MATCH
+        data = frame.data()
+        msg = parser.OFPPacketIn(dp, buffer_id=ofp.OFP_NO_BUFFER, total_len=len(data),
+                                 reason=reason, table_id=table_id, cookie=0,
+                                 match=parser.OFPMatch(in_port=in_port), data=data)
+        msg.msg_len = len(data)
+        self.packet_ins[frame.labels and ETH_TYPE_MPLS or frame.ethertype] += 1
+        start = clock()
+        self.dispatch(ofp_event.EventOFPPacketIn(msg))
+        self.latencies.append(clock() - start)
+
+    def inject(self, host, frame):
+        """Sends frame from host into its switch, walks it until it is
+        delivered, dropped or punted to the controller and back."""
+        (dpid, port) = self.hosts[host]
+        self.walk([(self.datapaths[dpid], port, frame, 0)])
+
+    def forward(self):
+        """Injects the packet-outs sent so far."""
+        self.walk([])
+
+    def queued_packet_ins(self):
+        """Packet-ins waiting in the app's admission queue (PACKET_IN_QUEUE)."""
+        queue = getattr(self.app, 'packet_in_queue', None)
+        return len(queue) if queue is not None else 0
+
+    def walk(self, queue):
+        queue = collections.deque(queue)
+        hops = 0
+        while True:
+            while self.packet_outs or self.replies:
+                while self.replies:
+                    self.dispatch(self.replies.pop(0))
+                while self.packet_outs:
+                    (dp, msg) = self.packet_outs.pop(0)
+                    if msg.data is not None:
+                        queue.extend(self.apply(dp, msg.in_port, Frame.parse(msg.data),
+                                                msg.actions, hops))
+            if not queue:
+                if not self.queued_packet_ins():
+                    return
+                # The app's worker thread handles one packet-in per turn
+                hub.sleep(0)
+                continue
+            (dp, in_port, frame, hops) = queue.popleft()
+            if hops > MAX_HOPS:
+                self.ttl_drops += 1
+                continue
+            queue.extend(self.pipeline(dp, in_port, frame, hops))
+
+    def pipeline(self, dp, in_port, frame, hops):
+        ofp = ofproto_v1_3
+        table_id = 0
+        while True:
+            entry = dp.tables[table_id].lookup(frame.fields(in_port))
+            if entry is None:
+                return []
+            entry['packets'] += 1
+            entry['bytes'] += len(frame.payload)
+            out = []
+            goto = None
+            for inst in entry['instructions']:
+                if inst.type == ofp.OFPIT_METER and not dp.meter(inst.meter_id):
+                    return []
+                if inst.type == ofp.OFPIT_APPLY_ACTIONS:
+                    out.extend(self.apply(dp, in_port, frame, inst.actions, hops, table_id))
+                elif inst.type == ofp.OFPIT_GOTO_TABLE:
+                    goto = inst.table_id
+            if goto is None:
+                return out
+            table_id = goto
+
+    def apply(self, dp, in_port, frame, actions, hops, table_id=0):
+        """Applies an action list to a copy of frame, returns the frames
+        sent to neighbour switches as (dp, in_port, frame, hops)."""
+        parser = ofproto_v1_3_parser
+        frame = frame.copy()
+        out = []
+        for action in actions:
+            if isinstance(action, parser.OFPActionPushMpls):
+                frame.labels.insert(0, 0)
+            elif isinstance(action, parser.OFPActionPopMpls):
+                if frame.labels:
+                    frame.labels.pop(0)
+            elif isinstance(action, parser.OFPActionSetField):
+                if action.key == 'mpls_label' and frame.labels:
+                    frame.labels[0] = action.value
+                elif action.key in ('eth_src', 'eth_dst'):
+                    setattr(frame, action.key, action.value)
+            elif isinstance(action, parser.OFPActionGroup):
+                for bucket in self.buckets(dp, action.group_id, frame):
+                    out.extend(self.apply(dp, in_port, frame, bucket.actions, hops, table_id))
+            elif isinstance(action, parser.OFPActionOutput):
+                out.extend(self.output(dp, in_port, frame, action.port, hops, table_id))
+        return out
+
+    def buckets(self, dp, group_id, frame):
+        ofp = ofproto_v1_3
+        if group_id not in dp.groups:
+            return []
+        (group_type, buckets) = dp.groups[group_id]
+        if group_type == ofp.OFPGT_ALL or not buckets:
+            return buckets
+        if group_type == ofp.OFPGT_SELECT:
+            total = sum(b.weight for b in buckets)
+            if total == 0:
+                return []
+            h = zlib.crc32(('%s/%s/%s' % (frame.eth_src, frame.eth_dst, frame.payload[:40]))
+                           .encode('ascii', 'replace')) % total
+            for bucket in buckets:
+                h -= bucket.weight
+                if h < 0:
+                    return [bucket]
+        if group_type == ofp.OFPGT_FF:
+            for bucket in buckets:
+                if (dp.id, bucket.watch_port) not in self.down:
+                    return [bucket]
+            return []
+        return buckets[:1]
+
+    def output(self, dp, in_port, frame, port, hops, table_id):
+        ofp = ofproto_v1_3
+        if port == ofp.OFPP_CONTROLLER:
+            self.packet_in(dp, in_port, frame, table_id)
+            return []
+        if port in (ofp.OFPP_FLOOD, ofp.OFPP_ALL):
+            ports = [p for p in dp.ports if p != in_port]
+        elif port == ofp.OFPP_IN_PORT:
+            ports = [in_port]
+        else:
+            ports = [port]
+        out = []
+        for p in ports:
+            if (dp.id, p) in self.down:
+                continue
+            if (dp.id, p) in self.links:
+                (peer, peer_port) = self.links[(dp.id, p)]
+                out.append((self.datapaths[peer], peer_port, frame.copy(), hops + 1))
+            elif (dp.id, p) in self.host_ports:
+                self.delivered[(self.host_ports[(dp.id, p)], frame.eth_src, frame.ethertype)] += 1
+        return out
+
+    def messages(self):
+        total = collections.Counter()
+        for dp in self.datapaths.values():
+            total.update(dp.msgs)
+        return total
+
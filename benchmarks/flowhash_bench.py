@@ -0,0 +1,114 @@
+"""
+Per-uplink load imbalance of the ingress label selection policies
+(first label, 5-tuple hash, flowlet) on a synthetic flow trace.
+
+    python benchmarks/flowhash_bench.py --flows 5000 --uplinks 4
+"""
+
+from __future__ import print_function
+
+import argparse
+import heapq
+import json
+import random
+
+from util import add_paths
+
+add_paths()
+
+import flowhash
+
+
+def make_trace(flows, seed, mean_flowlets, gap_prob):
+    """Returns [(start, end, key, bytes)] flowlets sorted by start time."""
+    rnd = random.Random(seed)
+    trace = []
+    for i in range(flows):
+        key = flowhash.five_tuple('10.0.%d.%d' % (i // 250, i % 250 + 1),
+                                  '10.1.%d.%d' % (rnd.randrange(16), rnd.randrange(1, 250)),
+                                  rnd.choice((flowhash.IPPROTO_TCP, flowhash.IPPROTO_UDP)),
+                                  rnd.randrange(1024, 65535), rnd.choice((80, 443, 5001)))
+        # Heavy tailed flow sizes, a few elephants carry most bytes
+        size = int(rnd.paretovariate(1.2) * 10000)
+        t = rnd.uniform(0, 100)
+        n = 1 + int(rnd.expovariate(1.0 / mean_flowlets))
+        for j in range(n):
+            duration = rnd.uniform(0.01, 0.5)
+            trace.append((t, t + duration, key, size // n))
+            # Most gaps are shorter than the idle timeout and keep the entry
+            t += duration + (rnd.uniform(1.5, 5) if rnd.random() < gap_prob else 0.01)
+    trace.sort()
+    return trace
+
+
+def merge_flowlets(trace, gap):
+    """Flowlets separated by less than gap share one switch entry."""
+    last = {}
+    merged = []
+    for (start, end, key, size) in trace:
+        if key in last and start - merged[last[key]][1] < gap:
+            entry = merged[last[key]]
+            merged[last[key]] = (entry[0], max(entry[1], end), key, entry[3] + size)
+        else:
+            last[key] = len(merged)
+            merged.append((start, end, key, size))
+    merged.sort()
+    return merged
+
+
+def simulate(trace, uplinks, policy):
+    choices = dict((21 + i, i) for i in range(uplinks))
+    selector = flowhash.PathSelector(flowlet=(policy == 'flowlet'))
+    load = [0] * uplinks
+    pending = []
+    for (start, end, key, size) in trace:
+        # Entries idled out before this packet-in report their bytes
+        while pending and pending[0][0] <= start:
+            (_, k, b) = heapq.heappop(pending)
+            selector.release(k, b)
+        if policy == 'first':
+            label = min(choices)
+        else:
+            label = selector.select(key, choices)
+        load[choices[label]] += size
+        heapq.heappush(pending, (end, key, size))
+    return load
+
+
+def imbalance(load):
+    mean = float(sum(load)) / len(load)
+    return max(load) / mean - 1 if mean else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--flows', type=int, default=5000)
+    parser.add_argument('--uplinks', type=int, default=4)
+    parser.add_argument('--flowlets', type=float, default=4.0, help='mean flowlets per flow')
+    parser.add_argument('--gap-prob', type=float, default=0.3,
+                        help='probability that a gap is longer than the idle timeout')
+    parser.add_argument('--idle-timeout', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='machine readable output')
+    args = parser.parse_args()
+
+    trace = merge_flowlets(make_trace(args.flows, args.seed, args.flowlets, args.gap_prob),
+                           args.idle_timeout)
+    results = {}
+    for policy in ('first', 'hash', 'flowlet'):
+        load = simulate(trace, args.uplinks, policy)
+        results[policy] = {'bytes_per_uplink': load, 'imbalance': imbalance(load)}
+
+    if args.json:
+        print(json.dumps({'flows': args.flows, 'entries': len(trace), 'uplinks': args.uplinks,
+                          'results': results}, sort_keys=True))
+        return
+    print('%d flows, %d switch entries, %d uplinks' % (args.flows, len(trace), args.uplinks))
+    print('%8s %10s  %s' % ('policy', 'max/mean-1', 'bytes per uplink'))
+    for policy in ('first', 'hash', 'flowlet'):
+        r = results[policy]
+        print('%8s %10.3f  %s' % (policy, r['imbalance'], r['bytes_per_uplink']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Memory, fill time and lookup rate of the label table layouts
+(controllers/labeltable.py) on the switch graph of topogen.fat_tree(k).
+
+Both tables are filled with one label per (switch, destination switch,
+next hop) of the all-pairs routes, as SimpleSwitch.compute_labels does, and
+get the root port of every pair. Memory is measured with tracemalloc, so
+Python objects and NumPy buffers count alike. Lookups are the
+select/next_hop/root_port calls of the packet-in handlers on random pairs.
+
+    python benchmarks/labeltable_bench.py -k 8 16 32
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+
+from util import add_paths
+
+add_paths()
+
+import allpairs
+import labeltable
+import topogen
+
+
+def fill(table, G, result):
+    """Fills table from the routes of every source, returns the label count
+    and the time spent in the table."""
+    label = 21
+    elapsed = 0.0
+    for src in G:
+        routes = result.routes(src)
+        start = time.time()
+        for (dst, hops) in routes.items():
+            if dst == src:
+                continue
+            paths = []
+            for (next_hop, cost) in hops:
+                paths.append((label, next_hop, cost))
+                label += 1
+            table.set_labels(src, dst, paths)
+            table.set_root_port(src, dst, G[src][hops[0][0]]['port'])
+        elapsed += time.time() - start
+    return (label - 21, elapsed)
+
+
+def lookups(table, pairs):
+    start = time.time()
+    for (src, dst) in pairs:
+        label = table.select(src, dst)
+        table.next_hop(src, dst, label)
+        table.root_port(src, dst)
+    return len(pairs) / (time.time() - start)
+
+
+def measure(cls, G, result, pairs):
+    tracemalloc.start()
+    table = cls()
+    (labels, fill_time) = fill(table, G, result)
+    # Routes of one source at most are still alive
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (labels, memory, fill_time, lookups(table, pairs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-k', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--dict-kmax', type=int, default=16,
+                        help='skip the dict layout above this k, it needs several GB at k=32')
+    parser.add_argument('--lookups', type=int, default=200000)
+    args = parser.parse_args()
+
+    print('%4s %6s %9s | %-6s %10s %8s %12s' % (
+        'k', 'nodes', 'labels', 'layout', 'memory_MB', 'fill_s', 'lookups/s'))
+    for k in args.k:
+        G = topogen.fat_tree(k).graph()
+        G.graph['version'] = 1
+        result = allpairs.AllPairs(allpairs.Snapshot(G))
+        rnd = random.Random(1)
+        nodes = sorted(G)
+        pairs = [tuple(rnd.sample(nodes, 2)) for _ in range(args.lookups)]
+
+        layouts = [('array', labeltable.ArrayLabelTable)]
+        if k <= args.dict_kmax:
+            layouts.insert(0, ('dict', labeltable.DictLabelTable))
+        for (name, cls) in layouts:
+            (labels, memory, fill_time, rate) = measure(cls, G, result, pairs)
+            print('%4d %6d %9d | %-6s %10.1f %8.2f %12.0f' % (
+                k, len(nodes), labels, name, memory / 1e6, fill_time, rate))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Packet-in header decoding rate of the previous SimpleSwitch path (one
+ryu Packet in _packet_in_handler and another one in the handler) against
+the single pass pktdecode.decode.
+
+    python benchmarks/pktdecode_bench.py -n 20000
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import time
+
+from util import add_paths
+
+add_paths()
+
+from ryu.lib.packet import arp
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import mpls
+from ryu.lib.packet import packet
+from ryu.lib.packet import tcp
+
+import pktdecode
+
+H1 = '00:00:00:00:00:01'
+H2 = '00:00:00:00:00:02'
+
+
+def serialize(*protocols):
+    pkt = packet.Packet()
+    for p in protocols:
+        pkt.add_protocol(p)
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def samples():
+    return {
+        'arp': serialize(ethernet.ethernet(dst='ff:ff:ff:ff:ff:ff', src=H1, ethertype=0x0806),
+                         arp.arp(opcode=1, src_mac=H1, src_ip='10.0.0.1',
+                                 dst_mac='00:00:00:00:00:00', dst_ip='10.0.0.2')),
+        'ipv4': serialize(ethernet.ethernet(dst=H2, src=H1, ethertype=0x0800),
+                          ipv4.ipv4(src='10.0.0.1', dst='10.0.0.2', proto=6),
+                          tcp.tcp(src_port=40000, dst_port=80)),
+        'mpls': serialize(ethernet.ethernet(dst=H2, src=H1, ethertype=0x8847),
+                          mpls.mpls(label=21, bsb=1),
+                          ipv4.ipv4(src='10.0.0.1', dst='10.0.0.2', proto=6),
+                          tcp.tcp(src_port=40000, dst_port=80)),
+    }
+
+
+def legacy(data):
+    # What _packet_in_handler and the ARP/IPv4/MPLS handlers used to do
+    pkt = packet.Packet(data)
+    eth = pkt.get_protocol(ethernet.ethernet)
+    pkt = packet.Packet(data)
+    eth = pkt.get_protocol(ethernet.ethernet)
+    return (eth.src, eth.dst, eth.ethertype, pkt.get_protocol(mpls.mpls))
+
+
+def fast(data):
+    hdr = pktdecode.decode(data)
+    return (hdr.eth_src, hdr.eth_dst, hdr.ethertype, hdr.mpls_label)
+
+
+def rate(fn, data, n):
+    start = time.time()
+    for _ in range(n):
+        fn(data)
+    return n / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=20000, help='packet-ins per measurement')
+    parser.add_argument('--json', action='store_true', help='machine readable output')
+    args = parser.parse_args()
+
+    results = {}
+    for (name, data) in sorted(samples().items()):
+        before = rate(legacy, data, args.n)
+        after = rate(fast, data, args.n)
+        results[name] = {'legacy_per_s': before, 'decode_per_s': after, 'speedup': after / before}
+
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+        return
+    print('%6s %14s %14s %8s' % ('type', 'legacy/s', 'decode/s', 'speedup'))
+    for (name, r) in sorted(results.items()):
+        print('%6s %14.0f %14.0f %7.1fx' % (name, r['legacy_per_s'], r['decode_per_s'], r['speedup']))
+
+
+if __name__ == '__main__':
+    main()
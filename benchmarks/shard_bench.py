@@ -0,0 +1,273 @@
+"""
+Packet-in throughput of SimpleSwitch sharded across 1, 2, 4 and 8
+controller processes (controllers/sharding.py), on a topogen fat tree with
+fake datapaths (fakedp.py).
+
+First all shards run in this process on one fabric with a MemoryStore:
+packet-ins go to the master of their switch, the shards poll the store
+after every event, and a stream of new flows (ARP request, ARP reply, one
+TCP packet) checks that they are delivered. The packet-ins of that run are
+recorded.
+
+Then every shard runs in its own process against a store served over a
+unix socket, converges on the topology and replays the recorded
+packet-ins of its switches. The first packet-in of every host is replayed
+and synced before the clock starts, so that no shard sees a packet of a
+host before its master published it. Throughput is reported against wall
+time, and per core against the CPU time of the busiest shard, which is
+the wall time when every shard has a core of its own.
+
+    python benchmarks/shard_bench.py -k 8 --flows 500
+    python benchmarks/shard_bench.py -k 8 --shards 1 4 --set PROACTIVE=True
+"""
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from ryu.controller import ofp_event
+from ryu.lib import hub
+
+import controller_bench
+import fakedp
+import sharding
+
+cpu_time = getattr(time, 'process_time', time.clock if hasattr(time, 'clock') else time.time)
+
+
+class ShardedFabric(fakedp.Fabric):
+    """One fabric driven by the apps of every shard. Events of a datapath go
+    to its master, switch features and topology events to every shard."""
+
+    def __init__(self, apps, topo):
+        fakedp.Fabric.__init__(self, apps[0], topo)
+        self.apps = apps
+        self.app_handlers = dict((id(app), {}) for app in apps)
+        # (dpid, in_port, frame data) of every packet-in
+        self.trace = []
+
+    def owner(self, dpid):
+        shard = self.apps[0].shard
+        return 0 if shard is None else shard.owner(dpid)
+
+    def dispatch(self, ev):
+        msg = getattr(ev, 'msg', None)
+        apps = self.apps
+        if msg is not None and not isinstance(ev, ofp_event.EventOFPSwitchFeatures):
+            apps = [self.apps[self.owner(msg.datapath.id)]]
+        count = 0
+        for app in apps:
+            self.app = app
+            self.handlers = self.app_handlers[id(app)]
+            count += fakedp.Fabric.dispatch(self, ev)
+        # Every shard polls the store
+        for app in self.apps:
+            if app.shard is not None:
+                app.sync_shard()
+        return count
+
+    def packet_in(self, dp, in_port, frame, table_id=0, reason=None):
+        self.trace.append((dp.id, in_port, frame.data()))
+        fakedp.Fabric.packet_in(self, dp, in_port, frame, table_id, reason)
+
+
+def shard_overrides(overrides, shards, shard_id, store, authkey_file=None):
+    return overrides + [('SHARDS', shards), ('SHARD_ID', shard_id), ('SHARD_STORE', store),
+                        ('SHARD_AUTHKEY_FILE', authkey_file)]
+
+
+def in_process(shards, kind, k, flows, seed, overrides):
+    """Runs the shards on one fabric, returns the results and the trace."""
+    store = sharding.MemoryStore()
+    modules = []
+    apps = []
+    for i in range(shards):
+        (module, cls, contexts) = controller_bench.load_app(
+            'simple', shard_overrides(overrides, shards, i, store))
+        modules.append(module)
+        apps.append(cls(**contexts))
+    topo = controller_bench.make_topo(kind, k)
+    fabric = ShardedFabric(apps, topo)
+    for module in modules:
+        module.get_switch = fabric.get_switch
+        module.get_link = fabric.get_link
+    fabric.connect()
+    fabric.converge('enter')
+    # The old labels of the convergence are broken, also on other shards
+    hub.sleep(modules[0].MBB_DELAY + 0.1)
+    for app in apps:
+        if app.shard is not None:
+            app.sync_shard()
+    fabric.forward()
+    setup = fabric.messages()
+    fabric.trace = []
+
+    rnd = random.Random(seed)
+    numbers = sorted(fabric.hosts)
+    delivered = 0
+    for i in range(flows):
+        (src, dst) = rnd.sample(numbers, 2)
+        delivered += controller_bench.learn(fabric, src, dst, 40000 + i % 20000)
+    msgs = fabric.messages()
+    msgs.subtract(setup)
+    stats = dict((key, sum(app.shard.stats[key] for app in apps if app.shard is not None))
+                 for key in ('published', 'forwarded'))
+    result = {
+        'delivered': float(delivered) / flows,
+        'packet_ins': len(fabric.trace),
+        'flow_mods_per_flow': float(msgs['OFPFlowMod'] + msgs['OFPGroupMod']) / flows,
+        'store_entries': len(store.table),
+        'published': stats['published'],
+        'forwarded': stats['forwarded'],
+    }
+    return (result, fabric.trace)
+
+
+def split(trace, shards):
+    """Per shard (learning, rest): the packet-ins of its switches, learning
+    holds the first packet-in of every host."""
+    ring = sharding.HashRing(range(shards))
+    seen = set()
+    out = [([], []) for _ in range(shards)]
+    for (dpid, in_port, data) in trace:
+        frame = fakedp.Frame.parse(data)
+        first = frame.ethertype == fakedp.ETH_TYPE_ARP and frame.eth_src not in seen
+        seen.add(frame.eth_src)
+        out[ring.owner(dpid) if shards > 1 else 0][0 if first else 1].append((dpid, in_port, data))
+    return out
+
+
+def worker(conn, shards, shard_id, address, authkey_file, kind, k, overrides, learning, rest):
+    (module, cls, contexts) = controller_bench.load_app(
+        'simple', shard_overrides(overrides, shards, shard_id, address, authkey_file))
+    app = cls(**contexts)
+    fabric = fakedp.Fabric(app, controller_bench.make_topo(kind, k))
+    module.get_switch = fabric.get_switch
+    module.get_link = fabric.get_link
+    fabric.connect()
+    converge = fabric.converge('enter')
+    frames = [[(fabric.datapaths[dpid], in_port, fakedp.Frame.parse(data))
+               for (dpid, in_port, data) in packet_ins] for packet_ins in (learning, rest)]
+
+    def replay(packet_ins):
+        for (dp, in_port, frame) in packet_ins:
+            fabric.packet_in(dp, in_port, frame)
+        fabric.packet_outs = []
+
+    def sync():
+        if app.shard is not None:
+            app.sync_shard()
+
+    conn.send(converge)
+    for step in (sync, lambda: replay(frames[0]), sync):
+        conn.recv()
+        step()
+        conn.send(None)
+    conn.recv()
+    start = cpu_time()
+    replay(frames[1])
+    conn.send((len(frames[1]), cpu_time() - start))
+    conn.recv()
+
+
+def multi_process(shards, kind, k, overrides, trace):
+    """Replays trace with one process per shard, returns the results."""
+    # Forked children would inherit the green threads of the in process apps
+    ctx = multiprocessing.get_context('spawn')
+    tmp = tempfile.mkdtemp()
+    address = os.path.join(tmp, 'store.sock')
+    authkey_file = os.path.join(tmp, 'authkey')
+    with open(authkey_file, 'wb') as f:
+        f.write(binascii.hexlify(os.urandom(16)))
+    server = None
+    if shards > 1:
+        server = ctx.Process(target=sharding.serve,
+                             args=(address, sharding.load_authkey(authkey_file)))
+        server.daemon = True
+        server.start()
+        while not os.path.exists(address):
+            time.sleep(0.01)
+    workers = []
+    for (i, (learning, rest)) in enumerate(split(trace, shards)):
+        (conn, child) = ctx.Pipe()
+        proc = ctx.Process(target=worker, args=(child, shards, i, address, authkey_file, kind,
+                                                k, overrides, learning, rest))
+        proc.start()
+        workers.append((proc, conn))
+
+    def step():
+        for (proc, conn) in workers:
+            conn.send(None)
+        return [conn.recv() for (proc, conn) in workers]
+
+    try:
+        converge = [conn.recv() for (proc, conn) in workers]
+        for _ in range(3):
+            step()
+        start = time.time()
+        replayed = step()
+        wall = time.time() - start
+        for (proc, conn) in workers:
+            conn.send(None)
+    finally:
+        for (proc, conn) in workers:
+            proc.join(10)
+        if server is not None:
+            server.terminate()
+        shutil.rmtree(tmp)
+
+    total = sum(n for (n, cpu) in replayed)
+    busiest = max(cpu for (n, cpu) in replayed)
+    return {
+        'converge_s': max(converge),
+        'replayed': total,
+        'per_shard': [n for (n, cpu) in replayed],
+        'packet_ins_per_s': total / wall if wall else 0.0,
+        'packet_ins_per_s_per_core': total / busiest if busiest else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-k', type=int, default=8)
+    parser.add_argument('--topo', choices=('fattree', 'leafspine', 'jellyfish'), default='fattree')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--flows', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a module constant of the app, e.g. PROACTIVE=True')
+    parser.add_argument('--json', action='store_true', help='machine readable output')
+    args = parser.parse_args()
+
+    overrides = [controller_bench.parse_override(o) for o in args.set]
+    results = []
+    if not args.json:
+        print('cores: %d' % multiprocessing.cpu_count())
+    for shards in args.shards:
+        (result, trace) = in_process(shards, args.topo, args.k, args.flows, args.seed, overrides)
+        result.update(multi_process(shards, args.topo, args.k, overrides, trace))
+        result.update({'shards': shards, 'k': args.k, 'flows': args.flows})
+        results.append(result)
+        if not args.json:
+            print('shards=%d k=%d delivered=%.0f%% flow-mods/flow=%.1f store: %d published, '
+                  '%d forwarded | converge=%.2fs pkt-in=%d (per shard %s) %.0f/s, %.0f/s per core'
+                  % (shards, args.k, result['delivered'] * 100, result['flow_mods_per_flow'],
+                     result['published'], result['forwarded'], result['converge_s'],
+                     result['replayed'], '/'.join(str(n) for n in result['per_shard']),
+                     result['packet_ins_per_s'], result['packet_ins_per_s_per_core']))
+            sys.stdout.flush()
+    if args.json:
+        print(json.dumps(results, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Helpers shared by the benchmark scripts.
+
+The controller apps and topology scripts are not importable modules (their
+file names contain dashes or start with a digit), so they are loaded by path.
+add_paths() puts controllers/ and topologies/ on sys.path for the helper
+modules, the scripts call it before importing them.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTROLLERS = os.path.join(ROOT, 'controllers')
+TOPOLOGIES = os.path.join(ROOT, 'topologies')
+
+
+def add_paths():
+    for path in (TOPOLOGIES, CONTROLLERS):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def load_source(name, path):
+    if not os.path.isabs(path):
+        path = os.path.join(ROOT, path)
+    try:
+        from importlib.util import spec_from_file_location, module_from_spec
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,115 @@
+"""
+Admission control of packet-ins on the controller side.
+
+The packet-in handler only decodes a packet-in and queues it by class. A
+green thread handles the queue in priority order and yields to the event
+loop after every packet-in, so topology, port status and stats events are
+handled ahead of a backlog instead of behind it (LLDP packet-ins go to
+ryu.topology, which has an event loop of its own).
+
+ARP goes first, then MPLS, whose flows were admitted at their ingress
+already, then IPv4, then the packet-ins of sources that are not learned
+yet: a scan or a storm from spoofed MACs only gets the capacity left over.
+Within a class the switches take turns, oldest packet-in first, as they do
+when Ryu reads their connections.
+
+The queue is bounded. When it is full a packet-in of the lowest class
+queued is dropped, the newest one of the switch with the most queued in
+that class, or the new one if its class is lower or its switch has as many
+queued. Packet-ins given a key are dropped while one with the same key is
+queued, e.g. the copies of a broadcast that reach a switch over several
+paths. Drops are counted per class and per switch.
+"""
+
+import collections
+
+# Classes in priority order, by ethertype, and the packet-ins of sources
+# that are not learned yet
+CLASSES = ('arp', 'mpls', 'ipv4', 'new')
+PRIORITY = {0x0806: 0, 0x8847: 1, 0x0800: 2}
+NEW = 3
+
+
+class PacketInQueue(object):
+    """Bounded queue of one FIFO per class and switch, the first class
+    first, its switches round robin."""
+
+    def __init__(self, capacity, classes=CLASSES):
+        self.capacity = capacity
+        self.classes = classes
+        # Per class {dpid: deque of (key, item)}, and the dpids in turn order
+        self.queues = [{} for _ in classes]
+        self.keys = set()
+        self.turns = [collections.deque() for _ in classes]
+        self.size = 0
+        self.peak = 0
+        self.queued = collections.Counter()
+        self.dropped = collections.Counter()
+        self.dropped_by_dpid = collections.Counter()
+        self.duplicates = 0
+
+    def __len__(self):
+        return self.size
+
+    def put(self, priority, dpid, item, key=None):
+        """Queues item of class priority from dpid, returns False if it
+        was dropped."""
+        if key is not None and key in self.keys:
+            self.duplicates += 1
+            return False
+        if self.size >= self.capacity:
+            lowest = max(i for (i, queues) in enumerate(self.queues) if queues)
+            queues = self.queues[lowest]
+            victim = max(queues, key=lambda d: len(queues[d]))
+            if lowest < priority or (lowest == priority and
+                                     len(queues.get(dpid, ())) >= len(queues[victim])):
+                self._drop(priority, dpid)
+                return False
+            self._pop(lowest, victim, last=True)
+            self._drop(lowest, victim)
+        queues = self.queues[priority]
+        if dpid not in queues:
+            queues[dpid] = collections.deque()
+            self.turns[priority].append(dpid)
+        queues[dpid].append((key, item))
+        if key is not None:
+            self.keys.add(key)
+        self.size += 1
+        self.peak = max(self.peak, self.size)
+        self.queued[self.classes[priority]] += 1
+        return True
+
+    def get(self):
+        """Next item of the highest class queued, None if empty."""
+        for (priority, turns) in enumerate(self.turns):
+            if turns:
+                dpid = turns.popleft()
+                item = self._pop(priority, dpid)
+                if dpid in self.queues[priority]:
+                    turns.append(dpid)
+                return item
+        return None
+
+    def _pop(self, priority, dpid, last=False):
+        queue = self.queues[priority][dpid]
+        (key, item) = queue.pop() if last else queue.popleft()
+        self.keys.discard(key)
+        if not queue:
+            del self.queues[priority][dpid]
+            if last:
+                self.turns[priority].remove(dpid)
+        self.size -= 1
+        return item
+
+    def _drop(self, priority, dpid):
+        self.dropped[self.classes[priority]] += 1
+        self.dropped_by_dpid[dpid] += 1
+
+    def stats(self):
+        return {'length': self.size,
+                'capacity': self.capacity,
+                'peak': self.peak,
+                'duplicates': self.duplicates,
+                'queued': dict((c, self.queued[c]) for c in self.classes),
+                'dropped': dict((c, self.dropped[c]) for c in self.classes),
+                'dropped_by_dpid': dict((str(d), n) for (d, n) in self.dropped_by_dpid.items())}
@@ -0,0 +1,243 @@
+"""
+Vectorised all-pairs routing backend.
+
+The controller graph is snapshotted once per topology version into CSR
+arrays (indptr/indices/weights over dense switch indices). Distances and
+ECMP next hop sets are then computed for every source in one pass:
+
+- unit costs use a level-synchronous BFS over N-bit rows, all sources at
+  once. L[t][x] is the set of nodes at distance t from x and
+  L[t][s] = OR(L[t-1][n] for n in out(s)) & ~reached[s].
+- other costs fall back to one heap based Dijkstra per source.
+
+The ECMP next hops are stored per CSR edge as a bitset over destinations:
+bit d of nh_bits[e] is set when edge e = (s, n) is the first hop of a
+shortest path from s to d. Non equal cost next hops (see kpaths.py) are
+read from the distance rows of the neighbours.
+
+IncrementalSPF takes the routes of a source as a dict of lists, and
+building those from the arrays grows with the number of next hops of every
+pair: at k = 32 and above it takes longer than the computation itself
+(see benchmarks/allpairs_bench.py). The root ports and labels are computed
+from those dicts, so a full recomputation at k = 48 is not sub-second.
+"""
+
+from heapq import heappop, heappush
+
+import numpy as np
+
+
+UNREACHABLE = np.iinfo(np.int32).max
+
+
+class Snapshot(object):
+    """CSR view of a networkx graph, neighbours are ordered by dpid."""
+
+    def __init__(self, G, weight='cost'):
+        self.version = G.graph.get('version')
+        self.nodes = sorted(G.nodes())
+        self.index = dict((n, i) for (i, n) in enumerate(self.nodes))
+        n = len(self.nodes)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indices = []
+        weights = []
+        for (i, u) in enumerate(self.nodes):
+            nbrs = sorted(G.neighbors(u))
+            indptr[i + 1] = indptr[i] + len(nbrs)
+            for v in nbrs:
+                indices.append(self.index[v])
+                weights.append(G[u][v][weight])
+        self.indptr = indptr
+        self.indices = np.array(indices, dtype=np.int64)
+        self.weights = np.array(weights, dtype=np.int64)
+        # Source index of every edge
+        self.sources = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+        self.words = (n + 63) // 64
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def unit_cost(self):
+        return bool(np.all(self.weights == 1))
+
+
+def _unpack(bits, n):
+    """Unpacks rows of uint64 bitsets into an (rows, n) boolean array."""
+    return np.unpackbits(bits.view(np.uint8), axis=1, bitorder='little')[:, :n].astype(bool)
+
+
+def _pack(mask, words):
+    """Packs an (rows, n) boolean array into rows of uint64 bitsets."""
+    rows, n = mask.shape
+    padded = np.zeros((rows, words * 64), dtype=bool)
+    padded[:, :n] = mask
+    return np.packbits(padded, axis=1, bitorder='little').view(np.uint64)
+
+
+def _or_neighbours(snap, rows):
+    """OR of rows[n] over the out-neighbours n of every node."""
+    out = np.zeros_like(rows)
+    deg = np.diff(snap.indptr)
+    nonempty = np.nonzero(deg)[0]
+    if len(nonempty):
+        gathered = rows[snap.indices]
+        out[nonempty] = np.bitwise_or.reduceat(gathered, snap.indptr[nonempty], axis=0)
+    return out
+
+
+def _bfs(snap):
+    n, words = len(snap), snap.words
+    dist = np.full((n, n), UNREACHABLE, dtype=np.int32)
+    nh_bits = np.zeros((len(snap.indices), words), dtype=np.uint64)
+
+    level = np.zeros((n, words), dtype=np.uint64)
+    diag = np.arange(n)
+    level.view(np.uint8)[diag, diag // 8] = (1 << (diag % 8)).astype(np.uint8)
+    reached = level.copy()
+    dist[diag, diag] = 0
+
+    t = 0
+    while True:
+        t += 1
+        nxt = _or_neighbours(snap, level) & ~reached
+        if not nxt.any():
+            break
+        # Edge (s, n) is a first hop towards d when dist(s, d) = t and dist(n, d) = t - 1
+        nh_bits |= nxt[snap.sources] & level[snap.indices]
+        dist[_unpack(nxt, n)] = t
+        reached |= nxt
+        level = nxt
+    return dist, nh_bits
+
+
+def _dijkstra(snap):
+    n = len(snap)
+    dist = np.full((n, n), UNREACHABLE, dtype=np.int32)
+    indptr, indices, weights = snap.indptr.tolist(), snap.indices.tolist(), snap.weights.tolist()
+    for s in range(n):
+        row = {s: 0}
+        done = set()
+        heap = [(0, s)]
+        while heap:
+            (cost, u) = heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                c = cost + weights[e]
+                if v not in row or c < row[v]:
+                    row[v] = c
+                    heappush(heap, (c, v))
+        dist[s, list(row.keys())] = list(row.values())
+
+    nh_bits = np.zeros((len(snap.indices), snap.words), dtype=np.uint64)
+    chunk = 4096
+    for start in range(0, len(snap.indices), chunk):
+        src = snap.sources[start:start + chunk]
+        nbr = snap.indices[start:start + chunk]
+        w = snap.weights[start:start + chunk]
+        ds = dist[src].astype(np.int64)
+        dn = dist[nbr].astype(np.int64)
+        mask = (dn != UNREACHABLE) & (dn + w[:, None] == ds)
+        nh_bits[start:start + chunk] = _pack(mask, snap.words)
+    return dist, nh_bits
+
+
+class AllPairs(object):
+    """Distances and ECMP next hops of every switch pair for one snapshot."""
+
+    def __init__(self, snap):
+        self.snap = snap
+        if snap.unit_cost():
+            self.dist, self.nh_bits = _bfs(snap)
+        else:
+            self.dist, self.nh_bits = _dijkstra(snap)
+
+    @property
+    def version(self):
+        return self.snap.version
+
+    def distance(self, src, dst):
+        d = self.dist[self.snap.index[src], self.snap.index[dst]]
+        if d == UNREACHABLE:
+            return None
+        return int(d)
+
+    def next_hops(self, src, dst):
+        snap = self.snap
+        s, d = snap.index[src], snap.index[dst]
+        lo, hi = snap.indptr[s], snap.indptr[s + 1]
+        byte = self.nh_bits[lo:hi].view(np.uint8)[:, d // 8]
+        hit = (byte >> (d % 8)) & 1
+        return [snap.nodes[i] for i in snap.indices[lo:hi][hit.astype(bool)]]
+
+    def routes(self, src, k=1, stretch=0.0):
+        """Returns {dst: [(next_hop, cost), ...]} like ecmp.dijsktra, or like
+        kpaths.bounded when k > 1."""
+        if k > 1:
+            return self.bounded_routes(src, k, stretch)
+        snap = self.snap
+        s = snap.index[src]
+        lo, hi = snap.indptr[s], snap.indptr[s + 1]
+        routes = {src: [(src, 0)]}
+        if lo == hi:
+            return routes
+        mask = _unpack(self.nh_bits[lo:hi], len(snap))
+        # (destination, neighbour) pairs ordered by destination, then dpid
+        (dsts, hops) = np.nonzero(mask.T)
+        nodes = snap.nodes
+        nbrs = [nodes[i] for i in snap.indices[lo:hi].tolist()]
+        for (d, j, cost) in zip(dsts.tolist(), hops.tolist(), self.dist[s][dsts].tolist()):
+            dst = nodes[d]
+            if dst in routes:
+                routes[dst].append((nbrs[j], cost))
+            else:
+                routes[dst] = [(nbrs[j], cost)]
+        return routes
+
+    def bounded_routes(self, src, k, stretch):
+        snap = self.snap
+        s = snap.index[src]
+        lo, hi = snap.indptr[s], snap.indptr[s + 1]
+        routes = {src: [(src, 0)]}
+        if lo == hi:
+            return routes
+        row = self.dist[s].astype(np.int64)
+        dn = self.dist[snap.indices[lo:hi]].astype(np.int64)
+        cost = dn + snap.weights[lo:hi][:, None]
+        back = dn[:, s][:, None]
+        # Loop-free alternates within the stretch, see kpaths.py
+        ok = ((dn != UNREACHABLE) & (back != UNREACHABLE) & (dn < back + row) &
+              (cost <= row * (1.0 + stretch)))
+        ok[:, s] = False
+        masked = np.where(ok, cost, np.iinfo(np.int64).max)
+        # Stable, equal costs stay in dpid order
+        order = np.argsort(masked, axis=0, kind='stable')
+        keep = np.minimum(ok.sum(axis=0), np.maximum(k, (ok & (cost == row)).sum(axis=0)))
+        nbrs = [snap.nodes[i] for i in snap.indices[lo:hi]]
+        order_t = order.T.tolist()
+        cost_t = np.take_along_axis(cost, order, axis=0).T.tolist()
+        for d in np.nonzero(keep)[0].tolist():
+            routes[snap.nodes[d]] = [(nbrs[j], c) for (j, c) in
+                                     zip(order_t[d][:keep[d]], cost_t[d][:keep[d]])]
+        return routes
+
+
+class AllPairsBackend(object):
+    """route_fn for IncrementalSPF, recomputes once per graph version."""
+
+    def __init__(self, weight='cost', k=1, stretch=0.0):
+        self.weight = weight
+        self.k = k
+        self.stretch = stretch
+        self.result = None
+
+    def compute(self, G):
+        version = G.graph.get('version')
+        if self.result is None or version is None or self.result.version != version:
+            self.result = AllPairs(Snapshot(G, self.weight))
+        return self.result
+
+    def __call__(self, G, source_node):
+        return self.compute(G).routes(source_node, self.k, self.stretch)
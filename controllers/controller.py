@@ -22,12 +22,20 @@ from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
 
+# Idle timeout in seconds of the learned entries, 0 keeps them until the
+# table is full. Entries with a timeout are installed with
+# OFPFF_SEND_FLOW_REM, the MAC of a source is forgotten at a switch once
+# its last entry there is removed.
+IDLE_TIMEOUT = 60
+
 class SimpleSwitch13(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def __init__(self, *args, **kwargs):
         super(SimpleSwitch13, self).__init__(*args, **kwargs)
         self.mac_to_port = {}
+        # dpid -> {src: set of (in_port, dst)} of the installed entries
+        self.learned = {}
 
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -48,21 +56,42 @@ class SimpleSwitch13(app_manager.RyuApp):
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None, idle_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
                                              actions)]
+        flags = 0
+        if idle_timeout:
+            flags = ofproto.OFPFF_SEND_FLOW_REM
+            src = match.get('eth_src')
+            entries = self.learned.setdefault(datapath.id, {}).setdefault(src, set())
+            entries.add((match.get('in_port'), match.get('eth_dst')))
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
                                     priority=priority, match=match,
-                                    instructions=inst)
+                                    instructions=inst, idle_timeout=idle_timeout,
+                                    flags=flags)
         else:
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    match=match, instructions=inst)
+                                    match=match, instructions=inst,
+                                    idle_timeout=idle_timeout, flags=flags)
         datapath.send_msg(mod)
 
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        src = msg.match.get('eth_src')
+        entries = self.learned.get(dpid, {}).get(src)
+        if entries is None:
+            return
+        entries.discard((msg.match.get('in_port'), msg.match.get('eth_dst')))
+        if not entries:
+            del self.learned[dpid][src]
+            self.mac_to_port[dpid].pop(src, None)
+
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
         # If you hit this you might want to increase
@@ -112,10 +141,10 @@ class SimpleSwitch13(app_manager.RyuApp):
             # verify if we have a valid buffer_id, if yes avoid to send both
             # flow_mod & packet_out
             if msg.buffer_id != ofproto.OFP_NO_BUFFER:
-                self.add_flow(datapath, 1, match, actions, msg.buffer_id)
+                self.add_flow(datapath, 1, match, actions, msg.buffer_id, IDLE_TIMEOUT)
                 return
             else:
-                self.add_flow(datapath, 1, match, actions)
+                self.add_flow(datapath, 1, match, actions, idle_timeout=IDLE_TIMEOUT)
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
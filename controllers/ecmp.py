@@ -0,0 +1,63 @@
+"""
+Shortest path DAG computation for equal cost multipath routing.
+
+The DAG is built with a single Dijkstra run per source: every node is pushed
+on the heap only when its distance strictly improves, so the heap is bounded
+by the number of links and not by the number of equal cost paths. First hops
+and path counts are then propagated along the DAG in settling order.
+Link costs are expected to be positive.
+"""
+
+from heapq import heappop, heappush
+
+
+def shortest_path_dag(G, source_node, weight='cost'):
+    """Returns (dist, preds, first_hops) for source_node.
+
+    dist[n] is the shortest distance to n, preds[n] the list of DAG
+    predecessors of n and first_hops[n] a {next_hop: path_count} dict.
+    """
+    dist = {source_node: 0}
+    preds = {source_node: []}
+    order = []
+    done = set()
+    heap = [(0, source_node)]
+
+    while heap:
+        (cost, node) = heappop(heap)
+        if node in done:
+            continue
+        done.add(node)
+        order.append(node)
+        for n in G.neighbors(node):
+            c = cost + G[node][n][weight]
+            if n not in dist or c < dist[n]:
+                dist[n] = c
+                preds[n] = [node]
+                heappush(heap, (c, n))
+            elif c == dist[n] and n not in done:
+                preds[n].append(node)
+
+    first_hops = {source_node: {}}
+    for node in order[1:]:
+        hops = {}
+        for p in preds[node]:
+            if p == source_node:
+                hops[node] = hops.get(node, 0) + 1
+                continue
+            for (nh, count) in first_hops[p].items():
+                hops[nh] = hops.get(nh, 0) + count
+        first_hops[node] = hops
+
+    return dist, preds, first_hops
+
+
+def dijsktra(G, source_node):
+    """Returns {dst: [(next_hop, cost), ...]} with one entry per distinct first hop."""
+    dist, preds, first_hops = shortest_path_dag(G, source_node)
+    routes = {source_node: [(source_node, 0)]}
+    for dst in first_hops:
+        if dst == source_node:
+            continue
+        routes[dst] = [(nh, dist[dst]) for nh in sorted(first_hops[dst])]
+    return routes
@@ -0,0 +1,109 @@
+"""
+Per-flow path selection at the ingress LER.
+
+Flows are identified by their IPv4 5-tuple. A new flow is mapped to one of
+the labels of its (ingress, egress) switch pair with rendezvous hashing: a
+flow keeps its label as long as that label exists, and only the flows of a
+removed label move.
+
+In flowlet mode a flow that comes back after its entry idled out (the idle
+timeout is the flowlet gap) is moved to the least loaded uplink instead.
+This cannot reorder packets, the previous flowlet has drained by then.
+"""
+
+from collections import OrderedDict
+import zlib
+
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+
+def five_tuple(src, dst, proto, sport=0, dport=0):
+    if proto not in (IPPROTO_TCP, IPPROTO_UDP):
+        sport = dport = 0
+    return (src, dst, proto, sport, dport)
+
+
+def match_fields(key):
+    """OFPMatch keyword arguments matching the 5-tuple key."""
+    (src, dst, proto, sport, dport) = key
+    fields = {'eth_type': 0x0800, 'ipv4_src': src, 'ipv4_dst': dst, 'ip_proto': proto}
+    if proto == IPPROTO_TCP:
+        fields.update(tcp_src=sport, tcp_dst=dport)
+    elif proto == IPPROTO_UDP:
+        fields.update(udp_src=sport, udp_dst=dport)
+    return fields
+
+
+def match_key(match):
+    """5-tuple key of an OFPMatch built from match_fields, None otherwise."""
+    if 'ipv4_src' not in match or 'ip_proto' not in match:
+        return None
+    proto = match['ip_proto']
+    if proto == IPPROTO_TCP:
+        return five_tuple(match['ipv4_src'], match['ipv4_dst'], proto,
+                          match['tcp_src'], match['tcp_dst'])
+    if proto == IPPROTO_UDP:
+        return five_tuple(match['ipv4_src'], match['ipv4_dst'], proto,
+                          match['udp_src'], match['udp_dst'])
+    return five_tuple(match['ipv4_src'], match['ipv4_dst'], proto)
+
+
+def score(key, label):
+    return zlib.crc32(('%s/%s' % (key, label)).encode('ascii'))
+
+
+def rendezvous(key, labels):
+    """The label with the highest hash score for key."""
+    return max(labels, key=lambda label: (score(key, label), label))
+
+
+class PathSelector(object):
+
+    def __init__(self, flowlet=False, max_flows=65536):
+        self.flowlet = flowlet
+        self.max_flows = max_flows
+        # key -> (label, uplink, active) of the current or last flowlet
+        self.flows = OrderedDict()
+        self.active = {}
+        self.bytes = {}
+
+    def load(self, uplink):
+        return (self.active.get(uplink, 0), self.bytes.get(uplink, 0))
+
+    def select(self, key, choices):
+        """Returns the label of flow key, choices is {label: uplink}."""
+        labels = sorted(choices)
+        entry = self.flows.get(key)
+        if entry is not None and entry[2] and entry[0] in choices:
+            # The entry of the flow is still installed, e.g. this packet was
+            # queued before it, the flow keeps its label
+            return entry[0]
+        if key in self.flows:
+            if self.flowlet:
+                # New flowlet of a known flow, ties are broken by the hash
+                label = min(labels, key=lambda l: (self.load(choices[l]), -score(key, l)))
+            else:
+                label = rendezvous(key, labels)
+            self.release(key, forget=True)
+        else:
+            label = rendezvous(key, labels)
+        self.flows[key] = (label, choices[label], True)
+        self.active[choices[label]] = self.active.get(choices[label], 0) + 1
+        while len(self.flows) > self.max_flows:
+            self.release(next(iter(self.flows)), forget=True)
+        return label
+
+    def release(self, key, byte_count=0, forget=False):
+        """The entry of flow key was removed (idle timeout or eviction)."""
+        if key not in self.flows:
+            return
+        (label, uplink, active) = self.flows[key]
+        if active:
+            self.active[uplink] -= 1
+        self.bytes[uplink] = self.bytes.get(uplink, 0) + byte_count
+        if forget or not self.flowlet:
+            del self.flows[key]
+        else:
+            self.flows[key] = (label, uplink, False)
@@ -0,0 +1,75 @@
+"""
+Bounded stretch multipath routes.
+
+With hop-by-hop label swapping a label can only pin the first hop of a
+path, every switch after it forwards on its own label towards the
+destination. The paths a source can offer are therefore one per next hop
+n, of cost cost(s, n) + dist(n, d). A next hop is kept when its path is at
+most (1 + stretch) times the shortest and when the shortest path from n
+does not come back through s, dist(n, d) < dist(n, s) + dist(s, d) (the
+loop-free alternate condition of RFC 5286).
+
+Only a path whose switches after n stay on their shortest paths is loop
+free. Next hops strictly closer to d than s (downstream()) can be mixed
+freely along a path, e.g. by the groups of every switch.
+
+Routes keep the {dst: [(next_hop, cost), ...]} shape of ecmp.dijsktra,
+cheapest first. The equal cost next hops are always kept, the others fill
+the list up to k entries.
+"""
+
+import ecmp
+
+
+def bounded(own, neighbours, src, k, stretch):
+    """own is {dst: dist} of src, neighbours [(next_hop, link cost,
+    {dst: dist of next_hop})] in dpid order."""
+    candidates = {}
+    for (n, w, dist) in neighbours:
+        back = dist.get(src)
+        for (d, c) in dist.items():
+            best = own.get(d)
+            if d == src or best is None or back is None or c >= back + best:
+                continue
+            if w + c <= best * (1.0 + stretch):
+                candidates.setdefault(d, []).append((w + c, n))
+
+    routes = {src: [(src, 0)]}
+    for (d, paths) in candidates.items():
+        # sort() is stable, equal costs stay in dpid order
+        paths.sort(key=lambda p: p[0])
+        equal = sum(1 for (c, n) in paths if c == own[d])
+        routes[d] = [(n, c) for (c, n) in paths[:max(k, equal)]]
+    return routes
+
+
+def downstream(cost, link_cost, best):
+    """Whether the next hop of a path of cost over a link of link_cost is
+    closer to the destination than the source, best away from it."""
+    return cost - link_cost < best
+
+
+class KPathsBackend(object):
+    """route_fn for IncrementalSPF on top of the shortest path DAG, the
+    distances of every node are cached per graph version."""
+
+    def __init__(self, k, stretch, weight='cost'):
+        self.k = k
+        self.stretch = stretch
+        self.weight = weight
+        self.version = None
+        self.dists = {}
+
+    def dist(self, G, node):
+        version = G.graph.get('version')
+        if version is None or version != self.version:
+            self.version = version
+            self.dists = {}
+        if node not in self.dists:
+            self.dists[node] = ecmp.shortest_path_dag(G, node, self.weight)[0]
+        return self.dists[node]
+
+    def __call__(self, G, source_node):
+        neighbours = [(n, G[source_node][n][self.weight], self.dist(G, n))
+                      for n in sorted(G.neighbors(source_node))]
+        return bounded(self.dist(G, source_node), neighbours, source_node, self.k, self.stretch)
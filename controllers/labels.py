@@ -0,0 +1,76 @@
+"""
+Global MPLS label allocation.
+
+Labels are unique across the fabric instead of per source switch, so a
+label value identifies one (src, dst, next_hop) path everywhere. A released
+label is held back for `hold` seconds before it can be handed out again,
+so that no entry still matching or pushing it can carry traffic of an
+unrelated path.
+"""
+
+from collections import deque
+import time
+
+
+FIRST_LABEL = 21
+# MPLS labels are 20 bits wide
+LAST_LABEL = (1 << 20) - 1
+
+
+class LabelSpaceExhausted(Exception):
+    pass
+
+
+class LabelAllocator(object):
+
+    def __init__(self, first=FIRST_LABEL, last=LAST_LABEL, hold=30, clock=time.time):
+        self.first = first
+        self.next = first
+        self.last = last
+        self.hold = hold
+        self.clock = clock
+        self.free = deque()
+        # (reclaim time, label) in release order
+        self.draining = deque()
+        self.in_use = set()
+
+    def reclaim(self, now=None):
+        if now is None:
+            now = self.clock()
+        while self.draining and self.draining[0][0] <= now:
+            self.free.append(self.draining.popleft()[1])
+
+    def allocate(self):
+        self.reclaim()
+        if self.free:
+            label = self.free.popleft()
+        elif self.next <= self.last:
+            label = self.next
+            self.next += 1
+        else:
+            raise LabelSpaceExhausted()
+        self.in_use.add(label)
+        return label
+
+    def release(self, label):
+        if label not in self.in_use:
+            return
+        self.in_use.discard(label)
+        self.draining.append((self.clock() + self.hold, label))
+
+    def restore(self, next_label, in_use, draining=()):
+        """Resumes the allocation of a snapshot. The draining labels may
+        still be matched by entries on the switches and are held again, the
+        other labels below next_label are free."""
+        self.in_use = set(in_use)
+        draining = sorted(set(draining) - self.in_use)
+        until = self.clock() + self.hold
+        self.draining = deque((until, label) for label in draining)
+        self.next = max(next_label, self.first)
+        held = self.in_use.union(draining)
+        self.free = deque(label for label in range(self.first, self.next) if label not in held)
+
+    def stats(self):
+        return {'in_use': len(self.in_use),
+                'draining': len(self.draining),
+                'free': len(self.free) + self.last - self.next + 1}
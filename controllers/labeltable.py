@@ -0,0 +1,249 @@
+"""
+Label and root port tables of the label switching controller.
+
+For every (switch, destination switch) pair the controller keeps labels,
+one per next hop with the cost of its path, and the root port used by the
+ARP flood entries. Two layouts share one interface:
+
+- DictLabelTable, nested dicts {src: {dst: {label: {'next_hop', 'cost'}}}}
+  and {sw: {dst: port}}, one small dict per label.
+- ArrayLabelTable, NumPy arrays over dense switch indices. Labels are
+  allocated fabric wide and densely (labels.py), so the next hop and cost of
+  a label sit in a structured array indexed by the label itself, chained
+  per pair in label order and tagged with the pair owning it. N x N arrays
+  hold the head of each chain, the selected label and the root port, so
+  select() and next_hop() are O(1).
+
+Labels are listed as (label, next_hop, cost) tuples in label order.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _cheapest(paths):
+    return min(paths, key=lambda p: (p[2], p[0]))[0]
+
+
+class DictLabelTable(object):
+
+    def __init__(self):
+        self.switch_to_label = {}
+        self.switch_to_port = {}
+
+    def set_labels(self, src, dst, paths):
+        self.switch_to_label.setdefault(src, {})[dst] = dict(
+            (label, {'next_hop': nh, 'cost': cost}) for (label, nh, cost) in paths)
+
+    def pop_labels(self, src, dst):
+        old = self.switch_to_label.get(src, {}).pop(dst, {})
+        return [(label, v['next_hop'], v['cost']) for (label, v) in sorted(old.items())]
+
+    def labels(self, src, dst):
+        labels = self.switch_to_label.get(src, {}).get(dst, {})
+        return [(label, v['next_hop'], v['cost']) for (label, v) in sorted(labels.items())]
+
+    def has_labels(self, src, dst):
+        return bool(self.switch_to_label.get(src, {}).get(dst))
+
+    def select(self, src, dst):
+        """The cheapest label, the smallest of equal cost ones."""
+        labels = self.switch_to_label.get(src, {}).get(dst)
+        if not labels:
+            return None
+        return min(labels, key=lambda l: (labels[l]['cost'], l))
+
+    def next_hop(self, src, dst, label):
+        return self.switch_to_label[src][dst][label]['next_hop']
+
+    def destinations(self, src):
+        return [dst for (dst, labels) in self.switch_to_label.get(src, {}).items() if labels]
+
+    def remove_source(self, src):
+        """Drops the labels of src, returns them as (label, next_hop)."""
+        retired = []
+        for labels in self.switch_to_label.pop(src, {}).values():
+            retired.extend((label, v['next_hop']) for (label, v) in labels.items())
+        return retired
+
+    def count(self):
+        return sum(len(labels) for dsts in self.switch_to_label.values()
+                   for labels in dsts.values())
+
+    def root_port(self, sw, dst):
+        return self.switch_to_port.get(sw, {}).get(dst)
+
+    def set_root_port(self, sw, dst, port):
+        self.switch_to_port.setdefault(sw, {})[dst] = port
+
+    def pop_root_port(self, sw, dst):
+        self.switch_to_port.get(sw, {}).pop(dst, None)
+
+    def root_ports(self):
+        """(sw, dst, port) of every root port."""
+        for (sw, ports) in self.switch_to_port.items():
+            for (dst, port) in ports.items():
+                yield (sw, dst, port)
+
+    def remove_ports(self, dpid):
+        """Drops the root ports of dpid and towards dpid."""
+        self.switch_to_port.pop(dpid, None)
+        for sw in self.switch_to_port:
+            self.switch_to_port[sw].pop(dpid, None)
+
+
+if np is not None:
+    ENTRY = np.dtype([('next_hop', np.int32), ('cost', np.int32), ('chain', np.int32),
+                      ('src', np.int32), ('dst', np.int32)])
+
+
+class ArrayLabelTable(object):
+
+    def __init__(self, switches=64, labels=1024):
+        self.index = {}
+        self.nodes = []
+        # Head of the label chain, selected label and root port per pair,
+        # 0 for none. Labels start above 0 (labels.FIRST_LABEL).
+        self.head = np.zeros((switches, switches), dtype=np.int32)
+        self.best = np.zeros((switches, switches), dtype=np.int32)
+        self.root = np.zeros((switches, switches), dtype=np.uint32)
+        # Indexed by label: dense index of the next hop, path cost, the
+        # next label of the same pair and the pair, src -1 for unused labels
+        self.entries = self._entries(labels)
+        self.total = 0
+
+    @staticmethod
+    def _entries(n):
+        entries = np.zeros(n, dtype=ENTRY)
+        entries['src'] = -1
+        entries['dst'] = -1
+        return entries
+
+    def _index(self, dpid):
+        i = self.index.get(dpid)
+        if i is not None:
+            return i
+        i = self.index[dpid] = len(self.nodes)
+        self.nodes.append(dpid)
+        size = self.head.shape[0]
+        if i >= size:
+            for name in ('head', 'best', 'root'):
+                old = getattr(self, name)
+                new = np.zeros((2 * size, 2 * size), dtype=old.dtype)
+                new[:size, :size] = old
+                setattr(self, name, new)
+        return i
+
+    def _pair(self, src, dst):
+        return (self.index.get(src), self.index.get(dst))
+
+    def set_labels(self, src, dst, paths):
+        self.pop_labels(src, dst)
+        if not paths:
+            return
+        (s, d) = (self._index(src), self._index(dst))
+        top = max(label for (label, nh, cost) in paths)
+        if top >= len(self.entries):
+            entries = self._entries(max(2 * len(self.entries), top + 1))
+            entries[:len(self.entries)] = self.entries
+            self.entries = entries
+        head = 0
+        for (label, nh, cost) in sorted(paths, reverse=True):
+            self.entries[label] = (self._index(nh), cost, head, s, d)
+            head = label
+        self.head[s, d] = head
+        self.best[s, d] = _cheapest(paths)
+        self.total += len(paths)
+
+    def pop_labels(self, src, dst):
+        (s, d) = self._pair(src, dst)
+        if s is None or d is None:
+            return []
+        old = self.labels(src, dst)
+        if not old:
+            return old
+        for (label, nh, cost) in old:
+            self.entries[label]['src'] = -1
+        self.head[s, d] = 0
+        self.best[s, d] = 0
+        self.total -= len(old)
+        return old
+
+    def labels(self, src, dst):
+        (s, d) = self._pair(src, dst)
+        if s is None or d is None:
+            return []
+        out = []
+        label = int(self.head[s, d])
+        while label:
+            (nh, cost, chain, _, _) = self.entries.item(label)
+            out.append((label, self.nodes[nh], cost))
+            label = chain
+        return out
+
+    def has_labels(self, src, dst):
+        (s, d) = self._pair(src, dst)
+        return s is not None and d is not None and bool(self.head[s, d])
+
+    def select(self, src, dst):
+        (s, d) = self._pair(src, dst)
+        if s is None or d is None:
+            return None
+        return int(self.best[s, d]) or None
+
+    def next_hop(self, src, dst, label):
+        # KeyError for a label that is not one of (src, dst), like the dicts
+        if not 0 < label < len(self.entries):
+            raise KeyError(label)
+        (nh, cost, chain, s, d) = self.entries.item(label)
+        if s < 0 or self.nodes[s] != src or self.nodes[d] != dst:
+            raise KeyError(label)
+        return self.nodes[nh]
+
+    def destinations(self, src):
+        s = self.index.get(src)
+        if s is None:
+            return []
+        return [self.nodes[d] for d in np.nonzero(self.head[s, :len(self.nodes)])[0]]
+
+    def remove_source(self, src):
+        retired = []
+        for dst in self.destinations(src):
+            retired.extend((label, nh) for (label, nh, cost) in self.pop_labels(src, dst))
+        return retired
+
+    def count(self):
+        return self.total
+
+    def root_port(self, sw, dst):
+        (s, d) = self._pair(sw, dst)
+        if s is None or d is None:
+            return None
+        return int(self.root[s, d]) or None
+
+    def set_root_port(self, sw, dst, port):
+        # The indices first, they may grow the arrays
+        (s, d) = (self._index(sw), self._index(dst))
+        self.root[s, d] = port
+
+    def pop_root_port(self, sw, dst):
+        (s, d) = self._pair(sw, dst)
+        if s is not None and d is not None:
+            self.root[s, d] = 0
+
+    def root_ports(self):
+        n = len(self.nodes)
+        (s, d) = np.nonzero(self.root[:n, :n])
+        for (i, j, port) in zip(s.tolist(), d.tolist(), self.root[s, d].tolist()):
+            yield (self.nodes[i], self.nodes[j], port)
+
+    def remove_ports(self, dpid):
+        i = self.index.get(dpid)
+        if i is not None:
+            self.root[i, :] = 0
+            self.root[:, i] = 0
+
+    def nbytes(self):
+        return self.head.nbytes + self.best.nbytes + self.root.nbytes + self.entries.nbytes
@@ -0,0 +1,78 @@
+"""
+Congestion aware link costs.
+
+Port counters polled with OFPPortStatsRequest are turned into a smoothed
+(EWMA) transmit utilisation per (dpid, port), and the utilisation into one
+of a few discrete link costs. A link moves up a cost level as soon as its
+utilisation crosses the level threshold, and only moves back down once it
+is `hysteresis` below it, so a link hovering around a threshold does not
+make the routes flap.
+"""
+
+
+# (utilisation threshold, cost) in increasing order, links below the first
+# threshold cost 1
+LEVELS = ((0.5, 2), (0.8, 4))
+
+
+class LinkCosts(object):
+
+    def __init__(self, levels=LEVELS, alpha=0.5, hysteresis=0.1, capacity=10 ** 9):
+        self.levels = levels
+        # EWMA weight of the newest sample
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+        # Link speed in bit/s used when the port does not report one
+        self.capacity = capacity
+        self.speed = {}
+        # (dpid, port) -> (tx_bytes, time) of the previous sample
+        self.samples = {}
+        self.util = {}
+        self.level = {}
+
+    def set_speed(self, dpid, port, bps):
+        if bps:
+            self.speed[(dpid, port)] = bps
+
+    def cost(self, dpid, port):
+        level = self.level.get((dpid, port), 0)
+        if level == 0:
+            return 1
+        return self.levels[level - 1][1]
+
+    def next_level(self, util, level):
+        while level < len(self.levels) and util >= self.levels[level][0]:
+            level += 1
+        while level > 0 and util < self.levels[level - 1][0] - self.hysteresis:
+            level -= 1
+        return level
+
+    def update(self, dpid, port, tx_bytes, now):
+        """Adds a counter sample, returns the new cost of the port if it changed."""
+        key = (dpid, port)
+        last = self.samples.get(key)
+        self.samples[key] = (tx_bytes, now)
+        if last is None or now <= last[1] or tx_bytes < last[0]:
+            # First sample or counter reset
+            return None
+        rate = (tx_bytes - last[0]) * 8.0 / (now - last[1])
+        util = rate / self.speed.get(key, self.capacity)
+        if key in self.util:
+            util = self.alpha * util + (1 - self.alpha) * self.util[key]
+        self.util[key] = util
+
+        old = self.level.get(key, 0)
+        level = self.next_level(util, old)
+        if level == old:
+            return None
+        self.level[key] = level
+        return self.cost(dpid, port)
+
+    def forget(self, dpid):
+        for table in (self.samples, self.util, self.level, self.speed):
+            for key in [k for k in table if k[0] == dpid]:
+                del table[key]
+
+    def stats(self):
+        return [{'dpid': dpid, 'port': port, 'util': self.util[(dpid, port)],
+                 'cost': self.cost(dpid, port)} for (dpid, port) in sorted(self.util)]
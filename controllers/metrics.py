@@ -0,0 +1,153 @@
+"""
+Controller metrics, served as JSON and in the Prometheus text format.
+
+Counters and latency histograms are plain dicts updated in the event loop,
+a packet-in costs a dict increment and two clock reads. Gauges are
+callbacks that are only evaluated when the metrics are scraped.
+"""
+
+import functools
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(upper bound, count of values <= bound)], +Inf last."""
+        out = []
+        total = 0
+        for (bound, n) in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            out.append((bound, total))
+        return out
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'buckets': dict(('+Inf' if b == float('inf') else repr(b), n)
+                                for (b, n) in self.cumulative())}
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, v) for (k, v) in labels)
+
+
+class Metrics(object):
+
+    def __init__(self, prefix='simpleswitch'):
+        self.prefix = prefix
+        # (name, ((label, value), ...)) -> value
+        self.counters = {}
+        self.histograms = {}
+        # name -> (kind, callback), see gauge()
+        self.gauges = {}
+        self.help = {}
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def gauge(self, name, text, callback, kind='gauge'):
+        """callback() returns a number or {labels: number}. kind 'counter'
+        exposes counters kept elsewhere, e.g. by Southbound."""
+        self.gauges[name] = (kind, callback)
+        self.help[name] = text
+
+    def _gauge_values(self, name):
+        values = self.gauges[name][1]()
+        if isinstance(values, dict):
+            return sorted(values.items())
+        return [((), values)]
+
+    def to_dict(self):
+        out = {}
+        for ((name, labels), value) in self.counters.items():
+            out.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for ((name, labels), hist) in self.histograms.items():
+            entry = hist.to_dict()
+            entry['labels'] = dict(labels)
+            out.setdefault(name, []).append(entry)
+        for name in self.gauges:
+            out[name] = [{'labels': dict(labels), 'value': value}
+                         for (labels, value) in self._gauge_values(name)]
+        return out
+
+    def prometheus(self):
+        lines = []
+
+        def header(name, kind):
+            full = '%s_%s' % (self.prefix, name)
+            if name in self.help:
+                lines.append('# HELP %s %s' % (full, self.help[name]))
+            lines.append('# TYPE %s %s' % (full, kind))
+            return full
+
+        for name in sorted(set(n for (n, _) in self.counters)):
+            full = header(name, 'counter')
+            for ((n, labels), value) in sorted(self.counters.items()):
+                if n == name:
+                    lines.append('%s%s %s' % (full, _labels(labels), value))
+        for name in sorted(set(n for (n, _) in self.histograms)):
+            full = header(name, 'histogram')
+            for ((n, labels), hist) in sorted(self.histograms.items(), key=lambda i: i[0]):
+                if n != name:
+                    continue
+                for (bound, count) in hist.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket%s %d' % (full, _labels(labels + (('le', le),)), count))
+                lines.append('%s_sum%s %r' % (full, _labels(labels), hist.sum))
+                lines.append('%s_count%s %d' % (full, _labels(labels), hist.count))
+        for name in sorted(self.gauges):
+            full = header(name, self.gauges[name][0])
+            for (labels, value) in self._gauge_values(name):
+                lines.append('%s%s %s' % (full, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def timed(name):
+    """Records the run time of the handler in the 'handler_seconds'
+    histogram of self.metrics, labelled with name."""
+    labels = (('handler', name),)
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return handler(self, *args, **kwargs)
+            finally:
+                self.metrics.observe('handler_seconds', time.time() - start, labels)
+        return wrapper
+    return decorator
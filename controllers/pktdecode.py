@@ -0,0 +1,116 @@
+"""
+Single pass packet-in header decoder.
+
+The SimpleSwitch handlers only need the Ethernet addresses and type, the
+top MPLS label and a few ARP/IPv4/L4 fields. decode() reads them with
+struct.unpack_from straight from msg.data, without building a
+ryu.lib.packet.Packet, and returns None for ethertypes it does not know
+(or truncated frames) so the caller can fall back to full Ryu parsing.
+"""
+
+import struct
+
+from ryu.lib.packet import arp
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import mpls
+from ryu.lib.packet import tcp
+from ryu.lib.packet import udp
+
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_MPLS = 0x8847
+ETH_TYPE_LLDP = 0x88cc
+ETH_TYPE_IPV6 = 0x86dd
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+_MAC = '%02x:%02x:%02x:%02x:%02x:%02x'
+_IP = '%d.%d.%d.%d'
+
+
+class Headers(object):
+    __slots__ = ('eth_dst', 'eth_src', 'ethertype', 'mpls_label',
+                 'arp_op', 'arp_sha', 'arp_spa', 'arp_tpa',
+                 'ip_src', 'ip_dst', 'ip_proto', 'l4_src', 'l4_dst')
+
+    def __init__(self, eth_dst, eth_src, ethertype):
+        self.eth_dst = eth_dst
+        self.eth_src = eth_src
+        self.ethertype = ethertype
+        self.mpls_label = None
+        self.arp_op = None
+        self.arp_sha = None
+        self.arp_spa = None
+        self.arp_tpa = None
+        self.ip_src = None
+        self.ip_dst = None
+        self.ip_proto = None
+        self.l4_src = 0
+        self.l4_dst = 0
+
+
+def _decode_ipv4(hdr, data, offset):
+    (vihl, proto) = struct.unpack_from('!B8xB', data, offset)
+    hdr.ip_proto = proto
+    hdr.ip_src = _IP % struct.unpack_from('!4B', data, offset + 12)
+    hdr.ip_dst = _IP % struct.unpack_from('!4B', data, offset + 16)
+    if proto == IPPROTO_TCP or proto == IPPROTO_UDP:
+        (hdr.l4_src, hdr.l4_dst) = struct.unpack_from('!HH', data, offset + (vihl & 0xf) * 4)
+
+
+def decode(data):
+    """Returns the Headers of an Ethernet frame, None if it needs full parsing."""
+    try:
+        ethertype = struct.unpack_from('!H', data, 12)[0]
+        hdr = Headers(_MAC % struct.unpack_from('!6B', data, 0),
+                      _MAC % struct.unpack_from('!6B', data, 6), ethertype)
+        if ethertype == ETH_TYPE_ARP:
+            hdr.arp_op = struct.unpack_from('!H', data, 20)[0]
+            hdr.arp_sha = _MAC % struct.unpack_from('!6B', data, 22)
+            hdr.arp_spa = _IP % struct.unpack_from('!4B', data, 28)
+            hdr.arp_tpa = _IP % struct.unpack_from('!4B', data, 38)
+        elif ethertype == ETH_TYPE_IP:
+            _decode_ipv4(hdr, data, 14)
+        elif ethertype == ETH_TYPE_MPLS:
+            word = struct.unpack_from('!I', data, 14)[0]
+            hdr.mpls_label = word >> 12
+            # Skip the rest of the label stack, IPv4 payloads are decoded too
+            offset = 14
+            while not word & 0x100:
+                offset += 4
+                word = struct.unpack_from('!I', data, offset)[0]
+            if len(data) > offset + 4 and struct.unpack_from('!B', data, offset + 4)[0] >> 4 == 4:
+                _decode_ipv4(hdr, data, offset + 4)
+        elif ethertype != ETH_TYPE_LLDP and ethertype != ETH_TYPE_IPV6:
+            return None
+    except struct.error:
+        return None
+    return hdr
+
+
+def from_packet(pkt):
+    """Headers of an already parsed ryu.lib.packet.Packet."""
+    eth = pkt.get_protocol(ethernet.ethernet)
+    hdr = Headers(eth.dst, eth.src, eth.ethertype)
+    mpls_proto = pkt.get_protocol(mpls.mpls)
+    if mpls_proto is not None:
+        hdr.mpls_label = mpls_proto.label
+    arp_proto = pkt.get_protocol(arp.arp)
+    if arp_proto is not None:
+        hdr.arp_op = arp_proto.opcode
+        hdr.arp_sha = arp_proto.src_mac
+        hdr.arp_spa = arp_proto.src_ip
+        hdr.arp_tpa = arp_proto.dst_ip
+    ip = pkt.get_protocol(ipv4.ipv4)
+    if ip is not None:
+        hdr.ip_src = ip.src
+        hdr.ip_dst = ip.dst
+        hdr.ip_proto = ip.proto
+        l4 = pkt.get_protocol(tcp.tcp) or pkt.get_protocol(udp.udp)
+        if l4 is not None:
+            hdr.l4_src = l4.src_port
+            hdr.l4_dst = l4.dst_port
+    return hdr
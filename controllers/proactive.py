@@ -0,0 +1,60 @@
+"""
+Proactive label switched fabric.
+
+The label entries of a switch only depend on the labels its upstream
+neighbours push towards it and on its own label towards the destination
+switch, so they can all be derived from the label table as soon as the
+labels are computed. Entries are keyed by (in_port, in_label): labels are
+only unique per upstream switch and the in_port tells the upstreams apart.
+"""
+
+
+def label_entries(net, table, dpid):
+    """Returns {(in_port, in_label): (dst, out_label, out_port)} for dpid.
+
+    out_label and out_port are None for the egress entries, where the label
+    is popped and the packet is delivered to the host.
+    """
+    entries = {}
+    for u in net.predecessors(dpid):
+        if not net.has_edge(dpid, u):
+            continue
+        in_port = net[dpid][u]['port']
+        for dst in table.destinations(u):
+            for (label, next_hop, cost) in table.labels(u, dst):
+                if next_hop != dpid:
+                    continue
+                if dst == dpid:
+                    entries[(in_port, label)] = (dst, None, None)
+                    continue
+                out_label = table.select(dpid, dst)
+                if out_label is None:
+                    continue
+                next_hop = table.next_hop(dpid, dst, out_label)
+                if not net.has_edge(dpid, next_hop):
+                    # The link is gone, the labels are not recomputed yet
+                    continue
+                entries[(in_port, label)] = (dst, out_label, net[dpid][next_hop]['port'])
+    return entries
+
+
+def diff(old, new):
+    """Returns (install, remove): the entries to (re)install and the keys to delete."""
+    install = dict((k, v) for (k, v) in new.items() if old.get(k) != v)
+    remove = [k for k in old if k not in new]
+    return install, remove
+
+
+def hops(table, src, dst, label):
+    """Number of switches after src on the path taken by label."""
+    count = 1
+    node = table.next_hop(src, dst, label)
+    seen = set([src])
+    while node != dst and node not in seen:
+        seen.add(node)
+        label = table.select(node, dst)
+        if label is None:
+            break
+        node = table.next_hop(node, dst, label)
+        count += 1
+    return count
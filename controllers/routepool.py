@@ -0,0 +1,167 @@
+"""
+Route computation in worker processes, off the Ryu event loop.
+
+RoutePool sends a snapshot of the topology (version, nodes, weighted edges)
+and the sources to recompute to its workers, split evenly between them, and
+polls the pipes from a green thread so packet-ins, echo and LLDP keep being
+served. The routes are handed to IncrementalSPF.apply() in one go once
+every worker answered.
+
+At most one job is in flight. Sources requested meanwhile are batched into
+the next job, and a result computed for a topology version older than the
+current one is discarded and recomputed: the incremental deltas that came
+in while the job ran were checked against stale routes, so that next job
+recomputes every source.
+"""
+
+import multiprocessing
+import time
+import traceback
+
+from ryu.lib import hub
+
+# Seconds between two polls of the worker pipes
+POLL_INTERVAL = 0.005
+
+
+def _route_fn(backend, k=1, stretch=0.0):
+    if backend == 'allpairs':
+        try:
+            import allpairs
+            return allpairs.AllPairsBackend(k=k, stretch=stretch)
+        except ImportError:
+            pass
+    if k > 1:
+        import kpaths
+        return kpaths.KPathsBackend(k, stretch)
+    import ecmp
+    return ecmp.dijsktra
+
+
+def _worker(conn, backend, k, stretch):
+    import networkx as nx
+    route_fn = _route_fn(backend, k, stretch)
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        (version, nodes, edges, sources) = job
+        try:
+            g = nx.DiGraph(version=version)
+            g.add_nodes_from(nodes)
+            g.add_edges_from((u, v, {'cost': cost}) for (u, v, cost) in edges)
+            conn.send((version, dict((src, route_fn(g, src)) for src in sources), None))
+        except Exception:
+            conn.send((version, None, traceback.format_exc()))
+
+
+class RoutePool(object):
+
+    def __init__(self, spf, workers, backend, on_routes, k=1, stretch=0.0):
+        # on_routes(changed) is called with the result of spf.apply(), k
+        # and stretch are passed to the backend as in kpaths.py
+        self.spf = spf
+        self.on_routes = on_routes
+        self.workers = []
+        for _ in range(workers):
+            (conn, child) = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_worker, args=(child, backend, k, stretch))
+            proc.daemon = True
+            proc.start()
+            self.workers.append((proc, conn))
+        self.pending = set()
+        self.full = False
+        # (version, sources) of the job in flight
+        self.job = None
+        self.submitted = 0
+        self.applied = 0
+        self.stale = 0
+        self.failed = 0
+        self.last_error = None
+        self.last_time = 0.0
+
+    def busy(self):
+        return self.job is not None
+
+    def request(self, sources):
+        if self.job is not None:
+            # Deltas are checked against the routes of the job in flight
+            self.full = True
+        self.pending |= set(sources)
+        if self.job is None and (self.pending or self.full):
+            self.submit()
+
+    def submit(self):
+        graph = self.spf.graph
+        if self.full:
+            sources = set(graph)
+        else:
+            sources = set(s for s in self.pending if s in graph)
+        self.pending = set()
+        self.full = False
+        if not sources:
+            return
+        if not self.workers:
+            self.on_routes(self.spf.update(sources))
+            return
+        (version, nodes, edges) = self.spf.snapshot()
+        self.job = (version, sources)
+        self.submitted += 1
+        ordered = sorted(sources)
+        n = len(self.workers)
+        for (i, (proc, conn)) in enumerate(self.workers):
+            conn.send((version, nodes, edges, ordered[i::n]))
+        hub.spawn(self.wait, time.time())
+
+    def wait(self, start):
+        (version, sources) = self.job
+        routes = {}
+        errors = []
+        # Every worker is read, so no answer is left behind for the next job
+        for (proc, conn) in list(self.workers):
+            try:
+                while not conn.poll():
+                    hub.sleep(POLL_INTERVAL)
+                (_, result, error) = conn.recv()
+            except (EOFError, IOError) as e:
+                # Without workers left routes are computed in place
+                self.workers.remove((proc, conn))
+                (result, error) = (None, 'worker %s: %s' % (proc.pid, e))
+            if error is None:
+                routes.update(result)
+            else:
+                errors.append(error)
+        self.job = None
+        self.last_time = time.time() - start
+
+        if self.spf.graph.graph['version'] != version:
+            # A newer topology is pending, recompute on it
+            self.stale += 1
+            self.full = True
+        elif errors:
+            # Computed in place, the event loop stalls but routes stay right
+            self.failed += 1
+            self.last_error = errors[0]
+            self.on_routes(self.spf.update(sources))
+        else:
+            self.applied += 1
+            self.on_routes(self.spf.apply(routes))
+        if self.pending or self.full:
+            self.submit()
+
+    def close(self):
+        for (proc, conn) in self.workers:
+            try:
+                conn.send(None)
+            except (EOFError, IOError):
+                pass
+            proc.join(1)
+
+    def stats(self):
+        return {'workers': len(self.workers),
+                'submitted': self.submitted,
+                'applied': self.applied,
+                'stale': self.stale,
+                'failed': self.failed,
+                'last_error': self.last_error,
+                'last_time': self.last_time}
@@ -0,0 +1,46 @@
+"""
+Source routed label stacks (segment routing over MPLS).
+
+Every switch port towards another switch has an adjacency label,
+ADJ_LABEL_BASE + port, the same value on every switch. A switch pops the top
+label and sends the frame out of the port it names, so its entries only
+depend on its ports and are installed once when its links are discovered.
+The ingress LER pushes one label per switch between itself and the egress
+LER and the egress LER delivers the plain IPv4 frame, so transit switches
+hold no per-flow entries and never see a packet-in.
+"""
+
+# Adjacency labels are kept above the labels handed out by labels.py
+ADJ_LABEL_BASE = 0xf0000
+
+
+def adjacency_label(port):
+    return ADJ_LABEL_BASE + port
+
+
+def is_adjacency_label(label):
+    return label >= ADJ_LABEL_BASE
+
+
+def path(table, src, dst, label):
+    """Switches from src to dst along label and then the selected label of
+    every switch, None if a switch on the way has no route."""
+    nodes = [src]
+    while True:
+        node = table.next_hop(nodes[-1], dst, label)
+        if node in nodes:
+            # Routes being updated can loop for a moment
+            return None
+        nodes.append(node)
+        if node == dst:
+            return nodes
+        label = table.select(node, dst)
+        if label is None:
+            return None
+
+
+def label_stack(net, nodes):
+    """Adjacency labels of the switches after the ingress, top of the stack
+    first. The last transit switch pops the bottom label."""
+    return [adjacency_label(net[nodes[i]][nodes[i + 1]]['port'])
+            for i in range(1, len(nodes) - 1)]
@@ -0,0 +1,235 @@
+"""
+Controller side mirror of the flow entries installed on every datapath.
+
+Entries are keyed by (table_id, priority, match) per dpid and remember the
+instructions, cookie and timeouts they were installed with. check() tells
+whether a new FlowMod is a duplicate that can be skipped, a change of
+instructions that can be sent as MODIFY_STRICT, or a plain add. Entries
+with a timeout are always added, a modify would not restart it.
+
+The mirror forgets entries on deletes, on FlowRemoved and when a flow
+stats reply shows they are gone from the switch. Entries added after the
+stats request was sent are kept, they may simply not be in the reply yet.
+
+Entries are last used when installed or when their packet counter moved
+between two flow stats replies; victims() picks the least recently used
+evictable ones when a switch table gets full.
+"""
+
+import heapq
+
+# Exact cookie match of a non strict delete
+FULL_MASK = 0xffffffffffffffff
+
+# Results of check()
+ADD = 'add'
+MODIFY = 'modify'
+SKIP = 'skip'
+
+
+def _mask_mac(value, mask):
+    return ':'.join('%02x' % (int(v, 16) & int(m, 16))
+                    for (v, m) in zip(value.split(':'), mask.split(':')))
+
+
+def match_key(match):
+    """Hashable form of an OFPMatch, masked values are normalised the way
+    the switch reports them."""
+    key = []
+    for (name, value) in sorted(match.items()):
+        if isinstance(value, tuple):
+            (value, mask) = value
+            if isinstance(value, int):
+                value = value & mask
+            elif isinstance(value, str) and value.count(':') == 5:
+                value = _mask_mac(value.lower(), mask.lower())
+            value = (value, mask)
+        elif isinstance(value, str):
+            value = value.lower()
+        key.append((name, value))
+    return tuple(key)
+
+
+# Filled in by serialize() or only set on messages parsed from a switch
+_VOLATILE = ('len', 'field')
+
+
+def _fields(obj):
+    # Hashable (name, value) pairs of an instruction or action, nested
+    # action lists included. str() of a message is far slower.
+    return tuple(sorted((name, tuple(_fields(a) for a in value) if isinstance(value, list) else value)
+                        for (name, value) in vars(obj).items() if name not in _VOLATILE))
+
+
+def instructions_key(instructions):
+    """Hashable form of a list of instructions (or group buckets), the same
+    for the ones sent and the ones read back from the switch."""
+    return tuple(_fields(inst) for inst in instructions)
+
+
+def _covers(fields, key):
+    """Non strict match: every field of fields is in key."""
+    entry = dict(key)
+    for (name, value) in fields:
+        if entry.get(name) != value:
+            return False
+    return True
+
+
+class ShadowTable(object):
+
+    def __init__(self):
+        # dpid -> {(table_id, priority, match key): entry}
+        self.tables = {}
+        # dpid -> {cookie: set of keys}, for the per destination flushes
+        self.cookies = {}
+        # Bumped for every install, compared with the stats request number
+        self.seq = 0
+        # dpid -> seq when the last flow stats request was sent
+        self.sync_seq = {}
+        # dpid -> keys seen in the replies of the running request
+        self.sync_keys = {}
+        self.sent = 0
+        self.skipped = 0
+        self.modified = 0
+        self.removed = 0
+        self.reconciled = 0
+        self.evicted = 0
+
+    def check(self, dpid, table_id, priority, match, instructions, cookie=0,
+              idle_timeout=0, hard_timeout=0, flags=0, evictable=False, dedup=True):
+        """Records the entry, returns ADD, MODIFY or SKIP. Without dedup
+        the entry is only recorded and ADD returned."""
+        key = (table_id, priority, match_key(match))
+        state = (instructions_key(instructions), cookie, idle_timeout, hard_timeout, flags)
+        old = self._record(dpid, key, state, match, evictable)
+        if not dedup:
+            self.sent += 1
+            return ADD
+        if idle_timeout or hard_timeout:
+            # A MODIFY_STRICT neither restarts the timeouts nor adds an
+            # entry the switch already expired, these are always re-added
+            self.sent += 1
+            return ADD
+        if old is not None and old['state'] == state:
+            self.skipped += 1
+            return SKIP
+        self.sent += 1
+        if old is not None and old['state'][1:] == state[1:]:
+            # Same cookie and flags, MODIFY_STRICT keeps the counters
+            self.modified += 1
+            return MODIFY
+        return ADD
+
+    def _record(self, dpid, key, state, match, evictable):
+        table = self.tables.setdefault(dpid, {})
+        old = table.get(key)
+        if old is not None and old['state'][1] != state[1]:
+            self.cookies[dpid][old['state'][1]].discard(key)
+        self.seq += 1
+        table[key] = {'state': state, 'seq': self.seq, 'used': self.seq, 'match': match,
+                      'evictable': evictable, 'packets': 0}
+        self.cookies.setdefault(dpid, {}).setdefault(state[1], set()).add(key)
+        return old
+
+    def restore(self, dpid, key, instructions, stat, evictable=False):
+        """Records an entry of a flow stats reply that the switch kept
+        across a controller restart, key and instructions as computed by
+        match_key() and instructions_key()."""
+        state = (instructions, stat.cookie, stat.idle_timeout, stat.hard_timeout, stat.flags)
+        self._record(dpid, key, state, stat.match, evictable)
+        self.tables[dpid][key]['packets'] = stat.packet_count
+
+    def has(self, dpid, key):
+        return key in self.tables.get(dpid, {})
+
+    def entries(self, dpid):
+        """(key, entry) of every entry of dpid."""
+        return self.tables.get(dpid, {}).items()
+
+    def _drop(self, dpid, key):
+        entry = self.tables[dpid].pop(key)
+        self.cookies[dpid][entry['state'][1]].discard(key)
+
+    def remove_strict(self, dpid, table_id, priority, match):
+        key = (table_id, priority, match_key(match))
+        if key in self.tables.get(dpid, {}):
+            self._drop(dpid, key)
+            self.removed += 1
+
+    def remove(self, dpid, table_id=None, cookie=0, cookie_mask=0, match=None):
+        """Non strict delete, table_id None stands for every table."""
+        fields = match_key(match) if match is not None else ()
+        table = self.tables.get(dpid, {})
+        if cookie_mask == FULL_MASK:
+            keys = list(self.cookies.get(dpid, {}).get(cookie, ()))
+        else:
+            keys = list(table)
+        for key in keys:
+            if table_id is not None and key[0] != table_id:
+                continue
+            if cookie_mask and (table[key]['state'][1] & cookie_mask) != (cookie & cookie_mask):
+                continue
+            if _covers(fields, key[2]):
+                self._drop(dpid, key)
+                self.removed += 1
+
+    def flow_removed(self, dpid, table_id, priority, match):
+        self.remove_strict(dpid, table_id, priority, match)
+
+    def begin_sync(self, dpid):
+        self.sync_seq[dpid] = self.seq
+        self.sync_keys[dpid] = set()
+
+    def sync(self, dpid, stats, more=False):
+        """Adds the entries of a flow stats reply, once the last part is in
+        forgets the entries installed before the request that the switch
+        does not have."""
+        if dpid not in self.sync_keys:
+            return
+        keys = self.sync_keys[dpid]
+        table = self.tables.get(dpid, {})
+        for stat in stats:
+            key = (stat.table_id, stat.priority, match_key(stat.match))
+            keys.add(key)
+            entry = table.get(key)
+            if entry is not None and entry['packets'] != stat.packet_count:
+                entry['packets'] = stat.packet_count
+                self.seq += 1
+                entry['used'] = self.seq
+        if more:
+            return
+        del self.sync_keys[dpid]
+        seq = self.sync_seq.pop(dpid)
+        for key in list(table):
+            if key not in keys and table[key]['seq'] <= seq:
+                self._drop(dpid, key)
+                self.reconciled += 1
+
+    def count(self, dpid):
+        return len(self.tables.get(dpid, ()))
+
+    def victims(self, dpid, n):
+        """Returns (table_id, priority, match) of the n least recently used
+        evictable entries of dpid."""
+        table = self.tables.get(dpid, {})
+        keys = heapq.nsmallest(n, (k for k in table if table[k]['evictable']),
+                               key=lambda k: table[k]['used'])
+        self.evicted += len(keys)
+        return [(k[0], k[1], table[k]['match']) for k in keys]
+
+    def forget(self, dpid):
+        self.tables.pop(dpid, None)
+        self.cookies.pop(dpid, None)
+        self.sync_seq.pop(dpid, None)
+        self.sync_keys.pop(dpid, None)
+
+    def stats(self):
+        return {'entries': sum(len(t) for t in self.tables.values()),
+                'max_entries': max([len(t) for t in self.tables.values()] + [0]),
+                'sent': self.sent,
+                'skipped': self.skipped,
+                'modified': self.modified,
+                'removed': self.removed,
+                'reconciled': self.reconciled,
+                'evicted': self.evicted}
@@ -0,0 +1,325 @@
+"""
+Sharding of the switches across several controller processes.
+
+Every process (shard) owns the dpids that a consistent hash ring maps to
+it: it is the OpenFlow master of those switches, handles their packet-ins
+and computes the routes and labels of which they are the source. Each
+shard allocates labels from its own slice of the label space, so labels
+stay unique fabric wide without coordination.
+
+The links, host locations, IP to MAC bindings and labels a shard learns are
+published to a store shared by all shards, as (key, value) entries appended
+to one log. Every shard polls the log and applies the entries of the
+others. Calls of label installs on switches of another shard are appended
+to the same log, addressed to the owner, so they always run after the
+labels they depend on.
+
+MemoryStore serves the shards of one process (tests and benchmarks),
+serve() exposes a MemoryStore on a unix socket or TCP port to SocketStore
+clients in other processes. Both ends authenticate with a shared key, read
+from a file or SIMPLESWITCH_SHARD_AUTHKEY in the environment, and exchange
+JSON, never pickles. A unix socket is created in a directory only its user
+can enter:
+
+    SIMPLESWITCH_SHARD_AUTHKEY=secret python controllers/sharding.py /tmp/simpleswitch/store.sock
+    python controllers/sharding.py /tmp/simpleswitch/store.sock /etc/simpleswitch/authkey
+"""
+
+import bisect
+import collections
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import traceback
+from multiprocessing.connection import Client, Listener
+
+# Points per shard on the hash ring, more points spread the dpids evenly
+REPLICAS = 128
+# Log entries kept beyond the live keys before the log is compacted
+COMPACT_SLACK = 4096
+# Environment variable holding the authkey when no file is given
+AUTHKEY_ENV = 'SIMPLESWITCH_SHARD_AUTHKEY'
+
+
+class StoreError(Exception):
+    pass
+
+
+def _hash(text):
+    return struct.unpack('<Q', hashlib.md5(text.encode('utf-8')).digest()[:8])[0]
+
+
+class HashRing(object):
+    """Consistent hashing of dpids onto shards. A dpid belongs to the shard
+    of the first point at or after its hash, so adding or removing a shard
+    only moves the dpids of that shard's arcs."""
+
+    def __init__(self, shards=(), replicas=REPLICAS):
+        self.replicas = replicas
+        # (point, shard), sorted
+        self.points = []
+        for shard in shards:
+            self.add(shard)
+
+    def add(self, shard):
+        for i in range(self.replicas):
+            bisect.insort(self.points, (_hash('%s-%d' % (shard, i)), shard))
+
+    def remove(self, shard):
+        self.points = [p for p in self.points if p[1] != shard]
+
+    def owner(self, dpid):
+        i = bisect.bisect_left(self.points, (_hash(str(dpid)),))
+        return self.points[i % len(self.points)][1]
+
+
+def label_range(shard, shards, first, last):
+    """(first, last) label of the slice of [first, last] allocated by shard."""
+    span = (last - first + 1) // shards
+    return (first + shard * span, first + (shard + 1) * span - 1)
+
+
+class MemoryStore(object):
+    """Key/value table with the ordered log of its writes.
+
+    Keys are tuples. Entries whose key starts with 'msg' are only logged,
+    they address the shard key[1]. The log is compacted once it outgrows
+    the table: entries overwritten later, and deletes and messages every
+    reader has gone past, are dropped.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        # (seq, writer, key, value), value None deletes key
+        self.log = []
+        self.table = {}
+        # Sequence number read up to by every shard
+        self.positions = {}
+        self.limit = COMPACT_SLACK
+
+    def write(self, writer, entries):
+        for (key, value) in entries:
+            self.seq += 1
+            self.log.append((self.seq, writer, key, value))
+            if key[0] == 'msg':
+                continue
+            if value is None:
+                self.table.pop(key, None)
+            else:
+                self.table[key] = value
+        if len(self.log) > len(self.table) + self.limit:
+            self.compact()
+        return self.seq
+
+    def read(self, reader, since):
+        """Returns (seq, [(writer, key, value)]) of the entries after since."""
+        self.positions[reader] = max(self.positions.get(reader, 0), since)
+        i = bisect.bisect_left(self.log, (since + 1,))
+        return (self.seq, [entry[1:] for entry in self.log[i:]])
+
+    def get(self, key):
+        return self.table.get(key)
+
+    def compact(self):
+        done = min(self.positions.values()) if self.positions else 0
+        last = {}
+        for (seq, writer, key, value) in self.log:
+            if key[0] != 'msg':
+                last[key] = seq
+        log = []
+        for entry in self.log:
+            (seq, writer, key, value) = entry
+            if key[0] == 'msg' or value is None:
+                keep = seq > done and (key[0] == 'msg' or last[key] == seq)
+            else:
+                keep = last[key] == seq
+            if keep:
+                log.append(entry)
+        self.log = log
+        self.limit = max(COMPACT_SLACK, len(self.log))
+
+
+def _tuples(obj):
+    # JSON arrays back to the tuples keys and values are made of
+    if isinstance(obj, list):
+        return tuple(_tuples(o) for o in obj)
+    if isinstance(obj, dict):
+        return dict((k, _tuples(v)) for (k, v) in obj.items())
+    return obj
+
+
+def _send(conn, obj):
+    conn.send_bytes(json.dumps(obj).encode('utf-8'))
+
+
+def _recv(conn):
+    return _tuples(json.loads(conn.recv_bytes().decode('utf-8')))
+
+
+def load_authkey(path=None):
+    """Authkey of the store, the contents of the file at path or else
+    AUTHKEY_ENV in the environment, None if neither is set."""
+    if path is not None:
+        with open(path, 'rb') as f:
+            key = f.read().strip()
+    else:
+        key = os.environ.get(AUTHKEY_ENV, '').encode('utf-8')
+    return key or None
+
+
+def _private_dir(path):
+    # Only the user may reach a unix socket, the directory guards it
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    st = os.stat(directory)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise StoreError('%s must belong to the user with mode 0700' % directory)
+
+
+class SocketStore(object):
+    """Client of a store served by serve()."""
+
+    def __init__(self, address, authkey):
+        if not authkey:
+            raise StoreError('no authkey for the store at %s' % (address,))
+        self.conn = Client(address, authkey=authkey)
+
+    def call(self, method, *args):
+        _send(self.conn, (method, args))
+        (result, error) = _recv(self.conn)
+        if error is not None:
+            raise StoreError(error)
+        return result
+
+    def write(self, writer, entries):
+        return self.call('write', writer, entries)
+
+    def read(self, reader, since):
+        return self.call('read', reader, since)
+
+    def get(self, key):
+        return self.call('get', key)
+
+
+def parse_address(text):
+    """'host:port' for TCP, a path for a unix socket."""
+    if ':' in text:
+        (host, port) = text.rsplit(':', 1)
+        return (host, int(port))
+    return text
+
+
+def connect(address, authkey=None):
+    """Store at address (see parse_address), address may also be a store."""
+    if hasattr(address, 'read'):
+        return address
+    return SocketStore(parse_address(address), authkey)
+
+
+def serve(address, authkey, store=None):
+    """Serves store, a new MemoryStore by default, until the process is
+    killed. Clients must know authkey."""
+    if not authkey:
+        raise StoreError('the store needs an authkey, see load_authkey()')
+    if store is None:
+        store = MemoryStore()
+    address = parse_address(address)
+    if not isinstance(address, tuple):
+        _private_dir(address)
+    lock = threading.Lock()
+    listener = Listener(address, authkey=authkey)
+
+    def handle(conn):
+        try:
+            while True:
+                request = conn.recv_bytes()
+                try:
+                    (method, args) = _tuples(json.loads(request.decode('utf-8')))
+                    if method not in ('write', 'read', 'get'):
+                        raise ValueError('unknown method %s' % method)
+                    with lock:
+                        _send(conn, (getattr(store, method)(*args), None))
+                except Exception:
+                    _send(conn, (None, traceback.format_exc()))
+        except (EOFError, IOError):
+            pass
+        finally:
+            conn.close()
+
+    while True:
+        conn = listener.accept()
+        thread = threading.Thread(target=handle, args=(conn,))
+        thread.daemon = True
+        thread.start()
+
+
+class Shard(object):
+    """One controller process: the dpids it owns, and the entries it
+    publishes to and reads from the store."""
+
+    def __init__(self, shard_id, shards, store, replicas=REPLICAS, generation=0):
+        self.id = shard_id
+        self.shards = shards
+        self.ring = HashRing(range(shards), replicas)
+        self.store = store
+        # Role requests of a restarted process supersede the old ones
+        self.generation = generation
+        self.owners = {}
+        self.position = 0
+        self.pending = []
+        self.stats = collections.Counter()
+
+    def owner(self, dpid):
+        owner = self.owners.get(dpid)
+        if owner is None:
+            owner = self.owners[dpid] = self.ring.owner(dpid)
+        return owner
+
+    def owns(self, dpid):
+        return self.owner(dpid) == self.id
+
+    def publish(self, key, value):
+        """Queues key = value (None deletes it) until flush()."""
+        self.pending.append((key, value))
+        self.stats['published'] += 1
+
+    def send(self, shard, method, *args):
+        """Queues a call of method(*args) on shard, run there after the
+        entries published before it."""
+        self.pending.append((('msg', shard), (method, args)))
+        self.stats['forwarded'] += 1
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = []
+        self.store.write(self.id, pending)
+
+    def poll(self):
+        """Returns the entries published by the other shards since the last
+        poll, and the calls sent to this one."""
+        (self.position, log) = self.store.read(self.id, self.position)
+        entries = []
+        calls = []
+        for (writer, key, value) in log:
+            if key[0] == 'msg':
+                if key[1] == self.id:
+                    calls.append(value)
+            elif writer != self.id:
+                entries.append((key, value))
+        self.stats['applied'] += len(entries)
+        self.stats['received'] += len(calls)
+        return (entries, calls)
+
+
+if __name__ == '__main__':
+    key = load_authkey(sys.argv[2] if len(sys.argv) > 2 else None)
+    if key is None:
+        sys.exit('usage: %s ADDRESS [AUTHKEY_FILE], or the authkey in %s'
+                 % (sys.argv[0], AUTHKEY_ENV))
+    serve(sys.argv[1], key)
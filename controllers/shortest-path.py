@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from __future__ import print_function
+
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
@@ -33,12 +35,20 @@ from ryu.app.wsgi import ControllerBase
 
 #import matplotlib.pyplot as plt
 
+# Idle timeout in seconds of the learned entries, 0 keeps them until the
+# table is full. Entries with a timeout are installed with
+# OFPFF_SEND_FLOW_REM, the MAC of a source is forgotten at a switch once
+# its last entry there is removed.
+IDLE_TIMEOUT = 60
+
 class SimpleSwitch13(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def __init__(self, *args, **kwargs):
         super(SimpleSwitch13, self).__init__(*args, **kwargs)
         self.mac_to_port = {}
+        # dpid -> {src: set of (in_port, dst)} of the installed entries
+        self.learned = {}
         self.net = nx.DiGraph()
         self.count = 0
 
@@ -60,21 +70,42 @@ class SimpleSwitch13(app_manager.RyuApp):
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None, idle_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
                                              actions)]
+        flags = 0
+        if idle_timeout:
+            flags = ofproto.OFPFF_SEND_FLOW_REM
+            src = match.get('eth_src')
+            entries = self.learned.setdefault(datapath.id, {}).setdefault(src, set())
+            entries.add((match.get('in_port'), match.get('eth_dst')))
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
                                     priority=priority, match=match,
-                                    instructions=inst)
+                                    instructions=inst, idle_timeout=idle_timeout,
+                                    flags=flags)
         else:
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    match=match, instructions=inst)
+                                    match=match, instructions=inst,
+                                    idle_timeout=idle_timeout, flags=flags)
         datapath.send_msg(mod)
 
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        src = msg.match.get('eth_src')
+        entries = self.learned.get(dpid, {}).get(src)
+        if entries is None:
+            return
+        entries.discard((msg.match.get('in_port'), msg.match.get('eth_dst')))
+        if not entries:
+            del self.learned[dpid][src]
+            self.mac_to_port[dpid].pop(src, None)
+
     def is_broadcast_mac(mac):
         if mac == "ff:ff:ff:ff:ff:ff":
             return True 
@@ -131,24 +162,17 @@ class SimpleSwitch13(app_manager.RyuApp):
                 prio = 2
                 actions = []
                 match = parser.OFPMatch(eth_src=src,in_port = in_port)
-                inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,actions)]
                 if msg.buffer_id != ofproto.OFP_NO_BUFFER:
-                    mod = parser.OFPFlowMod(datapath=datapath, buffer_id=msg.buffer_id,
-                                            priority=prio, match=match,
-                                            instructions=inst)
-
+                    self.add_flow(datapath, prio, match, actions, msg.buffer_id, IDLE_TIMEOUT)
                 else:
-                    mod = parser.OFPFlowMod(datapath=datapath, priority=prio,
-                                            match=match, instructions=inst)
-
-                datapath.send_msg(mod)
+                    self.add_flow(datapath, prio, match, actions, idle_timeout=IDLE_TIMEOUT)
                 self.logger.info("IN PORT WRONG: %s, DROPPING PKT", in_port)
                 return
 
 
         if src not in self.net:
             self.net.add_node(src)
-            self.net.add_edge(dpid, src, {'port':in_port})
+            self.net.add_edge(dpid, src, port=in_port)
             self.net.add_edge(src, dpid)
 
 
@@ -176,10 +200,10 @@ class SimpleSwitch13(app_manager.RyuApp):
             # verify if we have a valid buffer_id, if yes avoid to send both
             # flow_mod & packet_out
             if msg.buffer_id != ofproto.OFP_NO_BUFFER:
-                self.add_flow(datapath, 1, match, actions, msg.buffer_id)
+                self.add_flow(datapath, 1, match, actions, msg.buffer_id, IDLE_TIMEOUT)
                 #return
             else:
-                self.add_flow(datapath, 1, match, actions)
+                self.add_flow(datapath, 1, match, actions, idle_timeout=IDLE_TIMEOUT)
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
@@ -198,14 +222,14 @@ class SimpleSwitch13(app_manager.RyuApp):
         # print "------------------------------"
         link_list = get_link(self, None)
         links = [(link.src.dpid, link.dst.dpid, {'port':link.src.port_no}) for link in link_list]
-        print "Links:--------------------------------------------------------"
-        print links
-        print "size: ", str(len(links))
-        print "-----------------------------------------------------------------"
+        print("Links:--------------------------------------------------------")
+        print(links)
+        print("size: ", str(len(links)))
+        print("-----------------------------------------------------------------")
         self.net.add_nodes_from(switches)
         self.net.add_edges_from(links)
         if len(switches) >= 20:
             #nx.draw(self.net)
             #plt.savefig("path.png")
-            print "++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++"
+            print("++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++")
             return
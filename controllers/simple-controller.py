@@ -17,16 +17,23 @@
 An OpenFlow 1.0 L2 learning switch implementation.
 """
 
-from heapq import heappop, heappush
+import json
+import os
+import time
 
+from ryu.app.wsgi import ControllerBase, Response, WSGIApplication, route
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import CONFIG_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
+from ryu.lib import dpid as dpid_lib
+from ryu.lib import hub
+from eventlet import tpool
 from ryu.lib.mac import haddr_to_bin
 from ryu.lib.packet import packet
+from ryu.lib.packet import arp
 from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
 from ryu.lib.packet import mpls
@@ -35,6 +42,32 @@ from ryu.topology import event
 
 import networkx as nx 
 
+import admission
+import ecmp
+import flowhash
+import kpaths
+import labels
+import labeltable
+import linkcost
+import metrics
+import pktdecode
+import proactive
+import routepool
+import segments
+import shadow
+import sharding
+import snapshot
+import southbound
+from metrics import timed
+from southbound import flushing
+from spf import IncrementalSPF
+
+try:
+    import allpairs
+except ImportError:
+    # numpy is not installed
+    allpairs = None
+
 
 HIGH = 0x9000
 MID = 0x8000
@@ -43,23 +76,318 @@ LOW = 0x7000
 BCAST_ADDR = "ff:ff:ff:ff:ff:ff"
 MASK = "01:00:00:00:00:00"
 
+# Routing backend: 'dag' runs dijsktra per affected source, 'allpairs'
+# computes every source in one vectorised pass per topology version. The
+# allpairs results are still turned into the route dicts of IncrementalSPF
+# per source, which dominates a recomputation from k = 32 on
+# (benchmarks/allpairs_bench.py).
+ROUTING_BACKEND = 'dag'
+# Layout of the label and root port tables (controllers/labeltable.py):
+# 'array' (NumPy arrays over dense switch indices) or 'dict'.
+LABEL_TABLE = 'array'
+# Up to KPATHS next hops per (switch, destination switch), each with its own
+# label, the equal cost ones and loop-free alternates whose path costs at
+# most (1 + PATH_STRETCH) times the shortest (controllers/kpaths.py).
+# Alternates are taken by FLOW_HASH at the ingress LER, as first hop of a
+# segment routed stack and as FAST_FAILOVER backups. 1 keeps equal cost
+# next hops only.
+KPATHS = 1
+PATH_STRETCH = 0.5
+
+# Install the label swap/pop entries of every switch as soon as the labels
+# are computed, instead of reacting to MPLS packet-ins at every LSR.
+PROACTIVE = False
+# Table holding the host delivery entries after the egress label pop
+EGRESS_TABLE = 1
+# Cookie flag of the proactive label entries, kept apart from the per
+# destination cookies flushed by update_routes
+PROACTIVE_COOKIE = 1 << 63
+
+# Spread traffic over all the labels of a (switch, destination switch) pair
+# with an OFPGT_SELECT group, one weighted bucket per label.
+ECMP = False
+
+# Point the push and swap entries at a fast failover group (OFPGT_FF) per
+# (switch, destination switch): the selected label first, the labels of the
+# other shortest path next hops as backups watching their ports, so the
+# switch reroutes on port down before the controller repairs the routes.
+# ECMP takes precedence, FLOW_HASH entries keep their single label.
+FAST_FAILOVER = False
+
+# Push a stack of adjacency labels, one per switch after the ingress LER,
+# instead of a label that every LSR swaps (controllers/segments.py). Paths
+# needing more than SR_MAX_DEPTH labels get the hop-by-hop label.
+SEGMENT_ROUTING = False
+SR_MAX_DEPTH = 3
+
+# Pick the ingress label per IPv4 5-tuple with a consistent hash and install
+# 5-tuple entries that expire after FLOW_IDLE_TIMEOUT seconds.
+FLOW_HASH = False
+FLOW_IDLE_TIMEOUT = 10
+# Move a flow to the least loaded uplink when it comes back after its entry
+# idled out, FLOWLET_GAP (seconds) is then used as idle timeout.
+FLOWLET = False
+FLOWLET_GAP = 1
+
+# Write the messages of an event to each datapath in one go, optionally as
+# an atomic ONF bundle ('bundle') or followed by a barrier ('barrier').
+COALESCE = True
+SOUTHBOUND_MODE = None
+
+# Seconds between installing the entries of new labels and removing the
+# entries of the labels they replace (make-before-break), and seconds a
+# removed label is held before it can be reused.
+MBB_DELAY = 2
+LABEL_HOLD = 30
+
+# Derive link costs from the transmit utilisation of the ports, polled every
+# PORT_STATS_INTERVAL seconds and smoothed with an EWMA of weight
+# UTIL_SMOOTHING. Cost changes are applied to the routes at most once every
+# COST_UPDATE_INTERVAL seconds.
+LINK_COST = False
+PORT_STATS_INTERVAL = 5
+UTIL_SMOOTHING = 0.5
+# (utilisation, cost) levels and how far below a level a link must drop to
+# leave it again
+COST_LEVELS = linkcost.LEVELS
+COST_HYSTERESIS = 0.1
+COST_UPDATE_INTERVAL = 10
+
+# Compute routes in this many worker processes instead of inside the
+# topology event handlers, 0 keeps the computation in the event loop.
+ROUTE_WORKERS = 0
+
+# Answer ARP requests for known hosts with a PacketOut at the ingress port,
+# only requests for unknown targets are flooded.
+PROXY_ARP = False
+
+# Match the ingress LER entries on the destination only, the transit
+# unicast ARP entries on (destination, in_port) and the LSR entries on the
+# label only, instead of one entry per (source, destination) pair. Of the
+# per-source ARP flood entries only the drop and root port ones are kept.
+AGGREGATE = False
+# Seconds between two OFPTableStatsRequest rounds, 0 only polls on requests
+# to /simpleswitch/tables.
+TABLE_STATS_INTERVAL = 0
+
+# Mirror the installed entries to skip FlowMods identical to an installed
+# entry and send changed instructions as MODIFY_STRICT; entries with a
+# timeout are always added, which restarts it. The mirror is reconciled
+# with the flow stats of every switch each FLOW_STATS_INTERVAL seconds
+# (0 disables).
+SHADOW_TABLE = False
+FLOW_STATS_INTERVAL = 30
+
+# (idle_timeout, hard_timeout) in seconds of the reactive entries per rule
+# class: 'arp' learning and flood entries, 'ipv4' push entries of the
+# ingress LER and 'label' swap/pop entries learned from MPLS packet-ins.
+# Entries with a timeout are installed with OFPFF_SEND_FLOW_REM, and are
+# installed again by the packet-ins that follow their expiry. Proactive
+# entries have no class and never expire.
+RULE_TIMEOUTS = {'arp': (60, 0), 'ipv4': (60, 0), 'label': (60, 0)}
+# Flow entries a switch can hold, 0 for no limit. Once a switch holds
+# EVICT_HIGH * TABLE_CAPACITY entries its least recently used reactive
+# entries are deleted down to EVICT_LOW * TABLE_CAPACITY.
+TABLE_CAPACITY = 0
+EVICT_HIGH = 0.9
+EVICT_LOW = 0.8
+
+# Save the topology, labels, hosts, groups and installed flow entries to
+# SNAPSHOT_FILE every SNAPSHOT_INTERVAL seconds and on close, and warm start
+# from it: the switches keep their entries, which are reconciled with their
+# flow and group stats instead of being flushed and learned again. Switches
+# and links of the snapshot not rediscovered within RESTORE_GRACE seconds
+# are removed. None disables snapshots, they need numpy.
+SNAPSHOT_FILE = None
+SNAPSHOT_INTERVAL = 30
+RESTORE_GRACE = 30
+
+# Shard the switches across SHARDS controller processes (controllers/sharding.py).
+# A consistent hash ring maps every dpid to a shard, this process is master of
+# the switches of shard SHARD_ID (SIMPLESWITCH_SHARD in the environment) and
+# slave of the others. Links, hosts and labels are shared through the store at
+# SHARD_STORE, a unix socket path or host:port served by sharding.py, polled
+# every SHARD_SYNC_INTERVAL seconds. The store authenticates with the key in
+# the file SHARD_AUTHKEY_FILE, or SIMPLESWITCH_SHARD_AUTHKEY in the environment.
+# Label entries on the switches of another shard are installed by that shard.
+# 1 disables sharding.
+SHARDS = 1
+SHARD_ID = int(os.environ.get('SIMPLESWITCH_SHARD', 0))
+SHARD_STORE = '/tmp/simpleswitch/store.sock'
+SHARD_AUTHKEY_FILE = None
+SHARD_SYNC_INTERVAL = 0.05
+
+# Rate limit the packet-ins of every switch with the OpenFlow meter
+# PACKET_IN_METER on its table-miss entries: PACKET_IN_RATE packets per
+# second in bursts of up to PACKET_IN_BURST, the switch drops the rest.
+# Switches that reject the meter get their table-miss entries without it.
+# 0 disables the meters.
+PACKET_IN_RATE = 0
+PACKET_IN_BURST = 50
+PACKET_IN_METER = 1
+# Queue up to PACKET_IN_QUEUE packet-ins and handle them in a green thread
+# that lets the topology and port status events go first: ARP, then MPLS of
+# the flows admitted at their ingress, then IPv4, then the packet-ins of
+# sources that are not learned yet (controllers/admission.py). 0 handles
+# them in the event handler.
+PACKET_IN_QUEUE = 0
+
+simple_switch_instance_name = 'simple_switch_api_app'
+
 class SimpleSwitch(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'wsgi': WSGIApplication}
 
     def __init__(self, *args, **kwargs):
         super(SimpleSwitch, self).__init__(*args, **kwargs)
-        self.switch_to_port = {}
+        wsgi = kwargs['wsgi']
+        wsgi.register(SimpleSwitchController, {simple_switch_instance_name: self})
         self.label = 20
-        self.switch_to_label = {}
+        # Labels and root ports per (switch, destination switch)
+        if LABEL_TABLE == 'array' and labeltable.np is None:
+            self.logger.info("numpy not available, using the dict label table")
+        if LABEL_TABLE == 'array' and labeltable.np is not None:
+            self.label_table = labeltable.ArrayLabelTable()
+        else:
+            self.label_table = labeltable.DictLabelTable()
         self.dst_to_label = {}
         self.host_to_switch = {}
+        # Learned from ARP and IPv4 packet-ins at the ingress switch
+        self.ip_to_mac = {}
+        self.arp_stats = {'cached': 0, 'flooded': 0}
+        self.datapaths = {}
+        self.southbound = southbound.Southbound(COALESCE, SOUTHBOUND_MODE, self.logger)
         self.net = nx.DiGraph()
+        route_fn = self.dijsktra
+        if KPATHS > 1:
+            route_fn = kpaths.KPathsBackend(KPATHS, PATH_STRETCH)
+        if ROUTING_BACKEND == 'allpairs':
+            if allpairs is None:
+                self.logger.info("numpy not available, using the dag routing backend")
+            else:
+                route_fn = allpairs.AllPairsBackend(k=KPATHS, stretch=PATH_STRETCH)
+        self.spf = IncrementalSPF(self.net, route_fn, alternates=KPATHS > 1)
+        self.route_pool = None
+        if ROUTE_WORKERS > 0:
+            self.route_pool = routepool.RoutePool(self.spf, ROUTE_WORKERS, ROUTING_BACKEND,
+                                                  self.pool_routes, KPATHS, PATH_STRETCH)
+        # Labels are allocated fabric wide, by every shard from its own slice
+        (first, last) = (labels.FIRST_LABEL, segments.ADJ_LABEL_BASE - 1)
+        self.shard = None
+        if SHARDS > 1:
+            self.shard = sharding.Shard(SHARD_ID, SHARDS,
+                                        sharding.connect(SHARD_STORE,
+                                                         sharding.load_authkey(SHARD_AUTHKEY_FILE)),
+                                        generation=int(time.time()))
+            self.southbound.hooks.append(self.shard.flush)
+            (first, last) = sharding.label_range(SHARD_ID, SHARDS, first, last)
+        self.labels = labels.LabelAllocator(first, last, hold=LABEL_HOLD)
+        # Ports whose adjacency label entries are installed, per switch
+        self.adjacencies = {}
+        # (ingress, destination switch) -> switches of the stacks pushed there
+        self.segment_paths = {}
+        # Proactive label entries installed per switch
+        self.label_state = {}
+        self.path_selector = flowhash.PathSelector(flowlet=FLOWLET)
+        # SELECT or FAST_FAILOVER groups per switch:
+        # {dpid: {dst: {'group_id': id, 'type': type, 'weights': {label: weight}}}}
+        self.groups = {}
+        self.use_groups = ECMP or FAST_FAILOVER
+        self.link_costs = linkcost.LinkCosts(COST_LEVELS, UTIL_SMOOTHING, COST_HYSTERESIS)
+        # Links whose cost changed since the last route update
+        self.cost_pending = set()
+        self.cost_updated = 0
+        if LINK_COST:
+            self.monitor_thread = hub.spawn(self._monitor)
+        # Active entries per table of every switch, from OFPTableStatsReply
+        self.table_occupancy = {}
+        if TABLE_STATS_INTERVAL > 0:
+            self.table_thread = hub.spawn(self._table_monitor)
+        # Switches whose table-miss entries are not metered
+        self.unmetered = set()
+        self.packet_in_queue = None
+        if PACKET_IN_QUEUE > 0:
+            self.packet_in_queue = admission.PacketInQueue(PACKET_IN_QUEUE)
+            self.packet_in_ready = hub.Event()
+            self.packet_in_thread = hub.spawn(self._packet_in_worker)
+        self.metrics = metrics.Metrics()
+        self.register_metrics()
+        self.shadow = shadow.ShadowTable()
+        self.snapshots = SNAPSHOT_FILE is not None and snapshot.np is not None and SHARDS == 1
+        if SNAPSHOT_FILE is not None and SHARDS > 1:
+            self.logger.info("Snapshots are not supported with SHARDS > 1")
+        elif SNAPSHOT_FILE is not None and not self.snapshots:
+            self.logger.info("numpy not available, snapshots disabled")
+        # Eviction and snapshots need the mirror, without the FlowMod suppression
+        self.track_flows = SHADOW_TABLE or TABLE_CAPACITY > 0 or self.snapshots
+        if self.track_flows and FLOW_STATS_INTERVAL > 0:
+            self.flow_stats_thread = hub.spawn(self._flow_stats_monitor)
+        # Snapshot entries {dpid: {fingerprint: evictable}} of the switches
+        # that have not been reconciled yet
+        self.restored_flows = {}
+        # Pairs whose labels changed while restoring, flushed on reconnect
+        self.restore_flush = {}
+        # Stats reply parts of the running reconciliations, per dpid
+        self.reconciling = {}
+        self.reconciling_groups = {}
+        self.restore_stats = {'kept': 0, 'deleted': 0, 'lost': 0, 'groups': 0}
+        # One snapshot is written at a time, the periodic one or on close
+        self.snapshot_lock = hub.Semaphore()
+        if self.snapshots:
+            self.restore_snapshot()
+            self.snapshot_thread = hub.spawn(self._snapshot_monitor)
+        if self.shard is not None:
+            # Everything the other shards published so far
+            self.sync_shard()
+            self.shard_thread = hub.spawn(self._shard_monitor)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    @flushing
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        if self.shard is not None:
+            # The switches of other shards are only in the topology, their
+            # packet-ins go to their master
+            owned = self.shard.owns(datapath.id)
+            role = ofproto.OFPCR_ROLE_MASTER if owned else ofproto.OFPCR_ROLE_SLAVE
+            self.southbound.send_msg(datapath, parser.OFPRoleRequest(datapath, role,
+                                                                     self.shard.generation))
+            if not owned:
+                return
+        self.datapaths[datapath.id] = datapath
+        # Nothing is known about the tables of a (re)connected switch
+        self.shadow.forget(datapath.id)
+        if datapath.id in self.restored_flows:
+            # It kept its entries across the restart, they are checked
+            # against the snapshot
+            self.request_reconcile(datapath)
+        else:
+            self.adjacencies.pop(datapath.id, None)
+
+        if PACKET_IN_RATE > 0 and datapath.id not in self.unmetered:
+            self.add_meter(datapath)
+        self.install_table_miss(datapath)
+        if LINK_COST:
+            self.southbound.send_msg(datapath, parser.OFPPortDescStatsRequest(datapath, 0))
+
+    def add_meter(self, datapath):
+        """Adds the packet-in meter of the table-miss entries."""
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        bands = [parser.OFPMeterBandDrop(rate=PACKET_IN_RATE, burst_size=PACKET_IN_BURST)]
+        # The ADD of a meter kept from a previous connection fails with
+        # METER_EXISTS, the MODIFY after it sets the bands either way
+        for command in (ofproto.OFPMC_ADD, ofproto.OFPMC_MODIFY):
+            mod = parser.OFPMeterMod(datapath, command=command,
+                                     flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST,
+                                     meter_id=PACKET_IN_METER, bands=bands)
+            self.southbound.send_msg(datapath, mod)
+
+    def install_table_miss(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
 
         # install table-miss flow entry
         #
@@ -72,40 +400,154 @@ class SimpleSwitch(app_manager.RyuApp):
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
                                           ofproto.OFPCML_NO_BUFFER)]
         priority = 0
-        self.add_flow(datapath, match, actions, priority)
-
-    def add_flow(self, datapath, match, actions, priority, buffer_id=None):
+        meter_id = None
+        if PACKET_IN_RATE > 0 and datapath.id not in self.unmetered:
+            meter_id = PACKET_IN_METER
+        self.add_flow(datapath, match, actions, priority, meter_id=meter_id)
+        if PROACTIVE:
+            self.add_flow(datapath, match, actions, priority, table_id=EGRESS_TABLE,
+                          meter_id=meter_id)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    @flushing
+    def _error_msg_handler(self, ev):
+        msg = ev.msg
+        datapath = msg.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        # The data of an error starts with the header of the failed message
+        failed = bytearray(msg.data[1:2])
+        if PACKET_IN_RATE <= 0 or not failed or failed[0] != ofproto.OFPT_METER_MOD:
+            return
+        if msg.type == ofproto.OFPET_METER_MOD_FAILED and msg.code == ofproto.OFPMMFC_METER_EXISTS:
+            return
+        if datapath.id in self.unmetered:
+            return
+        self.logger.info("%s rejected the packet-in meter (type %d, code %d), "
+                         "table-miss entries without it", datapath.id, msg.type, msg.code)
+        self.unmetered.add(datapath.id)
+        # Their FlowMods failed too, MODIFY_STRICT would not add them again
+        for table_id in (0, EGRESS_TABLE):
+            self.shadow.remove_strict(datapath.id, table_id, 0, parser.OFPMatch())
+        self.install_table_miss(datapath)
+
+    def add_flow(self, datapath, match, actions, priority, buffer_id=None, cookie=0,
+                 table_id=0, goto_table=None, idle_timeout=0, flags=0, hard_timeout=0,
+                 rule_class=None, meter_id=None):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         if buffer_id == None:
             buffer_id = ofproto.OFP_NO_BUFFER
 
+        # Reactive entries get the timeouts of their class unless given
+        if rule_class is not None:
+            (idle, hard) = RULE_TIMEOUTS.get(rule_class, (0, 0))
+            idle_timeout = idle_timeout or idle
+            hard_timeout = hard_timeout or hard
+            if idle_timeout or hard_timeout:
+                flags |= ofproto.OFPFF_SEND_FLOW_REM
+
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
                                              actions)]
+        if goto_table is not None:
+            inst.append(parser.OFPInstructionGotoTable(goto_table))
+        if meter_id is not None:
+            inst.insert(0, parser.OFPInstructionMeter(meter_id))
+
+        command = ofproto.OFPFC_ADD
+        if self.track_flows:
+            # A buffered packet is only released by the FlowMod, never skip it
+            dedup = SHADOW_TABLE and buffer_id == ofproto.OFP_NO_BUFFER
+            result = self.shadow.check(datapath.id, table_id, priority, match, inst, cookie,
+                                       idle_timeout, hard_timeout, flags,
+                                       rule_class is not None, dedup)
+            if result == shadow.SKIP:
+                return
+            if result == shadow.MODIFY:
+                command = ofproto.OFPFC_MODIFY_STRICT
+
+        # The cookie is the dpid of the switch whose route the entry depends on,
+        # so that entries can be flushed when that route changes.
+        mod = parser.OFPFlowMod(datapath=datapath, priority=priority, cookie=cookie,
+                                    command=command, table_id=table_id, match=match,
+                                    instructions=inst, buffer_id=buffer_id,
+                                    idle_timeout=idle_timeout, hard_timeout=hard_timeout,
+                                    flags=flags)
+        self.southbound.send_msg(datapath, mod)
+        if TABLE_CAPACITY > 0:
+            self.evict(datapath)
+
+    def evict(self, datapath):
+        """Deletes the least recently used reactive entries of datapath once
+        its table is EVICT_HIGH full."""
+        count = self.shadow.count(datapath.id)
+        if count < EVICT_HIGH * TABLE_CAPACITY:
+            return
+        victims = self.shadow.victims(datapath.id, count - int(EVICT_LOW * TABLE_CAPACITY))
+        for (table_id, priority, match) in victims:
+            self.delete_flow(datapath, match, priority, table_id)
+        self.logger.info("Evicted %d entries of %s", len(victims), datapath.id)
+
+    def delete_flow(self, datapath, match, priority, table_id=0):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=table_id, priority=priority,
+                                command=ofproto.OFPFC_DELETE_STRICT, match=match,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY)
+        self.southbound.send_msg(datapath, mod)
+        self.shadow.remove_strict(datapath.id, table_id, priority, match)
+
+    def delete_flows(self, datapath, cookie=None, match=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
 
-        mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    match=match, instructions=inst, buffer_id=buffer_id)
-        datapath.send_msg(mod)
+        # Non strict delete of the entries with the given cookie and/or
+        # at least as specific as match
+        cookie_mask = 0
+        if cookie is not None:
+            cookie_mask = 0xffffffffffffffff
+        if match is None:
+            match = parser.OFPMatch()
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie or 0, cookie_mask=cookie_mask,
+                                table_id=ofproto.OFPTT_ALL, command=ofproto.OFPFC_DELETE,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                match=match)
+        self.southbound.send_msg(datapath, mod)
+        self.shadow.remove(datapath.id, None, cookie or 0, cookie_mask, match)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    @flushing
     def _packet_in_handler(self, ev):
         msg = ev.msg
         datapath = msg.datapath
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
+        # Decode the few header fields the handlers use once, only
+        # unknown ethertypes go through the full Ryu parser
+        hdr = pktdecode.decode(msg.data)
+        if hdr is None:
+            hdr = pktdecode.from_packet(packet.Packet(msg.data))
+        self.metrics.inc('packet_ins_total',
+                         (('dpid', datapath.id), ('eth_type', '0x%04x' % hdr.ethertype)))
 
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP or eth.ethertype == ether_types.ETH_TYPE_IPV6:
+        if hdr.ethertype == ether_types.ETH_TYPE_LLDP or hdr.ethertype == ether_types.ETH_TYPE_IPV6:
             # ignore lldp packet
             return
-        dst = eth.dst
-        src = eth.src
-
-        dpid = datapath.id
-        ethtype = eth.ethertype
+        if self.packet_in_queue is not None:
+            priority = admission.PRIORITY.get(hdr.ethertype)
+            if priority is None:
+                return
+            if hdr.eth_src not in self.host_to_switch:
+                # New hosts, and scans and storms from spoofed sources
+                priority = admission.NEW
+            key = None
+            if int(hdr.eth_dst[:2], 16) & 1:
+                # A switch floods a broadcast once, whichever copy comes first
+                key = (datapath.id, msg.data)
+            if self.packet_in_queue.put(priority, datapath.id, (msg, hdr, time.time()), key):
+                self.packet_in_ready.set()
+            return
 
         # self.dst_to_label.setdefault(dpid, {})
         # self.switch_to_port.setdefault(dpid, {})
@@ -181,28 +623,48 @@ class SimpleSwitch(app_manager.RyuApp):
         #     actions=actions, data=data)
         # datapath.send_msg(out)
 
+        self.handle_packet_in(msg, hdr)
+
+    def handle_packet_in(self, msg, hdr):
+        ethtype = hdr.ethertype
         # If ARP
         if ethtype == 2054:
-            self.arpHandler(msg)
+            self.arpHandler(msg, hdr)
         # If IPV4
         elif ethtype == 2048:
-            self.ipv4Handler(msg)
+            self.ipv4Handler(msg, hdr)
         #If MPLS unicast
         elif ethtype == 34887:
-            self.mplsHandler(msg)
-
-    def arpHandler(self, msg):
+            self.mplsHandler(msg, hdr)
+
+    def _packet_in_worker(self):
+        while True:
+            self.packet_in_ready.wait()
+            self.packet_in_ready.clear()
+            while len(self.packet_in_queue):
+                try:
+                    self.handle_queued_packet_in()
+                except Exception:
+                    self.logger.exception("Packet-in handler failed")
+                # The events that arrived meanwhile go first
+                hub.sleep(0)
+
+    @flushing
+    def handle_queued_packet_in(self):
+        (msg, hdr, queued) = self.packet_in_queue.get()
+        self.metrics.observe('packet_in_wait_seconds', time.time() - queued)
+        self.handle_packet_in(msg, hdr)
+
+    @timed('arpHandler')
+    def arpHandler(self, msg, hdr):
         datapath = msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
-
         in_port = msg.match['in_port']
-        ethtype = eth.ethertype
-        dst = eth.dst
-        src = eth.src
+        ethtype = hdr.ethertype
+        dst = hdr.eth_dst
+        src = hdr.eth_src
         dpid = datapath.id
 
         self.logger.info("Launching ARP handler for dpid: %s, src: %s, dst: %s", datapath.id, src, dst)
@@ -216,14 +678,18 @@ class SimpleSwitch(app_manager.RyuApp):
         #     actions = [datapath.ofproto_parser.OFPActionOutput(out_port)]
         #     self.add_flow(datapath, match, actions, priority, msg.buffer_id)
 
-        self.switch_to_label.setdefault(dpid, {})
-        self.switch_to_port.setdefault(dpid, {})
         
 
         root_port = None
+        if self.shard is not None and (src not in self.host_to_switch or
+                                       (dst != BCAST_ADDR and dst not in self.host_to_switch)):
+            # They may have been learned at a switch of another shard
+            self.sync_shard()
         # Learn source switch if host
         if src not in self.host_to_switch:
             self.host_to_switch[src] = {'switch': dpid, 'port': in_port}
+            if self.shard is not None:
+                self.shard.publish(('host', src), (dpid, in_port))
 
             # Add FTE when current src is dst
             match = parser.OFPMatch(eth_dst = src, eth_type=ethtype)
@@ -232,6 +698,22 @@ class SimpleSwitch(app_manager.RyuApp):
             #self.add_flow(datapath, match, actions, priority, None)
             root_port = in_port
 
+            self.install_host(datapath, src, in_port)
+
+        at_ingress = (self.host_to_switch[src]['switch'] == dpid and
+                      self.host_to_switch[src]['port'] == in_port)
+        if at_ingress:
+            # The entries of a known source may have expired or been
+            # evicted, or its first request answered without installing them
+            root_port = in_port
+            if hdr.arp_op == arp.ARP_REQUEST:
+                if PROXY_ARP and self.proxy_arp(msg, hdr):
+                    return
+                self.arp_stats['flooded'] += 1
+            elif PROXY_ARP and hdr.arp_op == arp.ARP_REPLY:
+                # The target of a flooded request is learned from its reply
+                self.learn_ip(hdr.arp_spa, hdr.eth_src)
+
         if self.host_to_switch[src]['switch'] != dpid: #and self.host_to_switch[src]['switch'] not in self.switch_to_port[dpid]:
             #Add FTE to account current src as dst 
             #root_port denotes the port on current dpid that leads 
@@ -240,33 +722,46 @@ class SimpleSwitch(app_manager.RyuApp):
             # next_hop = path[path.index(dpid)+1]
             # root_port = self.net[dpid][next_hop]['port']
             # self.switch_to_port[dpid][self.host_to_switch[src]['switch']] = root_port
-            root_port = self.switch_to_port[dpid][self.host_to_switch[src]['switch']]
+            root_port = self.label_table.root_port(dpid, self.host_to_switch[src]['switch'])
 
         if root_port ==  None:
             self.logger.info("Root Port is None...\n Quitting...")
             # self.logger.info("packet in %s %s %s %s", dpid, src, dst, in_port)
             return
 
+        # Entries depending on the root port are flushed when the route
+        # towards the source switch changes
+        cookie = 0
+        if self.host_to_switch[src]['switch'] != dpid:
+            cookie = self.host_to_switch[src]['switch']
+
         #Add flow for unknown unicast, drop duplicate flooded packets
         match = parser.OFPMatch(eth_src=src, eth_type=ethtype)
         actions = []
         priority = LOW
-        self.add_flow(datapath, match, actions, priority, None)
+        self.add_flow(datapath, match, actions, priority, None, cookie, rule_class='arp')
 
         #Add flow to accept traffic through root port
         match = parser.OFPMatch(eth_src=src, in_port = root_port, eth_type=ethtype)
         actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
         priority = MID
-        self.add_flow(datapath, match, actions, priority, None)
+        self.add_flow(datapath, match, actions, priority, None, cookie, rule_class='arp')
 
         #Add flow for broadcast/multicast
+        # Redundant with the root port entry, no other HIGH entry matches a
+        # broadcast ARP, so aggregation leaves it out
         match = parser.OFPMatch(eth_src=src, eth_dst=(BCAST_ADDR, MASK), in_port=root_port, eth_type=ethtype)
         actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
         priority = HIGH
-        self.add_flow(datapath, match, actions, priority, None)
+        if not AGGREGATE:
+            self.add_flow(datapath, match, actions, priority, None, cookie, rule_class='arp')
 
         if dst in self.host_to_switch:
             match = parser.OFPMatch(eth_dst = dst, eth_src = src, eth_type=ethtype)
+            if AGGREGATE and self.host_to_switch[src]['switch'] != dpid:
+                # Frames of hosts behind this switch keep the per source
+                # entry, an unknown host has to reach the controller once
+                match = parser.OFPMatch(eth_dst=dst, in_port=in_port, eth_type=ethtype)
             # if self.host_to_switch[dst]['switch'] in self.switch_to_port[dpid]:
             #     out_port = self.switch_to_port[dpid][self.host_to_switch[dst]['switch']]
             # else:
@@ -276,13 +771,19 @@ class SimpleSwitch(app_manager.RyuApp):
             #     root_port = self.net[dpid][next_hop]['port']
             #     self.switch_to_port[dpid][self.host_to_switch[dst]['switch']] = root_port
             #     out_port = root_port
+            cookie = 0
             if self.host_to_switch[dst]['switch'] == dpid:
                 out_port = self.host_to_switch[dst]['port']
             else:
-                out_port = self.switch_to_port[dpid][self.host_to_switch[dst]['switch']]
+                out_port = self.label_table.root_port(dpid, self.host_to_switch[dst]['switch'])
+                cookie = self.host_to_switch[dst]['switch']
+                if out_port is None:
+                    self.logger.info("No route from %s to %s", dpid, self.host_to_switch[dst]['switch'])
+                    return
             actions = [parser.OFPActionOutput(out_port)]
             priority = HIGH
-            self.add_flow(datapath, match, actions, priority, msg.buffer_id)
+            self.add_flow(datapath, match, actions, priority, msg.buffer_id, cookie,
+                          rule_class='arp')
 
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
@@ -291,44 +792,147 @@ class SimpleSwitch(app_manager.RyuApp):
         out = datapath.ofproto_parser.OFPPacketOut(
             datapath=datapath, buffer_id=msg.buffer_id, in_port=in_port,
             actions=actions, data=data)
-        datapath.send_msg(out)
+        self.southbound.send_msg(datapath, out)
+
+    def install_host(self, datapath, mac, port):
+        """Installs the entries delivering to a host that are not learned
+        from packet-ins."""
+        parser = datapath.ofproto_parser
+        if PROACTIVE:
+            # Delivery after the egress LER pops the label
+            match = parser.OFPMatch(eth_dst=mac)
+            actions = [parser.OFPActionOutput(port)]
+            self.add_flow(datapath, match, actions, HIGH, table_id=EGRESS_TABLE)
+        if SEGMENT_ROUTING:
+            # Stacks are popped before the egress LER
+            match = parser.OFPMatch(eth_dst=mac, eth_type=ether_types.ETH_TYPE_IP)
+            actions = [parser.OFPActionOutput(port)]
+            self.add_flow(datapath, match, actions, HIGH)
+
+    def learn_ip(self, ip, mac):
+        if self.ip_to_mac.get(ip) == mac:
+            return
+        self.ip_to_mac[ip] = mac
+        if self.shard is not None:
+            self.shard.publish(('arp', ip), mac)
 
-    def ipv4Handler(self, msg):
+    def proxy_arp(self, msg, hdr):
+        """Learns the sender of an ARP request at its ingress switch and
+        answers it if the target is known, returns True if answered."""
+        datapath = msg.datapath
+        parser = datapath.ofproto_parser
+        in_port = msg.match['in_port']
+        # Gratuitous ARPs are for the other hosts' caches and probes have
+        # no sender address yet, both are flooded
+        if hdr.arp_spa == hdr.arp_tpa or hdr.arp_spa == '0.0.0.0':
+            return False
+        self.learn_ip(hdr.arp_spa, hdr.eth_src)
+
+        target = self.ip_to_mac.get(hdr.arp_tpa)
+        if target is None or target not in self.host_to_switch:
+            return False
+        reply = packet.Packet()
+        reply.add_protocol(ethernet.ethernet(dst=hdr.eth_src, src=target,
+                                             ethertype=ether_types.ETH_TYPE_ARP))
+        reply.add_protocol(arp.arp(opcode=arp.ARP_REPLY, src_mac=target, src_ip=hdr.arp_tpa,
+                                   dst_mac=hdr.eth_src, dst_ip=hdr.arp_spa))
+        reply.serialize()
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=datapath.ofproto.OFP_NO_BUFFER,
+                                  in_port=datapath.ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(in_port)], data=reply.data)
+        self.southbound.send_msg(datapath, out)
+        self.arp_stats['cached'] += 1
+        return True
+
+    @timed('ipv4Handler')
+    def ipv4Handler(self, msg, hdr):
         datapath = msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
-
-        dst = eth.dst
+        dst = hdr.eth_dst
         in_port = msg.match['in_port']
         dpid = datapath.id
         self.logger.info("Launching IPV4 handler for datatpath%s", datapath.id)
 
+        if PROXY_ARP and self.host_to_switch.get(hdr.eth_src, {}).get('switch') == dpid:
+            self.learn_ip(hdr.ip_src, hdr.eth_src)
+        if dst not in self.host_to_switch and self.shard is not None:
+            self.sync_shard()
+        if dst not in self.host_to_switch:
+            # e.g. after a cold restart, until the host is seen in an ARP
+            self.logger.info("Unknown destination %s at %s", dst, dpid)
+            return
+
         # If the packet is IPV4, it means that the datapath is a LER
         # IPV4 packets that come trough in_port with this destination
-        match = parser.OFPMatch(eth_src = eth.src, in_port=in_port, eth_dst=dst, eth_type=eth.ethertype)
+        match = parser.OFPMatch(eth_src = hdr.eth_src, in_port=in_port, eth_dst=dst, eth_type=hdr.ethertype)
+        if AGGREGATE:
+            # Every source behind this LER shares the destination entry
+            match = parser.OFPMatch(eth_dst=dst, eth_type=hdr.ethertype)
+        idle_timeout = 0
+        flags = 0
+        flow_key = None
+        if FLOW_HASH:
+            flow_key = flowhash.five_tuple(hdr.ip_src, hdr.ip_dst, hdr.ip_proto,
+                                           hdr.l4_src, hdr.l4_dst)
+            match = parser.OFPMatch(in_port=in_port, **flowhash.match_fields(flow_key))
+            idle_timeout = FLOWLET_GAP if FLOWLET else FLOW_IDLE_TIMEOUT
+            # FlowRemoved releases the flow in the path selector
+            flags = ofproto.OFPFF_SEND_FLOW_REM
 
         # self.label = self.label + 1
         # self.switch_to_label[datapath.id][eth.dst] = self.label
 
         label = None
+        cookie = 0
         if self.host_to_switch[dst]['switch'] == dpid:
             out_port = self.host_to_switch[dst]['port']
             actions = [parser.OFPActionOutput(out_port)]
         else:
+            cookie = self.host_to_switch[dst]['switch']
             # out_port = self.switch_to_port[dpid][self.host_to_switch[dst]['switch']]
             # choose label
             
-            paths_labels = self.switch_to_label[dpid][self.host_to_switch[dst]['switch']].keys()
-            label = paths_labels[0]
-            next_hop = self.switch_to_label[dpid][self.host_to_switch[dst]['switch']][label]['next_hop']
+            label = self.select_label(dpid, self.host_to_switch[dst]['switch'])
+            if label is None:
+                self.logger.info("No route from %s to %s", dpid, self.host_to_switch[dst]['switch'])
+                return
+            if FLOW_HASH:
+                labels = self.label_table.labels(dpid, self.host_to_switch[dst]['switch'])
+                choices = dict((l, (dpid, nh)) for (l, nh, cost) in labels)
+                label = self.path_selector.select((dpid, flow_key), choices)
+            next_hop = self.label_table.next_hop(dpid, self.host_to_switch[dst]['switch'], label)
+            if not self.net.has_edge(dpid, next_hop):
+                # The link is gone and the route pool has not replaced the
+                # labels yet, the next packet-in gets the new routes
+                self.logger.info("Next hop %s of %s is down", next_hop, dpid)
+                if FLOW_HASH:
+                    self.path_selector.release((dpid, flow_key), forget=True)
+                return
             out_port = self.net[dpid][next_hop]['port']
             # Set the action to be performed by the datapath
-            actions = [parser.OFPActionPushMpls(ethertype=34887,type_=None, len_=None),
-                parser.OFPActionSetField(mpls_label=label),
-                parser.OFPActionOutput(out_port)]
+            actions = None
+            if SEGMENT_ROUTING:
+                actions = self.segment_actions(datapath, self.host_to_switch[dst]['switch'], label)
+            if actions is None and self.use_groups and not FLOW_HASH:
+                # The group buckets set the label and the output port
+                group_id = self.ensure_group(datapath, self.host_to_switch[dst]['switch'])
+                actions = [parser.OFPActionPushMpls(ethertype=34887,type_=None, len_=None),
+                    parser.OFPActionGroup(group_id)]
+            elif actions is None:
+                actions = [parser.OFPActionPushMpls(ethertype=34887,type_=None, len_=None),
+                    parser.OFPActionSetField(mpls_label=label),
+                    parser.OFPActionOutput(out_port)]
+
+            if PROACTIVE:
+                # Every switch after the ingress LER already has its label
+                # entry, each would have sent one packet-in for this entry's
+                # first packet. The ingress datapath is the only label, a
+                # (src, dst) label would add a series per flow
+                avoided = proactive.hops(self.label_table, dpid,
+                                         self.host_to_switch[dst]['switch'], label)
+                self.metrics.inc('packet_ins_avoided_total', (('dpid', dpid),), avoided)
 
         
         # self.logger.info("Flow match: in_port=%s, dst=%s, type=IP",in_port, dst)
@@ -338,16 +942,50 @@ class SimpleSwitch(app_manager.RyuApp):
 
         # Install a flow# verify if we have a valid buffer_id, if yes avoid to send both
         # flow_mod & packet_out
-        self.add_flow(datapath, match, actions, priority, msg.buffer_id)
+        self.add_flow(datapath, match, actions, priority, msg.buffer_id, cookie,
+                      idle_timeout=idle_timeout, flags=flags, rule_class='ipv4')
 
         data = None 
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
 
         out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,in_port=in_port, actions=actions, data=data)
-        datapath.send_msg(out)
+        self.southbound.send_msg(datapath, out)
 
-    def mplsHandler(self, msg):
+    def segment_actions(self, datapath, dst, label):
+        """Push actions of the adjacency label stack from datapath to the
+        destination switch along label, None if the stack is too deep."""
+        parser = datapath.ofproto_parser
+        nodes = segments.path(self.label_table, datapath.id, dst, label)
+        if nodes is None or len(nodes) - 2 > SR_MAX_DEPTH:
+            return None
+        if not all(self.net.has_edge(u, v) for (u, v) in zip(nodes, nodes[1:])):
+            return None
+        self.segment_paths.setdefault((datapath.id, dst), set()).update(nodes)
+        actions = []
+        # The bottom label is pushed first
+        for adjacency in reversed(segments.label_stack(self.net, nodes)):
+            actions += [parser.OFPActionPushMpls(ethertype=34887),
+                        parser.OFPActionSetField(mpls_label=adjacency)]
+        actions.append(parser.OFPActionOutput(self.net[datapath.id][nodes[1]]['port']))
+        return actions
+
+    def install_adjacency(self, dpid, port):
+        """Installs the pop and output entries of the adjacency label of port."""
+        datapath = self.datapaths.get(dpid)
+        if datapath is None or port in self.adjacencies.get(dpid, ()):
+            return
+        parser = datapath.ofproto_parser
+        self.adjacencies.setdefault(dpid, set()).add(port)
+        label = segments.adjacency_label(port)
+        # Below the bottom of the stack is the IPv4 packet
+        for (bos, ethertype) in ((0, 34887), (1, 2048)):
+            match = parser.OFPMatch(eth_type=34887, mpls_label=label, mpls_bos=bos)
+            actions = [parser.OFPActionPopMpls(ethertype), parser.OFPActionOutput(port)]
+            self.add_flow(datapath, match, actions, HIGH)
+
+    @timed('mplsHandler')
+    def mplsHandler(self, msg, hdr):
         datapath = msg.datapath
         ofproto = datapath.ofproto
         in_port = msg.match['in_port']
@@ -356,15 +994,21 @@ class SimpleSwitch(app_manager.RyuApp):
 
         self.logger.info("Launching MPLS Handler for datatpath%s", dpid)
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
+        dst = hdr.eth_dst
+        ethtype = hdr.ethertype
 
-        mpls_proto = pkt.get_protocol(mpls.mpls)
-        dst = eth.dst
-        ethtype = eth.ethertype
+        if segments.is_adjacency_label(hdr.mpls_label):
+            # The entries of the port are installed when its link is discovered
+            self.logger.info("No adjacency entry for label %s at %s", hdr.mpls_label, dpid)
+            return
+        if dst not in self.host_to_switch and self.shard is not None:
+            self.sync_shard()
+        if dst not in self.host_to_switch:
+            self.logger.info("Unknown destination %s at %s", dst, dpid)
+            return
 
         # The switch can be a LSR or a LER, but the match is the same
-        match = parser.OFPMatch(in_port=in_port, eth_dst=dst, eth_type=ethtype,mpls_label=mpls_proto.label)
+        match = parser.OFPMatch(in_port=in_port, eth_dst=dst, eth_type=ethtype,mpls_label=hdr.mpls_label)
 
         # self.logger.info("Flow match: in_port=%s, dst=%s, type=IP, label=%s",in_port, dst, mpls_proto.label)
 
@@ -373,25 +1017,42 @@ class SimpleSwitch(app_manager.RyuApp):
         # self.logger.info("Source Swith Dst: " + str(self.host_to_switch[dst]['switch']))
         # self.logger.info("dpid: " + str(dpid))
 
+        cookie = 0
         if self.host_to_switch[dst]['switch'] != dpid:
+            cookie = self.host_to_switch[dst]['switch']
             # out_port = self.switch_to_port[dpid][self.host_to_switch[dst]['switch']]
             #Choose label
-            paths_labels = self.switch_to_label[dpid][self.host_to_switch[dst]['switch']].keys()
-            label = paths_labels[0]
-            next_hop = self.switch_to_label[dpid][self.host_to_switch[dst]['switch']][label]['next_hop']
+            label = self.select_label(dpid, self.host_to_switch[dst]['switch'])
+            if label is None:
+                self.logger.info("No route from %s to %s", dpid, self.host_to_switch[dst]['switch'])
+                return
+            next_hop = self.label_table.next_hop(dpid, self.host_to_switch[dst]['switch'], label)
+            if not self.net.has_edge(dpid, next_hop):
+                self.logger.info("Next hop %s of %s is down", next_hop, dpid)
+                return
             out_port = self.net[dpid][next_hop]['port']
+            if AGGREGATE:
+                # Labels are allocated fabric wide, the incoming label alone
+                # identifies the destination switch
+                match = parser.OFPMatch(eth_type=ethtype, mpls_label=hdr.mpls_label)
 
             #The switch is LSR
             #Create New Label
             # self.label = self.label + 1
-            actions = [parser.OFPActionPopMpls(),
-                        parser.OFPActionPushMpls(),
-                        parser.OFPActionSetField(mpls_label=label),
-                        parser.OFPActionOutput(out_port)]
+            if self.use_groups:
+                group_id = self.ensure_group(datapath, self.host_to_switch[dst]['switch'])
+                actions = [parser.OFPActionGroup(group_id)]
+            else:
+                actions = [parser.OFPActionPopMpls(),
+                            parser.OFPActionPushMpls(),
+                            parser.OFPActionSetField(mpls_label=label),
+                            parser.OFPActionOutput(out_port)]
             # self.logger.info("Flow actions: switchMPLS=%s, out_port=%s",label, out_port)
         else:
             # self.logger.info("Edge Router>>>>>>>>")
             out_port = self.host_to_switch[dst]['port']
+            if AGGREGATE:
+                match = parser.OFPMatch(eth_dst=dst, eth_type=ethtype, mpls_label=hdr.mpls_label)
             #The switc is LER
             #Pop Label
             actions = [parser.OFPActionPopMpls(),
@@ -399,13 +1060,228 @@ class SimpleSwitch(app_manager.RyuApp):
             # self.logger.info("Flow actions: popMPLS, out_port=%s", out_port)
         priority = HIGH
         # Install a flow
-        self.add_flow(datapath, match, actions, priority, msg.buffer_id)
+        self.add_flow(datapath, match, actions, priority, msg.buffer_id, cookie, rule_class='label')
 
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
         out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,in_port=in_port, actions=actions, data=data)
-        datapath.send_msg(out)
+        self.southbound.send_msg(datapath, out)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    @flushing
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        self.shadow.flow_removed(msg.datapath.id, msg.table_id, msg.priority, msg.match)
+        flow_key = flowhash.match_key(msg.match)
+        if flow_key is not None:
+            self.path_selector.release((msg.datapath.id, flow_key), msg.byte_count)
+
+    def _flow_stats_monitor(self):
+        while True:
+            hub.sleep(FLOW_STATS_INTERVAL)
+            self.request_flow_stats()
+
+    @flushing
+    def request_flow_stats(self):
+        for datapath in list(self.datapaths.values()):
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            self.shadow.begin_sync(datapath.id)
+            req = parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                             ofproto.OFPG_ANY, 0, 0, parser.OFPMatch())
+            self.southbound.send_msg(datapath, req)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    @flushing
+    def _flow_stats_reply_handler(self, ev):
+        msg = ev.msg
+        more = msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE
+        dpid = msg.datapath.id
+        if dpid in self.reconciling:
+            self.reconciling[dpid].extend(msg.body)
+            if not more:
+                self.reconcile_flows(msg.datapath, self.reconciling.pop(dpid))
+            return
+        self.shadow.sync(dpid, msg.body, more)
+
+    @set_ev_cls(ofp_event.EventOFPGroupDescStatsReply, MAIN_DISPATCHER)
+    @flushing
+    def _group_desc_stats_reply_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        if dpid not in self.reconciling_groups:
+            return
+        self.reconciling_groups[dpid].extend(msg.body)
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            self.reconcile_groups(msg.datapath, self.reconciling_groups.pop(dpid))
+
+    def request_reconcile(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        self.reconciling[datapath.id] = []
+        req = parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                         ofproto.OFPG_ANY, 0, 0, parser.OFPMatch())
+        self.southbound.send_msg(datapath, req)
+        self.reconciling_groups[datapath.id] = []
+        self.southbound.send_msg(datapath, parser.OFPGroupDescStatsRequest(datapath, 0))
+
+    def reconcile_flows(self, datapath, stats):
+        """Keeps the entries of a restored switch that are in the snapshot
+        or were installed since the restart, deletes the others. Reactive
+        entries the switch lost are learned again, the others installed."""
+        dpid = datapath.id
+        expected = self.restored_flows.pop(dpid, {})
+        present = set()
+        deleted = 0
+        for stat in stats:
+            key = (stat.table_id, stat.priority, shadow.match_key(stat.match))
+            instructions = shadow.instructions_key(stat.instructions)
+            fingerprint = snapshot.flow_fingerprint(key, stat.cookie, instructions)
+            if fingerprint in expected:
+                present.add(fingerprint)
+            if self.shadow.has(dpid, key):
+                # Installed again since the restart
+                continue
+            label = stat.match.get('mpls_label')
+            if (fingerprint in expected and
+                    (label is None or label in self.labels.in_use or
+                     segments.is_adjacency_label(label))):
+                self.shadow.restore(dpid, key, instructions, stat, expected[fingerprint])
+                continue
+            # Not in the snapshot, or matching a label retired before it
+            # whose entries were still draining
+            self.delete_flow(datapath, stat.match, stat.priority, stat.table_id)
+            deleted += 1
+        lost = [f for (f, evictable) in expected.items() if not evictable and f not in present]
+        if lost:
+            self.adjacencies.pop(dpid, None)
+            self.label_state.pop(dpid, None)
+            if SEGMENT_ROUTING:
+                for (u, v, port) in self.net.out_edges(dpid, data='port'):
+                    self.install_adjacency(dpid, port)
+            for (mac, host) in self.host_to_switch.items():
+                if host['switch'] == dpid:
+                    self.install_host(datapath, mac, host['port'])
+        if PROACTIVE:
+            # Only the entries that differ from label_state are sent
+            self.install_label_fabric([dpid])
+        for dst in self.restore_flush.pop(dpid, ()):
+            self.delete_flows(datapath, dst)
+        self.restore_stats['kept'] += len(present)
+        self.restore_stats['deleted'] += deleted
+        self.restore_stats['lost'] += len(lost)
+        self.logger.info("Reconciled %s: %d entries kept, %d deleted, %d lost", dpid,
+                         len(present), deleted, len(lost))
+
+    def reconcile_groups(self, datapath, stats):
+        """Deletes the groups of a restored switch that are not in the
+        snapshot, adds the missing ones and fixes the buckets of the others."""
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        groups = self.groups.get(datapath.id, {})
+        by_id = dict((g['group_id'], dst) for (dst, g) in groups.items())
+        fixed = 0
+        for stat in stats:
+            dst = by_id.pop(stat.group_id, None)
+            if dst is None:
+                req = parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE, stat.type, stat.group_id)
+                self.southbound.send_msg(datapath, req)
+                fixed += 1
+            elif (not self.label_table.has_labels(datapath.id, dst) or
+                  stat.type != groups[dst]['type'] or
+                  shadow.instructions_key(stat.buckets) !=
+                  shadow.instructions_key(self.group_buckets(datapath, dst))):
+                self.update_group(datapath, dst)
+                fixed += 1
+        for dst in by_id.values():
+            # Kept entries may point at it
+            if self.label_table.has_labels(datapath.id, dst):
+                req = parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, groups[dst]['type'],
+                                         groups[dst]['group_id'],
+                                         self.group_buckets(datapath, dst))
+                self.southbound.send_msg(datapath, req)
+            else:
+                del groups[dst]
+            fixed += 1
+        self.restore_stats['groups'] += fixed
+
+    def _monitor(self):
+        while True:
+            for datapath in list(self.datapaths.values()):
+                parser = datapath.ofproto_parser
+                req = parser.OFPPortStatsRequest(datapath, 0, datapath.ofproto.OFPP_ANY)
+                self.southbound.send_msg(datapath, req)
+            self.southbound.flush()
+            self.apply_link_costs()
+            hub.sleep(PORT_STATS_INTERVAL)
+
+    def _table_monitor(self):
+        while True:
+            self.request_table_stats()
+            hub.sleep(TABLE_STATS_INTERVAL)
+
+    @flushing
+    def request_table_stats(self):
+        for datapath in list(self.datapaths.values()):
+            req = datapath.ofproto_parser.OFPTableStatsRequest(datapath, 0)
+            self.southbound.send_msg(datapath, req)
+
+    @set_ev_cls(ofp_event.EventOFPTableStatsReply, MAIN_DISPATCHER)
+    def _table_stats_reply_handler(self, ev):
+        # Only the tables in use, OVS reports all 254 of them
+        self.table_occupancy[ev.msg.datapath.id] = dict(
+            (stat.table_id, stat.active_count) for stat in ev.msg.body if stat.active_count)
+
+    def get_table_occupancy(self):
+        switches = dict((dpid, {'tables': tables, 'total': sum(tables.values())})
+                        for (dpid, tables) in self.table_occupancy.items())
+        totals = [sw['total'] for sw in switches.values()]
+        return {'switches': switches,
+                'total': sum(totals),
+                'max': max(totals) if totals else 0}
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def _port_desc_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        for port in ev.msg.body:
+            # curr_speed is in kbit/s
+            self.link_costs.set_speed(dpid, port.port_no, port.curr_speed * 1000)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        if dpid not in self.net:
+            return
+        # Output port of every link leaving the switch
+        links = dict((attrs['port'], nh) for (nh, attrs) in self.net[dpid].items())
+        for stat in ev.msg.body:
+            if stat.port_no not in links:
+                continue
+            now = stat.duration_sec + stat.duration_nsec * 1e-9
+            cost = self.link_costs.update(dpid, stat.port_no, stat.tx_bytes, now)
+            if cost is not None:
+                self.logger.info("Link %s -> %s cost %d", dpid, links[stat.port_no], cost)
+                self.cost_pending.add((dpid, links[stat.port_no]))
+
+    @flushing
+    def apply_link_costs(self):
+        """Moves the pending link costs into the graph, rate limited to one
+        route update every COST_UPDATE_INTERVAL seconds."""
+        now = time.time()
+        if not self.cost_pending or now - self.cost_updated < COST_UPDATE_INTERVAL:
+            return
+        pending = self.cost_pending
+        self.cost_pending = set()
+        self.cost_updated = now
+        affected = set()
+        for (src, dst) in pending:
+            if not self.net.has_edge(src, dst):
+                continue
+            attrs = dict(self.net[src][dst])
+            attrs['cost'] = self.link_costs.cost(src, attrs['port'])
+            affected |= self.add_link(src, dst, attrs)
+        self.update_routes(affected)
 
     @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
     def _port_status_handler(self, ev):
@@ -423,94 +1299,772 @@ class SimpleSwitch(app_manager.RyuApp):
         else:
             self.logger.info("Illeagal port state %s %s", port_no, reason)
 
+        down = (reason == ofproto.OFPPR_DELETE or
+                msg.desc.state & ofproto.OFPPS_LINK_DOWN or
+                msg.desc.config & ofproto.OFPPC_PORT_DOWN)
+        if down:
+            # The fast failover groups already moved the traffic, the labels
+            # are repaired outside of the event handler
+            links = [(u, v) for (u, v, port) in self.net.out_edges(msg.datapath.id, data='port')
+                     if port == port_no]
+            if links:
+                hub.spawn(self.repair_links, links)
+
+    @flushing
+    def repair_links(self, links):
+        """Removes the links of a port that went down in both directions,
+        before the topology discovery notices it."""
+        affected = set()
+        for (u, v) in links:
+            affected |= self.remove_link(u, v)
+            affected |= self.remove_link(v, u)
+        self.logger.info("Port down, links %s removed, %d sources affected", links, len(affected))
+        self.update_routes(affected)
+
     @set_ev_cls(event.EventSwitchEnter)
+    @timed('handler_switch_enter')
+    @flushing
     def handler_switch_enter(self, ev):
-        self.net.clear()
-        self.switch_to_label.clear()
-        # The Function get_switch(self, None) outputs the list of switches.
-        topo_raw_switches = get_switch(self, None)
+        dpid = ev.switch.dp.id
+        affected = self.spf.add_switch(dpid)
         # The Function get_link(self, None) outputs the list of links.
-        topo_raw_links = get_link(self, None)
-
-        links = [(link.src.dpid, link.dst.dpid, {'port': link.src.port_no, 'cost': 1}) for link in topo_raw_links]
-        switches = [i.dp.id for i in topo_raw_switches]
-
-        self.logger.info("Switches: %d --------------------------", len(switches))
-        self.logger.info(str(switches))
-        self.logger.info("---------------------------------------")
-        self.logger.info("Links: %d -----------------------------", len(links))
-        self.logger.info(str(links))
-        self.logger.info("---------------------------------------")
-
-        self.net.add_nodes_from(switches)
-        self.net.add_edges_from(links)
-
-        self.set_root_ports(switches)
-        self.logger.info("Root Ports: >>>>>>>>>>>>>>>>>>>>>>")
-        self.logger.info(str(self.switch_to_port))
-
-        del topo_raw_links
-        del topo_raw_switches
-
-        r = self.dijsktra(self.net, switches[0])
-        self.logger.info("SW: %s =============================================>", str(switches[0]))
-        self.logger.info(str(r))
-
-        self.compute_labels(switches)
-        
-
-    def set_root_ports(self, switches):
-        for sw in switches:
-            self.switch_to_port.setdefault(sw, {})
-            for i in switches:
-                if i == sw:
-                    continue
-                #Set root port
-                path = nx.shortest_path(self.net, sw, i)
-                next_hop = path[path.index(sw)+1]
-                root_port = self.net[sw][next_hop]['port']
-                self.switch_to_port[sw][i] = root_port
-
-    def compute_labels(self, switches):
-        for src in switches:
-            label = 21
-            r = self.dijsktra(self.net, src)
-            self.switch_to_label.setdefault(src, {})
-            for dst in r.keys():
-                if dst == src:
+        # Links discovered before this event are picked up as deltas too.
+        for link in get_link(self, None):
+            affected |= self.add_link(link.src.dpid, link.dst.dpid,
+                                      {'port': link.src.port_no,
+                                       'cost': self.link_costs.cost(link.src.dpid,
+                                                                    link.src.port_no)})
+            if SEGMENT_ROUTING:
+                self.install_adjacency(link.src.dpid, link.src.port_no)
+
+        self.logger.info("Switch enter: %s, switches: %d, links: %d", dpid,
+                         self.net.number_of_nodes(), self.net.number_of_edges())
+        self.update_routes(affected)
+
+    @set_ev_cls(event.EventSwitchLeave)
+    @flushing
+    def handler_switch_leave(self, ev):
+        dpid = ev.switch.dp.id
+        self.logger.info("Switch leave: %s", dpid)
+        (affected, retired) = self.remove_switch(dpid)
+        self.update_routes(affected)
+        self.schedule_break(retired, {})
+
+    def remove_switch(self, dpid):
+        """Forgets dpid, returns the affected sources and the retired
+        (label, next_hop) pairs."""
+        affected = self.spf.remove_switch(dpid)
+        self.datapaths.pop(dpid, None)
+        self.label_table.remove_ports(dpid)
+        retired = self.label_table.remove_source(dpid)
+        self.label_state.pop(dpid, None)
+        self.groups.pop(dpid, None)
+        self.link_costs.forget(dpid)
+        self.table_occupancy.pop(dpid, None)
+        self.shadow.forget(dpid)
+        self.adjacencies.pop(dpid, None)
+        self.restored_flows.pop(dpid, None)
+        self.restore_flush.pop(dpid, None)
+        return (affected, retired)
+
+    @set_ev_cls(event.EventLinkAdd)
+    @flushing
+    def handler_link_add(self, ev):
+        link = ev.link
+        affected = self.add_link(link.src.dpid, link.dst.dpid,
+                                 {'port': link.src.port_no,
+                                  'cost': self.link_costs.cost(link.src.dpid,
+                                                               link.src.port_no)})
+        if SEGMENT_ROUTING:
+            self.install_adjacency(link.src.dpid, link.src.port_no)
+        self.update_routes(affected)
+
+    @set_ev_cls(event.EventLinkDelete)
+    @flushing
+    def handler_link_delete(self, ev):
+        link = ev.link
+        self.logger.info("Link delete: %s -> %s", link.src.dpid, link.dst.dpid)
+        affected = self.remove_link(link.src.dpid, link.dst.dpid)
+        self.update_routes(affected)
+
+    def add_link(self, src, dst, attrs):
+        """Adds or updates a link, shared with the other shards, returns the
+        affected sources."""
+        if self.shard is not None and not (self.net.has_edge(src, dst) and
+                                           self.net[src][dst] == attrs):
+            self.shard.publish(('link', src, dst), attrs)
+        return self.spf.add_link(src, dst, attrs)
+
+    def remove_link(self, src, dst):
+        if self.shard is not None and self.net.has_edge(src, dst):
+            self.shard.publish(('link', src, dst), None)
+        return self.spf.remove_link(src, dst)
+
+    def update_routes(self, sources):
+        if self.shard is not None:
+            # The other shards compute the routes of their switches
+            sources = set(src for src in sources if self.shard.owns(src))
+        if self.route_pool is not None:
+            # install_routes is called back once the workers are done
+            self.route_pool.request(sources)
+            return
+        if not sources:
+            return
+        start = time.time()
+        changed = self.spf.update(sources)
+        self.metrics.observe('route_computation_seconds', time.time() - start)
+        self.install_routes(changed)
+
+    def pool_routes(self, changed):
+        self.metrics.observe('route_computation_seconds', self.route_pool.last_time)
+        self.install_routes(changed)
+
+    @flushing
+    def install_routes(self, changed):
+        self.set_root_ports(changed)
+        retired = self.compute_labels(changed)
+        if self.shard is not None:
+            for src in changed:
+                for dst in changed[src]:
+                    self.shard.publish(('labels', src, dst),
+                                       self.label_table.labels(src, dst) or None)
+
+        # Make: groups and label entries of the new labels are installed
+        # before any entry of the old labels is removed
+        for src in changed:
+            datapath = self.datapaths.get(src)
+            if datapath is None:
+                continue
+            for dst in changed[src]:
+                if dst in self.groups.get(src, {}):
+                    self.update_group(datapath, dst)
+
+        stale = {}
+        if PROACTIVE:
+            # Label entries depend on the switch's own labels and on the
+            # labels pushed towards it by its upstream neighbours
+            switches = set(changed)
+            for src in changed:
+                if src in self.net:
+                    switches.update(self.net.successors(src))
+            stale = self.install_label_fabric(self.local_switches(switches))
+
+        # Switch: entries of (src, dst) pairs whose routes changed are
+        # flushed and re-learned with the new labels
+        flushed = 0
+        for src in changed:
+            datapath = self.datapaths.get(src)
+            if datapath is None:
+                continue
+            for dst in changed[src]:
+                self.delete_flows(datapath, dst)
+                flushed += 1
+        flushed += self.flush_segment_paths(changed)
+        self.logger.info("Routes updated for %d sources, %d (src, dst) pairs flushed",
+                         len(changed), flushed)
+
+        # Break: the old labels go once the new paths carry the traffic
+        self.schedule_break(retired, stale)
+
+    def flush_segment_paths(self, changed):
+        """Flushes the stacks pushed at ingress switches that cross a changed
+        route, returns the number of flushed (ingress, dst) pairs."""
+        flushed = 0
+        for ((ingress, dst), nodes) in list(self.segment_paths.items()):
+            if not any(dst in changed.get(sw, ()) for sw in nodes):
+                continue
+            del self.segment_paths[(ingress, dst)]
+            datapath = self.datapaths.get(ingress)
+            # The pairs of changed routes are flushed already
+            if datapath is not None and dst not in changed.get(ingress, ()):
+                self.delete_flows(datapath, dst)
+                flushed += 1
+        return flushed
+
+    def local_switches(self, switches):
+        """The switches of this shard. The label entries of the others are
+        installed by their shard, the call is forwarded to it."""
+        if self.shard is None:
+            return switches
+        remote = {}
+        for dpid in switches:
+            owner = self.shard.owner(dpid)
+            if owner != self.shard.id:
+                remote.setdefault(owner, []).append(dpid)
+        for (owner, dpids) in remote.items():
+            self.shard.send(owner, 'install_label_fabric', sorted(dpids))
+        return [dpid for dpid in switches if self.shard.owns(dpid)]
+
+    def schedule_break(self, retired, stale):
+        if not retired and not stale:
+            return
+        if MBB_DELAY > 0:
+            hub.spawn_after(MBB_DELAY, self.break_labels, retired, stale)
+        else:
+            self.break_labels(retired, stale)
+
+    @flushing
+    def break_labels(self, retired, stale):
+        """Removes the entries of retired (label, next_hop) pairs and stale
+        proactive entries, then releases the labels."""
+        remote = {}
+        for (label, next_hop) in retired:
+            datapath = self.datapaths.get(next_hop)
+            if datapath is not None:
+                match = datapath.ofproto_parser.OFPMatch(eth_type=34887, mpls_label=label)
+                self.delete_flows(datapath, match=match)
+            elif self.shard is not None and label in self.labels.in_use and next_hop in self.net:
+                # Every shard removes the entries of its switches after a
+                # switch leaves, the labels of route changes are handed over
+                remote.setdefault(self.shard.owner(next_hop), []).append((label, next_hop))
+            self.labels.release(label)
+        for (owner, pairs) in remote.items():
+            if owner != self.shard.id:
+                self.shard.send(owner, 'break_labels', pairs, {})
+
+        for (dpid, keys) in stale.items():
+            datapath = self.datapaths.get(dpid)
+            if datapath is None:
+                continue
+            parser = datapath.ofproto_parser
+            for (in_port, label) in keys:
+                # The entry may have been installed again in the meantime
+                if (in_port, label) in self.label_state.get(dpid, {}):
                     continue
-                self.switch_to_label[src].setdefault(dst, {})
-                for path in r[dst]:
-                    self.switch_to_label[src][dst][label] = {'next_hop': path[0], 'cost': path[1]}
-                    label += 1
-        self.logger.info("LABELS COMPUTED &&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&")
-        self.logger.info(str(self.switch_to_label))
-        self.logger.info("LABELS COMPUTED &&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&")
-
-    def dijsktra(self, G, source_node):
-        routes = {}
-        unvisited = [(0, source_node, source_node)]
-        visited = set()
+                match = parser.OFPMatch(in_port=in_port, eth_type=34887, mpls_label=label)
+                self.delete_flow(datapath, match, HIGH)
+        self.logger.info("Labels retired: %d, %s", len(retired), self.labels.stats())
+
+    def select_label(self, dpid, dst):
+        # The cheapest path, switches after the first hop rely on it
+        return self.label_table.select(dpid, dst)
+
+    def group_labels(self, dpid, dst, group_type):
+        """Labels of the buckets of a (dpid, dst) group. A select group is
+        used by every switch on the way, so it only gets the next hops
+        closer to dst than dpid."""
+        labels = self.label_table.labels(dpid, dst)
+        if group_type == ofproto_v1_3.OFPGT_FF:
+            return [l for (l, nh, cost) in labels]
+        best = self.spf.dist(dpid, dst)
+        return [l for (l, nh, cost) in labels
+                if kpaths.downstream(cost, self.net[dpid][nh]['cost'], best)]
+
+    def install_label_fabric(self, switches):
+        """Installs the new and changed label entries of switches, returns
+        {dpid: [(in_port, label)]} of the entries that are no longer needed."""
+        installed = 0
+        stale = {}
+        for dpid in switches:
+            datapath = self.datapaths.get(dpid)
+            if datapath is None or dpid not in self.net:
+                continue
+            parser = datapath.ofproto_parser
+            old = self.label_state.get(dpid, {})
+            new = proactive.label_entries(self.net, self.label_table, dpid)
+            install, remove = proactive.diff(old, new)
+
+            for ((in_port, label), (dst, out_label, out_port)) in install.items():
+                match = parser.OFPMatch(in_port=in_port, eth_type=34887, mpls_label=label)
+                if out_label is None:
+                    #The switch is the egress LER
+                    actions = [parser.OFPActionPopMpls()]
+                    self.add_flow(datapath, match, actions, HIGH, cookie=PROACTIVE_COOKIE | dst,
+                                  goto_table=EGRESS_TABLE)
+                else:
+                    if self.use_groups:
+                        actions = [parser.OFPActionGroup(self.ensure_group(datapath, dst))]
+                    else:
+                        actions = [parser.OFPActionPopMpls(),
+                                   parser.OFPActionPushMpls(),
+                                   parser.OFPActionSetField(mpls_label=out_label),
+                                   parser.OFPActionOutput(out_port)]
+                    self.add_flow(datapath, match, actions, HIGH, cookie=PROACTIVE_COOKIE | dst)
+            self.label_state[dpid] = new
+            installed += len(install)
+            if remove:
+                stale[dpid] = remove
+        self.logger.info("Label fabric: %d entries installed, %d stale", installed,
+                         sum(len(keys) for keys in stale.values()))
+        return stale
+
+    def group_buckets(self, datapath, dst):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        dpid = datapath.id
 
-        while unvisited:
-            (cost, dst, nh) = heappop(unvisited)
-            if dst not in visited or cost == routes[dst][0][1]:
-                visited.add(dst)
-                if nh == source_node: 
-                    nh = dst
+        group = self.groups[dpid][dst]
+        labels = self.group_labels(dpid, dst, group['type'])
+        if group['type'] == ofproto.OFPGT_FF:
+            # The first bucket whose port is up is used
+            primary = self.select_label(dpid, dst)
+            labels.remove(primary)
+            labels.insert(0, primary)
+        buckets = []
+        for label in labels:
+            next_hop = self.label_table.next_hop(dpid, dst, label)
+            if not self.net.has_edge(dpid, next_hop):
+                # Until the routes are recomputed without the link
+                continue
+            out_port = self.net[dpid][next_hop]['port']
+            actions = [parser.OFPActionSetField(mpls_label=label),
+                       parser.OFPActionOutput(out_port)]
+            if group['type'] == ofproto.OFPGT_FF:
+                buckets.append(parser.OFPBucket(weight=0, watch_port=out_port,
+                                                watch_group=ofproto.OFPG_ANY,
+                                                actions=actions))
+                continue
+            buckets.append(parser.OFPBucket(weight=group['weights'].get(label, 1),
+                                            watch_port=ofproto.OFPP_ANY,
+                                            watch_group=ofproto.OFPG_ANY,
+                                            actions=actions))
+        return buckets
+
+    def group_type(self, ofproto):
+        """Type of the groups added from now on."""
+        if FAST_FAILOVER and not ECMP:
+            return ofproto.OFPGT_FF
+        return ofproto.OFPGT_SELECT
+
+    def ensure_group(self, datapath, dst):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        groups = self.groups.setdefault(datapath.id, {})
+
+        if dst not in groups:
+            group_id = max([g['group_id'] for g in groups.values()] + [0]) + 1
+            group_type = self.group_type(ofproto)
+            groups[dst] = {'group_id': group_id, 'type': group_type, 'weights': {}}
+            req = parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, group_type,
+                                     group_id, self.group_buckets(datapath, dst))
+            self.southbound.send_msg(datapath, req)
+        return groups[dst]['group_id']
+
+    def update_group(self, datapath, dst):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        group = self.groups[datapath.id][dst]
 
+        if not self.label_table.has_labels(datapath.id, dst):
+            req = parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE, group['type'],
+                                     group['group_id'])
+            self.southbound.send_msg(datapath, req)
+            del self.groups[datapath.id][dst]
+            return
+        # Forget the weights of labels that no longer exist
+        labels = set(l for (l, nh, cost) in self.label_table.labels(datapath.id, dst))
+        group['weights'] = dict((l, w) for (l, w) in group['weights'].items() if l in labels)
+        req = parser.OFPGroupMod(datapath, ofproto.OFPGC_MODIFY, group['type'],
+                                 group['group_id'], self.group_buckets(datapath, dst))
+        self.southbound.send_msg(datapath, req)
+
+    def get_group_weights(self, dpid):
+        groups = {}
+        for (dst, group) in self.groups.get(dpid, {}).items():
+            labels = []
+            if self.label_table.has_labels(dpid, dst):
+                labels = self.group_labels(dpid, dst, group['type'])
+            groups[dst] = {'group_id': group['group_id'],
+                           'weights': dict((l, group['weights'].get(l, 1)) for l in labels)}
+        return groups
+
+    @flushing
+    def set_group_weights(self, dpid, dst, weights):
+        """Sets the bucket weights of the (dpid, dst) group, weights is {label: weight}."""
+        datapath = self.datapaths.get(dpid)
+        if datapath is None or not self.label_table.has_labels(dpid, dst):
+            raise KeyError((dpid, dst))
+        ofproto = datapath.ofproto
+        # Checked before ensure_group, a rejected request adds no group
+        group = self.groups.get(dpid, {}).get(dst)
+        group_type = group['type'] if group else self.group_type(ofproto)
+        if group_type != ofproto.OFPGT_SELECT:
+            raise ValueError("the group of %s is not a select group" % dst)
+        buckets = self.group_labels(dpid, dst, ofproto.OFPGT_SELECT)
+        unknown = [l for l in weights if l not in buckets]
+        if unknown:
+            raise ValueError("unknown labels %s" % unknown)
+        # Bucket weights are 16 bit, nothing is stored unless all of them fit
+        invalid = [w for w in weights.values()
+                   if isinstance(w, bool) or not isinstance(w, int) or not 0 <= w <= 0xffff]
+        if invalid:
+            raise ValueError("invalid weights %s" % invalid)
+        self.ensure_group(datapath, dst)
+        self.groups[dpid][dst]['weights'].update(weights)
+        self.update_group(datapath, dst)
+        return self.get_group_weights(dpid)[dst]
+
+    def set_root_ports(self, changed):
+        for sw in changed:
+            routes = self.spf.routes[sw]
+            for i in changed[sw]:
+                if i not in routes:
+                    self.label_table.pop_root_port(sw, i)
+                    continue
+                # Keep the current root port while it is still on a shortest path
+                ports = [self.net[sw][nh]['port'] for (nh, cost) in routes[i]
+                         if cost == routes[i][0][1]]
+                if self.label_table.root_port(sw, i) not in ports:
+                    self.label_table.set_root_port(sw, i, ports[0])
+
+    def compute_labels(self, changed):
+        """Updates the labels of the changed pairs, returns the retired
+        (label, next_hop) pairs."""
+        retired = []
+        for src in changed:
+            routes = self.spf.routes[src]
+            for dst in changed[src]:
+                old = self.label_table.pop_labels(src, dst)
+                # Labels of next hops that are still used are kept
+                kept = dict((next_hop, label) for (label, next_hop, cost) in old)
                 if dst in routes:
-                    routes[dst].append((nh, cost))
+                    paths = []
+                    for (next_hop, cost) in routes[dst]:
+                        label = kept.pop(next_hop, None)
+                        if label is None:
+                            label = self.labels.allocate()
+                        paths.append((label, next_hop, cost))
+                    self.label_table.set_labels(src, dst, paths)
+                retired.extend((label, next_hop) for (next_hop, label) in kept.items())
+        self.logger.info("LABELS COMPUTED for %d sources", len(changed))
+        return retired
+
+    def register_metrics(self):
+        m = self.metrics
+        m.describe('packet_ins_total', "Packet-ins by datapath and ethertype")
+        m.describe('handler_seconds', "Run time of the packet-in and topology handlers")
+        m.describe('route_computation_seconds', "Time to compute the routes of a topology change")
+        m.describe('packet_ins_avoided_total',
+                   "Label path hops after the ingress LER of the push entries installed, "
+                   "summed per ingress datapath (not per flow)")
+        m.gauge('messages_sent_total', "OpenFlow messages sent by type",
+                lambda: dict(((('type', t),), n) for (t, n) in self.southbound.sent.items()),
+                'counter')
+        m.gauge('messages_dropped_total', "OpenFlow messages that failed to serialize",
+                lambda: self.southbound.errors, 'counter')
+        m.gauge('labels', "Labels in use, draining and free",
+                lambda: dict(((('state', k),), v) for (k, v) in self.labels.stats().items()))
+        m.gauge('label_table_entries', "(switch, destination switch, label) entries",
+                self.label_table.count)
+        m.gauge('hosts', "Learned hosts", lambda: len(self.host_to_switch))
+        m.gauge('switches', "Switches in the topology", lambda: self.net.number_of_nodes())
+        m.describe('snapshot_seconds', "Time to save a snapshot")
+        m.describe('snapshot_copy_seconds', "Time a snapshot holds the event loop to copy the state")
+        if self.shard is not None:
+            m.gauge('shard_entries', "Store entries published, applied, forwarded and received",
+                    lambda: dict(((('kind', k),), v) for (k, v) in self.shard.stats.items()),
+                    'counter')
+        if self.packet_in_queue is not None:
+            queue = self.packet_in_queue
+            m.gauge('packet_in_queue_length', "Packet-ins waiting to be handled", lambda: len(queue))
+            m.gauge('packet_ins_queued_total', "Packet-ins queued by class",
+                    lambda: dict(((('class', c),), n) for (c, n) in queue.queued.items()),
+                    'counter')
+            m.gauge('packet_ins_dropped_total', "Packet-ins dropped by the full queue by class",
+                    lambda: dict(((('class', c),), n) for (c, n) in queue.dropped.items()),
+                    'counter')
+            m.gauge('packet_ins_duplicate_total', "Copies of queued broadcasts dropped",
+                    lambda: queue.duplicates, 'counter')
+            m.describe('packet_in_wait_seconds', "Time packet-ins wait in the queue")
+        m.gauge('restored_entries', "Flow entries and groups of restored switches by outcome",
+                lambda: dict(((('result', k),), v) for (k, v) in self.restore_stats.items()),
+                'counter')
+
+    def _snapshot_monitor(self):
+        while True:
+            hub.sleep(SNAPSHOT_INTERVAL)
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        """Copies the state on the event loop, then writes it from a native
+        thread while the event loop goes on."""
+        with self.snapshot_lock:
+            start = time.time()
+            (tables, scalars, unhashed) = self.snapshot_state()
+            copied = time.time() - start
+            (size, fingerprints) = tpool.execute(self.write_snapshot, tables, scalars, unhashed)
+            elapsed = time.time() - start
+        # The entries are replaced, not changed, when their flow is modified
+        for ((dpid, key, state, entry), fingerprint) in zip(unhashed, fingerprints):
+            entry['fingerprint'] = fingerprint
+        self.metrics.observe('snapshot_copy_seconds', copied)
+        self.metrics.observe('snapshot_seconds', elapsed)
+        self.logger.info("Snapshot of %d labels, %d hosts and %d entries saved to %s "
+                         "(%d bytes) in %.3fs, %.3fs of them copying", len(tables['labels']),
+                         len(tables['hosts']), len(tables['flows']), SNAPSHOT_FILE, size,
+                         elapsed, copied)
+        return size
+
+    @staticmethod
+    def write_snapshot(tables, scalars, unhashed):
+        """Adds the flow entries not fingerprinted yet and saves the snapshot,
+        returns its size and their fingerprints. Runs in a native thread."""
+        fingerprints = [snapshot.flow_fingerprint(key, state[1], state[0])
+                        for (dpid, key, state, entry) in unhashed]
+        tables['flows'].extend((dpid, fingerprint, int(entry['evictable']))
+                               for ((dpid, key, state, entry), fingerprint)
+                               in zip(unhashed, fingerprints))
+        return (snapshot.save(SNAPSHOT_FILE, tables, scalars), fingerprints)
+
+    def snapshot_state(self):
+        """(tables, scalars) of snapshot.save(), copies of the state, and
+        the flow entries whose fingerprint is not cached yet."""
+        labels = []
+        for src in self.net:
+            for dst in self.label_table.destinations(src):
+                labels.extend((src, dst, label, nh, cost)
+                              for (label, nh, cost) in self.label_table.labels(src, dst))
+        flows = []
+        unhashed = []
+        for dpid in list(self.shadow.tables):
+            for (key, entry) in self.shadow.entries(dpid):
+                if 'fingerprint' in entry:
+                    flows.append((dpid, entry['fingerprint'], int(entry['evictable'])))
                 else:
-                    routes[dst] = [(nh, cost)]
-
-                for n in G.neighbors(dst):
-                    heappush(unvisited, (cost+G[dst][n]['cost'], n, nh))
-
-        return routes
-
-
-
-    
-
+                    unhashed.append((dpid, key, entry['state'], entry))
+        tables = {
+            'links': [(u, v, attrs['port'], attrs['cost'])
+                      for (u, v, attrs) in self.net.edges(data=True)],
+            'labels': labels,
+            'root_ports': list(self.label_table.root_ports()),
+            'draining': [(label,) for (until, label) in self.labels.draining],
+            'hosts': [(snapshot.mac_to_int(mac), h['switch'], h['port'])
+                      for (mac, h) in self.host_to_switch.items()],
+            'arp': [(snapshot.ip_to_int(ip), snapshot.mac_to_int(mac))
+                    for (ip, mac) in self.ip_to_mac.items()],
+            'label_entries': [(dpid, in_port, label, dst, out_label or 0, out_port or 0)
+                              for (dpid, entries) in self.label_state.items()
+                              for ((in_port, label), (dst, out_label, out_port)) in entries.items()],
+            'adjacencies': [(dpid, port) for (dpid, ports) in self.adjacencies.items()
+                            for port in ports],
+            'segment_paths': [(ingress, dst, node)
+                              for ((ingress, dst), nodes) in self.segment_paths.items()
+                              for node in nodes],
+            'groups': [(dpid, dst, g['group_id'], g['type'])
+                       for (dpid, groups) in self.groups.items() for (dst, g) in groups.items()],
+            'weights': [(dpid, dst, label, weight)
+                        for (dpid, groups) in self.groups.items() for (dst, g) in groups.items()
+                        for (label, weight) in g['weights'].items()],
+            'flows': flows,
+        }
+        return (tables, {'label_next': self.labels.next}, unhashed)
+
+    def restore_snapshot(self):
+        """Warm start from the state saved by save_snapshot(), the switches
+        are reconciled with it when they connect."""
+        loaded = snapshot.load(SNAPSHOT_FILE)
+        if loaded is None:
+            self.logger.info("No snapshot in %s, cold start", SNAPSHOT_FILE)
+            return
+        start = time.time()
+        (scalars, tables) = loaded
+        for (src, dst, port, cost) in tables['links'].tolist():
+            self.spf.add_link(src, dst, {'port': port, 'cost': cost})
+        paths = {}
+        for (src, dst, label, next_hop, cost) in tables['labels'].tolist():
+            paths.setdefault((src, dst), []).append((label, next_hop, cost))
+        for ((src, dst), p) in paths.items():
+            self.label_table.set_labels(src, dst, p)
+        for (sw, dst, port) in tables['root_ports'].tolist():
+            self.label_table.set_root_port(sw, dst, port)
+        self.labels.restore(scalars['label_next'], tables['labels'][:, 2].tolist(),
+                            tables['draining'][:, 0].tolist())
+        for (mac, dpid, port) in tables['hosts'].tolist():
+            self.host_to_switch[snapshot.int_to_mac(mac)] = {'switch': dpid, 'port': port}
+        for (ip, mac) in tables['arp'].tolist():
+            self.ip_to_mac[snapshot.int_to_ip(ip)] = snapshot.int_to_mac(mac)
+        for (dpid, in_port, label, dst, out_label, out_port) in tables['label_entries'].tolist():
+            self.label_state.setdefault(dpid, {})[(in_port, label)] = (
+                dst, out_label or None, out_port or None)
+        for (dpid, port) in tables['adjacencies'].tolist():
+            self.adjacencies.setdefault(dpid, set()).add(port)
+        for (ingress, dst, node) in tables['segment_paths'].tolist():
+            self.segment_paths.setdefault((ingress, dst), set()).add(node)
+        for (dpid, dst, group_id, group_type) in tables['groups'].tolist():
+            self.groups.setdefault(dpid, {})[dst] = {'group_id': group_id, 'type': group_type,
+                                                     'weights': {}}
+        for (dpid, dst, label, weight) in tables['weights'].tolist():
+            self.groups[dpid][dst]['weights'][label] = weight
+        for (dpid, fingerprint, evictable) in tables['flows'].tolist():
+            self.restored_flows.setdefault(dpid, {})[fingerprint] = bool(evictable)
+
+        # Pairs whose labels do not follow the routes of the restored
+        # topology (e.g. other KPATHS) get new ones, their entries and the
+        # stacks crossing them are flushed when the switches connect
+        changed = self.spf.update(list(self.net))
+        stale = {}
+        for (src, dsts) in changed.items():
+            routes = self.spf.routes[src]
+            for dst in dsts:
+                labels = self.label_table.labels(src, dst)
+                if sorted((nh, cost) for (l, nh, cost) in labels) != sorted(routes.get(dst, [])):
+                    stale.setdefault(src, set()).add(dst)
+        for ((ingress, dst), nodes) in self.segment_paths.items():
+            if any(dst in stale.get(sw, ()) for sw in nodes):
+                self.restore_flush.setdefault(ingress, set()).add(dst)
+        for (src, dsts) in stale.items():
+            self.restore_flush.setdefault(src, set()).update(dsts)
+        if stale:
+            self.install_routes(stale)
+        hub.spawn_after(RESTORE_GRACE, self.expire_restored)
+        self.logger.info("Restored %d switches, %d labels and %d hosts from %s in %.3fs, "
+                         "%d sources relabelled", self.net.number_of_nodes(),
+                         self.label_table.count(), len(self.host_to_switch), SNAPSHOT_FILE,
+                         time.time() - start, len(stale))
+
+    @flushing
+    def expire_restored(self):
+        """Removes the switches and links of the snapshot that were not
+        discovered again."""
+        links = set((link.src.dpid, link.dst.dpid) for link in get_link(self, None))
+        affected = set()
+        retired = []
+        for dpid in [d for d in self.net if d not in self.datapaths]:
+            (a, r) = self.remove_switch(dpid)
+            affected |= a
+            retired.extend(r)
+        for (u, v) in list(self.net.edges()):
+            if (u, v) not in links:
+                affected |= self.spf.remove_link(u, v)
+        self.restored_flows.clear()
+        self.logger.info("Restore grace over, %d sources affected", len(affected))
+        self.update_routes(affected)
+        self.schedule_break(retired, {})
+
+    def _shard_monitor(self):
+        while True:
+            hub.sleep(SHARD_SYNC_INTERVAL)
+            self.sync_shard()
+
+    @flushing
+    def sync_shard(self):
+        """Applies the links, hosts and labels published by the other shards
+        and runs the calls they forwarded to this one."""
+        (entries, calls) = self.shard.poll()
+        affected = set()
+        # Labels of other shards that changed, per source
+        changed = {}
+        for (key, value) in entries:
+            if key[0] == 'link':
+                (src, dst) = key[1:]
+                if value is None:
+                    affected |= self.spf.remove_link(src, dst)
+                    continue
+                if self.shard.owns(src):
+                    # The cost of a port is measured by the master of its switch
+                    value = dict(value, cost=self.link_costs.cost(src, value['port']))
+                affected |= self.spf.add_link(src, dst, value)
+                if SEGMENT_ROUTING:
+                    self.install_adjacency(src, value['port'])
+            elif key[0] == 'host':
+                if value is None:
+                    self.host_to_switch.pop(key[1], None)
+                else:
+                    self.host_to_switch[key[1]] = {'switch': value[0], 'port': value[1]}
+            elif key[0] == 'arp':
+                self.ip_to_mac[key[1]] = value
+            elif key[0] == 'labels':
+                (src, dst) = key[1:]
+                self.label_table.set_labels(src, dst, value or [])
+                changed.setdefault(src, set()).add(dst)
+        for (method, args) in calls:
+            if method == 'install_label_fabric':
+                self.schedule_break([], self.install_label_fabric(*args))
+            elif method == 'break_labels':
+                self.break_labels(*args)
+        self.flush_segment_paths(changed)
+        self.update_routes(affected)
+
+    def close(self):
+        if self.route_pool is not None:
+            self.route_pool.close()
+        if self.snapshots:
+            self.save_snapshot()
 
+    def dijsktra(self, G, source_node):
+        # One entry per distinct first hop, see ecmp.shortest_path_dag
+        return ecmp.dijsktra(G, source_node)
+
+
+class SimpleSwitchController(ControllerBase):
+
+    def __init__(self, req, link, data, **config):
+        super(SimpleSwitchController, self).__init__(req, link, data, **config)
+        self.simple_switch_app = data[simple_switch_instance_name]
+
+    @route('simpleswitch', '/simpleswitch/groups/{dpid}', methods=['GET'],
+           requirements={'dpid': dpid_lib.DPID_PATTERN})
+    def list_groups(self, req, **kwargs):
+        dpid = dpid_lib.str_to_dpid(kwargs['dpid'])
+        groups = self.simple_switch_app.get_group_weights(dpid)
+        body = json.dumps(dict((str(dst), g) for (dst, g) in groups.items()))
+        return Response(content_type='application/json', body=body)
+
+    @route('simpleswitch', '/simpleswitch/groups/{dpid}/{dst}', methods=['PUT'],
+           requirements={'dpid': dpid_lib.DPID_PATTERN, 'dst': dpid_lib.DPID_PATTERN})
+    def put_group_weights(self, req, **kwargs):
+        dpid = dpid_lib.str_to_dpid(kwargs['dpid'])
+        dst = dpid_lib.str_to_dpid(kwargs['dst'])
+        try:
+            new_weights = req.json if req.body else {}
+            if not isinstance(new_weights, dict):
+                raise ValueError(new_weights)
+            # Weights are checked as given, 1.5 or "2" are not weights
+            weights = dict((int(l), w) for (l, w) in new_weights['weights'].items())
+        except (ValueError, KeyError, AttributeError, TypeError):
+            return Response(status=400)
+
+        try:
+            group = self.simple_switch_app.set_group_weights(dpid, dst, weights)
+        except KeyError:
+            return Response(status=404)
+        except ValueError:
+            return Response(status=400)
+        return Response(content_type='application/json', body=json.dumps(group))
+
+    @route('simpleswitch', '/simpleswitch/southbound', methods=['GET'])
+    def southbound_stats(self, req, **kwargs):
+        body = json.dumps(self.simple_switch_app.southbound.stats())
+        return Response(content_type='application/json', body=body)
+
+    @route('simpleswitch', '/simpleswitch/arp', methods=['GET'])
+    def arp_stats(self, req, **kwargs):
+        app = self.simple_switch_app
+        body = json.dumps(dict(app.arp_stats, hosts=len(app.ip_to_mac)))
+        return Response(content_type='application/json', body=body)
+
+    @route('simpleswitch', '/simpleswitch/tables', methods=['GET'])
+    def table_occupancy(self, req, **kwargs):
+        app = self.simple_switch_app
+        body = json.dumps(app.get_table_occupancy())
+        # The answer reflects the previous poll, the next one is started now
+        app.request_table_stats()
+        return Response(content_type='application/json', body=body)
+
+    @route('simpleswitch', '/simpleswitch/flowmods', methods=['GET'])
+    def flow_mod_stats(self, req, **kwargs):
+        body = json.dumps(self.simple_switch_app.shadow.stats())
+        return Response(content_type='application/json', body=body)
+
+    @route('simpleswitch', '/simpleswitch/packetins', methods=['GET'])
+    def packet_in_stats(self, req, **kwargs):
+        app = self.simple_switch_app
+        stats = app.packet_in_queue.stats() if app.packet_in_queue is not None else {}
+        stats['meter'] = {'rate': PACKET_IN_RATE, 'burst': PACKET_IN_BURST,
+                          'unmetered': sorted(app.unmetered)}
+        return Response(content_type='application/json', body=json.dumps(stats))
+
+    @route('simpleswitch', '/simpleswitch/metrics', methods=['GET'])
+    def metrics_json(self, req, **kwargs):
+        body = json.dumps(self.simple_switch_app.metrics.to_dict())
+        return Response(content_type='application/json', body=body)
+
+    @route('simpleswitch', '/metrics', methods=['GET'])
+    def metrics_prometheus(self, req, **kwargs):
+        body = self.simple_switch_app.metrics.prometheus()
+        return Response(content_type='text/plain; version=0.0.4', body=body)
+
+    @route('simpleswitch', '/simpleswitch/linkcosts', methods=['GET'])
+    def link_costs(self, req, **kwargs):
+        body = json.dumps(self.simple_switch_app.link_costs.stats())
+        return Response(content_type='application/json', body=body)
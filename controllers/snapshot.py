@@ -0,0 +1,120 @@
+"""
+On-disk snapshot of the controller state, for warm restarts.
+
+A snapshot is one file: MAGIC, the length of a JSON header, the header and
+then one uint64 row-major table per kind of state, each 8 byte aligned. The
+header holds a few scalars and the offset, row count and columns of every
+table. load() maps the file and returns read-only views, restoring only
+reads the pages it touches and nothing is parsed. The file is written next
+to the old one and renamed over it, a crash while saving keeps the previous
+snapshot.
+
+Installed flow entries are kept as fingerprints of (table_id, priority,
+cookie, match, instructions) so that they can be compared with the flow
+stats of a switch after the restart.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'SWSNAP1\n'
+VERSION = 1
+
+# Columns of every table, 0 stands for None
+TABLES = {
+    'links': ('src', 'dst', 'port', 'cost'),
+    'labels': ('src', 'dst', 'label', 'next_hop', 'cost'),
+    'root_ports': ('sw', 'dst', 'port'),
+    'draining': ('label',),
+    'hosts': ('mac', 'dpid', 'port'),
+    'arp': ('ip', 'mac'),
+    'label_entries': ('dpid', 'in_port', 'label', 'dst', 'out_label', 'out_port'),
+    'adjacencies': ('dpid', 'port'),
+    'segment_paths': ('ingress', 'dst', 'node'),
+    'groups': ('dpid', 'dst', 'group_id', 'type'),
+    'weights': ('dpid', 'dst', 'label', 'weight'),
+    'flows': ('dpid', 'fingerprint', 'evictable'),
+}
+
+
+def mac_to_int(mac):
+    return int(mac.replace(':', ''), 16)
+
+
+def int_to_mac(value):
+    return ':'.join('%02x' % ((value >> shift) & 0xff) for shift in range(40, -8, -8))
+
+
+def ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+def flow_fingerprint(key, cookie, instructions):
+    """64 bit digest of a flow entry. key is (table_id, priority,
+    shadow.match_key()), instructions from shadow.instructions_key()."""
+    text = repr((key, cookie, instructions))
+    return struct.unpack('<Q', hashlib.md5(text.encode('utf-8')).digest()[:8])[0]
+
+
+def save(path, tables, scalars):
+    """Writes {name: [row tuple]} and the JSON-able scalars to path,
+    returns the size of the file."""
+    header = {'version': VERSION, 'scalars': scalars, 'tables': {}}
+    arrays = []
+    offset = 0
+    for (name, columns) in sorted(TABLES.items()):
+        rows = tables.get(name, [])
+        array = np.array(rows, dtype=np.uint64).reshape(len(rows), len(columns))
+        header['tables'][name] = {'offset': offset, 'rows': len(rows), 'columns': columns}
+        arrays.append(array)
+        offset += array.nbytes
+    text = json.dumps(header, sort_keys=True).encode('utf-8')
+    text += b' ' * (-(len(MAGIC) + 8 + len(text)) % 8)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(text)))
+        f.write(text)
+        for array in arrays:
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+    return len(MAGIC) + 8 + len(text) + offset
+
+
+def load(path):
+    """Returns (scalars, {name: uint64 array of rows}) of the snapshot at
+    path, None if there is none or it has another version."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode('utf-8'))
+    if header.get('version') != VERSION:
+        return None
+    base = len(MAGIC) + 8 + length
+    tables = {}
+    for (name, columns) in TABLES.items():
+        info = header['tables'].get(name)
+        if not info or not info['rows'] or list(info['columns']) != list(columns):
+            tables[name] = np.zeros((0, len(columns)), dtype=np.uint64)
+            continue
+        tables[name] = np.memmap(path, dtype=np.uint64, mode='r', offset=base + info['offset'],
+                                 shape=(info['rows'], len(columns)))
+    return (header['scalars'], tables)
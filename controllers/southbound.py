@@ -0,0 +1,127 @@
+"""
+Per-datapath southbound write coalescing.
+
+Messages sent while an event is handled are serialized into a per
+datapath buffer and written with a single Datapath.send() when the handler
+returns (see flushing). The flush can optionally be made atomic with an
+OpenFlow 1.3 ONF bundle (flow and group mods only, meter mods precede the
+bundle and other messages follow the commit) or be followed by a barrier
+request. A message that fails to serialize is logged and left out, the
+others are still sent.
+"""
+
+import collections
+import functools
+import logging
+
+
+# Flush modes
+PLAIN = None
+BARRIER = 'barrier'
+BUNDLE = 'bundle'
+
+
+class Southbound(object):
+
+    def __init__(self, coalesce=True, mode=PLAIN, logger=None):
+        self.coalesce = coalesce
+        self.mode = mode
+        self.logger = logger or logging.getLogger(__name__)
+        # dpid -> (datapath, [msgs])
+        self.pending = {}
+        self.bundle_id = {}
+        self.flushes = 0
+        self.msgs = 0
+        self.bytes = 0
+        self.max_msgs_per_flush = 0
+        self.max_bytes_per_flush = 0
+        # Messages dropped because they failed to serialize
+        self.errors = 0
+        # Messages sent per type name, e.g. 'OFPFlowMod'
+        self.sent = collections.Counter()
+        # Called before every flush, e.g. to publish the state the
+        # messages depend on first
+        self.hooks = []
+
+    def send_msg(self, datapath, msg):
+        self.sent[type(msg).__name__] += 1
+        if not self.coalesce:
+            datapath.send_msg(msg)
+            self.msgs += 1
+            return
+        self.pending.setdefault(datapath.id, (datapath, []))[1].append(msg)
+
+    def _bundle(self, datapath, msgs):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        bundled = [m for m in msgs if isinstance(m, (parser.OFPFlowMod, parser.OFPGroupMod))]
+        if not bundled:
+            return msgs
+        others = [m for m in msgs if not isinstance(m, (parser.OFPFlowMod, parser.OFPGroupMod))]
+        # The flow entries of the bundle may use them
+        meters = [m for m in others if isinstance(m, parser.OFPMeterMod)]
+        others = [m for m in others if not isinstance(m, parser.OFPMeterMod)]
+        bundle_id = self.bundle_id.get(datapath.id, 0) + 1
+        self.bundle_id[datapath.id] = bundle_id
+        flags = ofproto.ONF_BF_ATOMIC | ofproto.ONF_BF_ORDERED
+        out = meters + [parser.ONFBundleCtrlMsg(datapath, bundle_id, ofproto.ONF_BCT_OPEN_REQUEST,
+                                                flags, [])]
+        for m in bundled:
+            out.append(parser.ONFBundleAddMsg(datapath, bundle_id, flags, m, []))
+        out.append(parser.ONFBundleCtrlMsg(datapath, bundle_id, ofproto.ONF_BCT_COMMIT_REQUEST,
+                                           flags, []))
+        return out + others
+
+    def flush(self):
+        for hook in self.hooks:
+            hook()
+        pending = self.pending
+        self.pending = {}
+        for (datapath, msgs) in pending.values():
+            if self.mode == BUNDLE:
+                msgs = self._bundle(datapath, msgs)
+            elif self.mode == BARRIER:
+                msgs = msgs + [datapath.ofproto_parser.OFPBarrierRequest(datapath)]
+            bufs = []
+            for msg in msgs:
+                try:
+                    datapath.set_xid(msg)
+                    msg.serialize()
+                except Exception:
+                    self.errors += 1
+                    self.logger.exception("Dropped %s to %s, it does not serialize",
+                                          type(msg).__name__, datapath.id)
+                    continue
+                bufs.append(msg.buf)
+            if not bufs:
+                continue
+            buf = b''.join(bufs)
+            datapath.send(buf)
+
+            self.flushes += 1
+            self.msgs += len(bufs)
+            self.bytes += len(buf)
+            self.max_msgs_per_flush = max(self.max_msgs_per_flush, len(bufs))
+            self.max_bytes_per_flush = max(self.max_bytes_per_flush, len(buf))
+
+    def stats(self):
+        flushes = max(self.flushes, 1)
+        return {'flushes': self.flushes,
+                'msgs': self.msgs,
+                'bytes': self.bytes,
+                'msgs_per_flush': float(self.msgs) / flushes,
+                'bytes_per_flush': float(self.bytes) / flushes,
+                'max_msgs_per_flush': self.max_msgs_per_flush,
+                'max_bytes_per_flush': self.max_bytes_per_flush,
+                'errors': self.errors}
+
+
+def flushing(handler):
+    """Flushes self.southbound when the event handler returns."""
+    @functools.wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return handler(self, *args, **kwargs)
+        finally:
+            self.southbound.flush()
+    return wrapper
@@ -0,0 +1,128 @@
+"""
+Incremental shortest path state for the label switching controller.
+
+Routes are kept per source switch in the {dst: [(next_hop, cost), ...]}
+shape returned by SimpleSwitch.dijsktra. Topology deltas (switch/link add
+and delete) only mark the sources whose shortest path DAG is touched by the
+change, and only those sources are recomputed. Every delta bumps
+graph.graph['version'] so batch backends know when to take a new snapshot.
+Routes with non shortest alternates (kpaths.py) depend on the distances of
+the neighbours, there every delta recomputes every source.
+"""
+
+
+class IncrementalSPF(object):
+
+    def __init__(self, graph, route_fn, alternates=False):
+        # graph is the controller's nx.DiGraph, route_fn(graph, src) returns
+        # the routes of src in the dijsktra format, cheapest first.
+        self.graph = graph
+        self.route_fn = route_fn
+        self.alternates = alternates
+        self.routes = {}
+        self.graph.graph.setdefault('version', 0)
+
+    def bump(self):
+        self.graph.graph['version'] += 1
+
+    def dist(self, src, node):
+        r = self.routes.get(src, {}).get(node)
+        if not r:
+            return None
+        return r[0][1]
+
+    def add_switch(self, dpid):
+        if dpid in self.graph:
+            return set()
+        self.graph.add_node(dpid)
+        self.bump()
+        # A switch without links does not change anybody else's routes
+        return set([dpid])
+
+    def remove_switch(self, dpid):
+        if dpid not in self.graph:
+            return set()
+        affected = set()
+        for (u, v) in list(self.graph.in_edges(dpid)) + list(self.graph.out_edges(dpid)):
+            affected |= self.remove_link(u, v)
+        self.graph.remove_node(dpid)
+        self.bump()
+        self.routes.pop(dpid, None)
+        affected.discard(dpid)
+        return affected
+
+    def add_link(self, src, dst, attrs):
+        if self.graph.has_edge(src, dst) and self.graph[src][dst] == attrs:
+            return set()
+        affected = set()
+        if self.graph.has_edge(src, dst):
+            affected = self.remove_link(src, dst)
+        for dpid in (src, dst):
+            if dpid not in self.graph:
+                self.graph.add_node(dpid)
+                self.bump()
+                affected.add(dpid)
+        cost = attrs['cost']
+        for s in self.routes:
+            if self.alternates:
+                affected.add(s)
+                continue
+            du = self.dist(s, src)
+            if du is None:
+                continue
+            dv = self.dist(s, dst)
+            # The new link is on (or shortens) a shortest path from s
+            if dv is None or du + cost <= dv:
+                affected.add(s)
+        self.graph.add_edge(src, dst, **attrs)
+        self.bump()
+        return affected
+
+    def remove_link(self, src, dst):
+        if not self.graph.has_edge(src, dst):
+            return set()
+        cost = self.graph[src][dst]['cost']
+        affected = set()
+        for s in self.routes:
+            if self.alternates:
+                affected.add(s)
+                continue
+            du = self.dist(s, src)
+            dv = self.dist(s, dst)
+            if du is None or dv is None:
+                continue
+            # Only sources whose DAG uses the link lose a path
+            if du + cost == dv:
+                affected.add(s)
+        self.graph.remove_edge(src, dst)
+        self.bump()
+        return affected
+
+    def snapshot(self):
+        """(version, nodes, [(u, v, cost)]) of the graph, for route_fn to
+        run elsewhere."""
+        edges = [(u, v, attrs['cost']) for (u, v, attrs) in self.graph.edges(data=True)]
+        return (self.graph.graph['version'], list(self.graph), edges)
+
+    def update(self, sources):
+        """Recompute the given sources, returns {src: set(changed dsts)}."""
+        return self.apply(dict((src, self.route_fn(self.graph, src))
+                               for src in sources if src in self.graph))
+
+    def apply(self, routes):
+        """Swaps in {src: routes} computed for the current graph, returns
+        {src: set(changed dsts)}."""
+        changed = {}
+        for (src, new) in routes.items():
+            if src not in self.graph:
+                continue
+            old = self.routes.get(src, {})
+            self.routes[src] = new
+            dsts = set()
+            for dst in set(old) | set(new):
+                if dst == src:
+                    continue
+                if sorted(old.get(dst, [])) != sorted(new.get(dst, [])):
+                    dsts.add(dst)
+            changed[src] = dsts
+        return changed
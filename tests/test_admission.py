@@ -0,0 +1,75 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'controllers'))
+
+import admission
+
+ARP = admission.PRIORITY[0x0806]
+MPLS = admission.PRIORITY[0x8847]
+IPV4 = admission.PRIORITY[0x0800]
+NEW = admission.NEW
+
+
+def drain(queue):
+    items = []
+    while len(queue):
+        items.append(queue.get())
+    return items
+
+
+class PacketInQueueTest(unittest.TestCase):
+
+    def test_classes_in_priority_order_switches_round_robin(self):
+        queue = admission.PacketInQueue(10)
+        for item in ('a1', 'a2', 'a3'):
+            queue.put(IPV4, 1, item)
+        for item in ('b1', 'b2'):
+            queue.put(IPV4, 2, item)
+        queue.put(NEW, 3, 'n1')
+        self.assertEqual(queue.get(), 'a1')
+        queue.put(ARP, 3, 'c1')
+        self.assertEqual(drain(queue), ['c1', 'b1', 'a2', 'b2', 'a3', 'n1'])
+        self.assertIsNone(queue.get())
+
+    def test_full_drops_newest_of_busiest_switch_in_lowest_class(self):
+        queue = admission.PacketInQueue(4)
+        queue.put(IPV4, 1, 'x1')
+        queue.put(IPV4, 1, 'x2')
+        queue.put(IPV4, 2, 'y1')
+        queue.put(ARP, 3, 'z1')
+        # A lower class than any queued is dropped itself
+        self.assertFalse(queue.put(NEW, 4, 'n1'))
+        # Switch 1 queues the most IPv4, it loses its newest
+        self.assertTrue(queue.put(MPLS, 4, 'm1'))
+        self.assertEqual(queue.dropped_by_dpid, {4: 1, 1: 1})
+        # Same class, switch 2 queues as many as any other: the new one goes
+        self.assertFalse(queue.put(IPV4, 2, 'y2'))
+        self.assertEqual(dict(queue.dropped), {'new': 1, 'ipv4': 2})
+        self.assertEqual(drain(queue), ['z1', 'm1', 'x1', 'y1'])
+        self.assertEqual(queue.peak, 4)
+
+    def test_duplicate_keys_dropped_while_queued(self):
+        queue = admission.PacketInQueue(2)
+        self.assertTrue(queue.put(ARP, 1, 'a', key='bcast'))
+        self.assertFalse(queue.put(ARP, 2, 'b', key='bcast'))
+        self.assertEqual(queue.duplicates, 1)
+        self.assertEqual(queue.get(), 'a')
+        self.assertTrue(queue.put(ARP, 2, 'b', key='bcast'))
+
+    def test_victim_releases_its_key(self):
+        queue = admission.PacketInQueue(1)
+        queue.put(IPV4, 1, 'a', key='k')
+        self.assertTrue(queue.put(ARP, 2, 'b'))
+        self.assertNotIn('k', queue.keys)
+        # Not a duplicate once 'a' is dropped, and switch 3 has nothing
+        # queued, so the ARP of switch 2 makes room
+        self.assertTrue(queue.put(ARP, 3, 'c', key='k'))
+        self.assertEqual(queue.duplicates, 0)
+        self.assertEqual(drain(queue), ['c'])
+        self.assertEqual(queue.stats()['dropped'], {'arp': 1, 'mpls': 0, 'ipv4': 1, 'new': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
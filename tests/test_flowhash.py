@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'controllers'))
+
+import flowhash
+
+
+KEY = (1, ('10.0.0.1', '10.0.0.2', flowhash.IPPROTO_TCP, 40000, 80))
+CHOICES = {100: 1, 101: 2, 102: 3}
+
+
+class PathSelectorTest(unittest.TestCase):
+
+    def test_active_flowlet_keeps_label(self):
+        selector = flowhash.PathSelector(flowlet=True)
+        label = selector.select(KEY, CHOICES)
+        for _ in range(5):
+            self.assertEqual(selector.select(KEY, CHOICES), label)
+        self.assertEqual(selector.active, {CHOICES[label]: 1})
+
+    def test_released_flowlet_moves_to_least_loaded(self):
+        selector = flowhash.PathSelector(flowlet=True)
+        label = selector.select(KEY, CHOICES)
+        # Another flow keeps the uplink of label busy
+        other = (1, ('10.0.0.3', '10.0.0.2', flowhash.IPPROTO_TCP, 40000, 80))
+        selector.select(other, {label: CHOICES[label]})
+        selector.release(KEY, byte_count=1000)
+        self.assertNotEqual(selector.select(KEY, CHOICES), label)
+
+    def test_removed_label_moves_active_flow(self):
+        selector = flowhash.PathSelector()
+        label = selector.select(KEY, CHOICES)
+        choices = dict((l, u) for (l, u) in CHOICES.items() if l != label)
+        self.assertIn(selector.select(KEY, choices), choices)
+        self.assertEqual(sum(selector.active.values()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'controllers'))
+
+import labels
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class LabelAllocatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.allocator = labels.LabelAllocator(first=21, last=24, hold=10, clock=self.clock)
+
+    def test_released_label_is_held(self):
+        a = self.allocator.allocate()
+        self.allocator.release(a)
+        self.assertNotEqual(self.allocator.allocate(), a)
+        self.clock.now = 9.9
+        self.assertNotEqual(self.allocator.allocate(), a)
+        self.clock.now = 10
+        self.assertEqual(self.allocator.allocate(), a)
+
+    def test_reclaimed_in_release_order(self):
+        (a, b, c) = [self.allocator.allocate() for _ in range(3)]
+        self.allocator.release(c)
+        self.clock.now = 1
+        self.allocator.release(a)
+        self.allocator.release(b)
+        # The fourth label is fresh, then the held ones come back in order
+        self.assertEqual(self.allocator.allocate(), 24)
+        self.clock.now = 20
+        self.assertEqual([self.allocator.allocate() for _ in range(3)], [c, a, b])
+
+    def test_double_release_is_ignored(self):
+        a = self.allocator.allocate()
+        self.allocator.release(a)
+        self.allocator.release(a)
+        self.assertEqual(len(self.allocator.draining), 1)
+
+    def test_exhausted(self):
+        for _ in range(4):
+            self.allocator.allocate()
+        self.assertRaises(labels.LabelSpaceExhausted, self.allocator.allocate)
+        # Held labels do not count as free
+        self.allocator.release(21)
+        self.assertRaises(labels.LabelSpaceExhausted, self.allocator.allocate)
+        self.clock.now = 10
+        self.assertEqual(self.allocator.allocate(), 21)
+
+    def test_restore_skips_in_use_and_draining(self):
+        self.clock.now = 100
+        allocator = labels.LabelAllocator(first=21, last=30, hold=10, clock=self.clock)
+        allocator.restore(26, in_use=[21, 23], draining=[22, 23])
+        self.assertEqual(allocator.in_use, set([21, 23]))
+        # 23 is in use, only 22 drains
+        self.assertEqual(list(allocator.draining), [(110, 22)])
+        self.assertEqual([allocator.allocate() for _ in range(4)], [24, 25, 26, 27])
+        self.clock.now = 110
+        self.assertEqual(allocator.allocate(), 22)
+        self.assertEqual(allocator.stats(), {'in_use': 7, 'draining': 0, 'free': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'controllers'))
+
+import labeltable
+
+
+class DictLabelTableTest(unittest.TestCase):
+
+    def make(self):
+        return labeltable.DictLabelTable()
+
+    def setUp(self):
+        self.table = self.make()
+        self.table.set_labels(1, 4, [(21, 2, 2), (22, 3, 2)])
+        self.table.set_labels(2, 4, [(23, 4, 1)])
+
+    def test_labels_and_select(self):
+        self.assertEqual(self.table.labels(1, 4), [(21, 2, 2), (22, 3, 2)])
+        self.assertEqual(self.table.select(1, 4), 21)
+        self.assertEqual(self.table.next_hop(1, 4, 22), 3)
+        self.assertEqual(self.table.count(), 3)
+
+    def test_next_hop_of_another_pair(self):
+        self.assertRaises(KeyError, self.table.next_hop, 1, 4, 23)
+        self.assertRaises(KeyError, self.table.next_hop, 4, 1, 21)
+
+    def test_next_hop_of_released_or_unknown_label(self):
+        self.table.set_labels(1, 4, [(24, 3, 2)])
+        self.assertRaises(KeyError, self.table.next_hop, 1, 4, 21)
+        self.assertRaises(KeyError, self.table.next_hop, 1, 4, 5000)
+        self.assertEqual(self.table.next_hop(1, 4, 24), 3)
+        self.assertEqual(self.table.pop_labels(2, 4), [(23, 4, 1)])
+        self.assertRaises(KeyError, self.table.next_hop, 2, 4, 23)
+        self.assertEqual(self.table.count(), 1)
+
+    def test_remove_source(self):
+        self.assertEqual(sorted(self.table.remove_source(1)), [(21, 2), (22, 3)])
+        self.assertFalse(self.table.has_labels(1, 4))
+        self.assertRaises(KeyError, self.table.next_hop, 1, 4, 21)
+
+
+@unittest.skipIf(labeltable.np is None, "numpy is not installed")
+class ArrayLabelTableTest(DictLabelTableTest):
+
+    def make(self):
+        # Small enough to grow
+        return labeltable.ArrayLabelTable(switches=2, labels=16)
+
+
+if __name__ == '__main__':
+    unittest.main()
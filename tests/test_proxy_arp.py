@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import controller_bench
+import fakedp
+import topogen
+
+
+class ProxyArpTest(unittest.TestCase):
+
+    def setUp(self):
+        (module, cls, contexts) = controller_bench.load_app('simple', [('PROXY_ARP', True)])
+        self.app = cls(**contexts)
+        self.fabric = fakedp.Fabric(self.app, topogen.fat_tree(4))
+        module.get_switch = self.fabric.get_switch
+        module.get_link = self.fabric.get_link
+        self.fabric.connect()
+        self.fabric.converge()
+
+    def tearDown(self):
+        self.app.close()
+
+    def test_reply_sender_learned(self):
+        self.fabric.inject(1, fakedp.arp_frame(1, 6, 1))
+        self.fabric.inject(6, fakedp.arp_frame(6, 1, 2))
+        self.assertEqual(self.app.ip_to_mac[topogen.host_ip(1)], topogen.host_mac(1))
+        self.assertEqual(self.app.ip_to_mac[topogen.host_ip(6)], topogen.host_mac(6))
+        # Answered at the ingress switch of host 10 instead of flooded
+        self.fabric.inject(10, fakedp.arp_frame(10, 6, 1))
+        self.assertEqual(self.app.arp_stats['cached'], 1)
+        self.assertEqual(self.app.arp_stats['flooded'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import collections
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'controllers'))
+
+from ryu.ofproto import ofproto_v1_3 as ofp
+from ryu.ofproto import ofproto_v1_3_parser as parser
+
+import shadow
+
+
+Stat = collections.namedtuple('Stat', 'table_id priority match packet_count')
+
+DPID = 1
+
+
+def output(port):
+    return [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS,
+                                         [parser.OFPActionOutput(port)])]
+
+
+def match(dst):
+    return parser.OFPMatch(eth_dst=dst, eth_type=0x0800)
+
+
+class ShadowTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = shadow.ShadowTable()
+
+    def check(self, dst, port, cookie=0, **kwargs):
+        return self.table.check(DPID, 0, 10, match(dst), output(port), cookie, **kwargs)
+
+    def test_check_decisions(self):
+        self.assertEqual(self.check('00:00:00:00:00:01', 1), shadow.ADD)
+        self.assertEqual(self.check('00:00:00:00:00:01', 1), shadow.SKIP)
+        self.assertEqual(self.check('00:00:00:00:00:01', 2), shadow.MODIFY)
+        # Another cookie cannot be changed by a MODIFY_STRICT
+        self.assertEqual(self.check('00:00:00:00:00:01', 2, cookie=5), shadow.ADD)
+        self.assertEqual(self.table.count(DPID), 1)
+        self.assertEqual((self.table.sent, self.table.skipped, self.table.modified), (3, 1, 1))
+
+    def test_timeouts_are_readded(self):
+        self.check('00:00:00:00:00:01', 1, idle_timeout=10)
+        self.assertEqual(self.check('00:00:00:00:00:01', 1, idle_timeout=10), shadow.ADD)
+        self.assertEqual(self.check('00:00:00:00:00:01', 2, idle_timeout=10), shadow.ADD)
+        self.check('00:00:00:00:00:02', 1, hard_timeout=30)
+        self.assertEqual(self.check('00:00:00:00:00:02', 1, hard_timeout=30), shadow.ADD)
+        self.assertEqual(self.table.modified, 0)
+
+    def test_changed_instructions_without_timeouts_modified(self):
+        self.check('00:00:00:00:00:01', 1)
+        self.assertEqual(self.check('00:00:00:00:00:01', 2), shadow.MODIFY)
+        self.assertEqual(self.check('00:00:00:00:00:01', 2), shadow.SKIP)
+
+    def test_without_dedup_always_adds(self):
+        self.check('00:00:00:00:00:01', 1)
+        self.assertEqual(self.check('00:00:00:00:00:01', 1, dedup=False), shadow.ADD)
+
+    def test_match_case_and_mask_normalised(self):
+        self.table.check(DPID, 0, 10, parser.OFPMatch(eth_dst=('01:00:00:00:00:ff', '01:00:00:00:00:00')),
+                         output(1))
+        result = self.table.check(DPID, 0, 10, parser.OFPMatch(eth_dst=('01:00:00:00:00:00',
+                                                                        '01:00:00:00:00:00')),
+                                  output(1))
+        self.assertEqual(result, shadow.SKIP)
+
+    def test_remove_by_cookie(self):
+        self.check('00:00:00:00:00:01', 1, cookie=3)
+        self.check('00:00:00:00:00:02', 1, cookie=4)
+        self.check('00:00:00:00:00:03', 1, cookie=0x103)
+        self.table.remove(DPID, cookie=3, cookie_mask=shadow.FULL_MASK)
+        self.assertEqual(self.table.count(DPID), 2)
+        # A partial mask compares the masked bits only
+        self.table.remove(DPID, cookie=0x100, cookie_mask=0x100)
+        self.assertEqual(self.table.count(DPID), 1)
+        self.assertEqual(self.check('00:00:00:00:00:02', 1, cookie=4), shadow.SKIP)
+
+    def test_remove_without_cookie_mask(self):
+        self.check('00:00:00:00:00:01', 1, cookie=3)
+        self.check('00:00:00:00:00:02', 1, cookie=4)
+        self.table.check(DPID, 1, 10, match('00:00:00:00:00:01'), output(1))
+        # Every entry of table 0 covered by the match, whatever the cookie
+        self.table.remove(DPID, table_id=0, match=parser.OFPMatch(eth_type=0x0800))
+        self.assertEqual(self.table.count(DPID), 1)
+        self.table.remove(DPID)
+        self.assertEqual(self.table.count(DPID), 0)
+        self.assertEqual(self.table.removed, 3)
+
+    def test_sync_keeps_entries_added_after_request(self):
+        self.check('00:00:00:00:00:01', 1)
+        self.check('00:00:00:00:00:02', 1)
+        self.table.begin_sync(DPID)
+        self.check('00:00:00:00:00:03', 1)
+        # The switch lost the second entry, the third is not in the reply yet
+        self.table.sync(DPID, [Stat(0, 10, match('00:00:00:00:00:01'), 0)], more=True)
+        self.assertEqual(self.table.count(DPID), 3)
+        self.table.sync(DPID, [])
+        self.assertEqual(self.table.reconciled, 1)
+        self.assertEqual(self.check('00:00:00:00:00:01', 1), shadow.SKIP)
+        self.assertEqual(self.check('00:00:00:00:00:02', 1), shadow.ADD)
+        self.assertEqual(self.check('00:00:00:00:00:03', 1), shadow.SKIP)
+
+    def test_victims_least_recently_used(self):
+        for i in range(3):
+            self.check('00:00:00:00:00:0%d' % i, 1, evictable=True)
+        self.check('00:00:00:00:00:09', 1)
+        self.table.begin_sync(DPID)
+        self.table.sync(DPID, [Stat(0, 10, match('00:00:00:00:00:0%d' % i), 1 if i == 0 else 0)
+                               for i in (0, 1, 2, 9)])
+        victims = self.table.victims(DPID, 2)
+        self.assertEqual([m['eth_dst'] for (t, p, m) in victims],
+                         ['00:00:00:00:00:01', '00:00:00:00:00:02'])
+
+
+if __name__ == '__main__':
+    unittest.main()
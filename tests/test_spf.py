@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'controllers'))
+
+import networkx as nx
+
+import ecmp
+from spf import IncrementalSPF
+
+
+def ring(n, cost=1):
+    G = nx.DiGraph()
+    for i in range(1, n + 1):
+        j = i % n + 1
+        G.add_edge(i, j, port=1, cost=cost)
+        G.add_edge(j, i, port=2, cost=cost)
+    return G
+
+
+class IncrementalSPFTest(unittest.TestCase):
+
+    def full(self, spf):
+        return dict((src, ecmp.dijsktra(spf.graph, src)) for src in spf.graph)
+
+    def test_random_deltas_match_full_recompute(self):
+        rand = random.Random(7)
+        spf = IncrementalSPF(nx.DiGraph(), ecmp.dijsktra)
+        for dpid in range(1, 13):
+            spf.add_switch(dpid)
+        spf.update(list(spf.graph))
+        for _ in range(200):
+            (u, v) = rand.sample(range(1, 13), 2)
+            if spf.graph.has_edge(u, v) and rand.random() < 0.4:
+                affected = spf.remove_link(u, v)
+            else:
+                affected = spf.add_link(u, v, {'port': v, 'cost': rand.randint(1, 4)})
+            spf.update(affected)
+            self.assertEqual(spf.routes, self.full(spf))
+
+    def test_cost_increase_on_used_link_marks_sources(self):
+        spf = IncrementalSPF(ring(6), ecmp.dijsktra)
+        spf.update(list(spf.graph))
+        # 1 -> 2 is on the shortest paths of 1 and 6, and on one of the two
+        # equal cost paths from 5 to 2
+        affected = spf.add_link(1, 2, {'port': 1, 'cost': 5})
+        self.assertEqual(affected, set([1, 5, 6]))
+        spf.update(affected)
+        self.assertEqual(spf.routes, self.full(spf))
+
+    def test_unchanged_link_marks_nothing(self):
+        spf = IncrementalSPF(ring(4), ecmp.dijsktra)
+        spf.update(list(spf.graph))
+        version = spf.graph.graph['version']
+        self.assertEqual(spf.add_link(1, 2, {'port': 1, 'cost': 1}), set())
+        self.assertEqual(spf.graph.graph['version'], version)
+
+    def test_unused_link_removal_marks_nothing(self):
+        G = ring(4)
+        G.add_edge(1, 3, port=3, cost=10)
+        spf = IncrementalSPF(G, ecmp.dijsktra)
+        spf.update(list(spf.graph))
+        self.assertEqual(spf.remove_link(1, 3), set())
+
+    def test_remove_switch_drops_its_routes(self):
+        spf = IncrementalSPF(ring(5), ecmp.dijsktra)
+        spf.update(list(spf.graph))
+        affected = spf.remove_switch(3)
+        self.assertNotIn(3, affected)
+        self.assertNotIn(3, spf.routes)
+        spf.update(affected)
+        self.assertEqual(spf.routes, self.full(spf))
+
+    def test_apply_returns_changed_destinations(self):
+        spf = IncrementalSPF(ring(4), ecmp.dijsktra)
+        spf.update([1])
+        routes = ecmp.dijsktra(spf.graph, 1)
+        routes[3] = [(2, 2)]
+        self.assertEqual(spf.apply({1: routes, 9: {}}), {1: set([3])})
+        self.assertNotIn(9, spf.routes)
+        # Same next hops in another order are no change
+        routes = dict(routes)
+        routes[3] = [(2, 2)]
+        self.assertEqual(spf.apply({1: routes}), {1: set()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+"""
+Parameterised data center topologies for Mininet and the offline benchmarks.
+
+fat_tree(k), leaf_spine(leaves, spines, hosts) and jellyfish(switches,
+degree, hosts) return a Topology: plain lists of switches, hosts and
+cables with deterministic dpids and port numbers, cheap enough to build a
+k=64 fat tree (5120 switches, 65536 hosts) in a few seconds. The same
+Topology can be turned into a Mininet Topo, a networkx graph shaped like
+SimpleSwitch.net, or flat link arrays.
+
+    sudo mn --custom topologies/topogen.py --topo fattree,8 --mac --switch ovs --controller remote
+"""
+
+from array import array
+import random
+
+try:
+    from mininet.topo import Topo
+except ImportError:
+    # Offline use, only the generators and the graph/array forms
+    Topo = None
+
+
+class Topology(object):
+
+    def __init__(self, name):
+        self.name = name
+        # dpids in creation order
+        self.switches = []
+        self.roles = {}
+        # (dpid, port, dpid, port), once per cable
+        self.links = []
+        # (host number, dpid, port), host numbers start at 1
+        self.hosts = []
+        self.next_port = {}
+
+    def add_switch(self, dpid, role):
+        self.switches.append(dpid)
+        self.roles[dpid] = role
+        self.next_port[dpid] = 1
+
+    def port(self, dpid):
+        port = self.next_port[dpid]
+        self.next_port[dpid] = port + 1
+        return port
+
+    def add_link(self, a, b):
+        self.links.append((a, self.port(a), b, self.port(b)))
+
+    def add_host(self, dpid):
+        self.hosts.append((len(self.hosts) + 1, dpid, self.port(dpid)))
+
+    def switch_ports(self):
+        """{dpid: [port]} of every used port."""
+        return dict((dpid, list(range(1, self.next_port[dpid]))) for dpid in self.switches)
+
+    def link_map(self):
+        """{(dpid, port): (dpid, port)} in both directions."""
+        links = {}
+        for (a, pa, b, pb) in self.links:
+            links[(a, pa)] = (b, pb)
+            links[(b, pb)] = (a, pa)
+        return links
+
+    def host_map(self):
+        """{host number: (dpid, port)}."""
+        return dict((n, (dpid, port)) for (n, dpid, port) in self.hosts)
+
+    def arrays(self):
+        """(src, src_port, dst, dst_port) arrays of the directed switch links."""
+        out = tuple(array('l') for _ in range(4))
+        for (a, pa, b, pb) in self.links:
+            for row in ((a, pa, b, pb), (b, pb, a, pa)):
+                for (column, value) in zip(out, row):
+                    column.append(value)
+        return out
+
+    def graph(self, cost=1):
+        """networkx DiGraph of the switches with 'port' and 'cost' edge
+        attributes, as built by SimpleSwitch from the topology events."""
+        import networkx as nx
+        g = nx.DiGraph()
+        g.add_nodes_from(self.switches)
+        g.add_edges_from((a, b, {'port': pa, 'cost': cost}) for (a, pa, b, pb) in self.links)
+        g.add_edges_from((b, a, {'port': pb, 'cost': cost}) for (a, pa, b, pb) in self.links)
+        return g
+
+
+def host_mac(n):
+    return '00:00:00:%02x:%02x:%02x' % ((n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+
+
+def host_ip(n):
+    return '10.%d.%d.%d' % ((n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+
+
+def fat_tree(k):
+    """k-ary fat tree: (k/2)^2 core switches, k pods of k/2 aggregation and
+    k/2 edge switches, k/2 hosts per edge switch.
+
+    dpids are numbered core, then aggregation, then edge, pod by pod. Edge
+    switches use ports 1..k/2 for hosts and k/2+1..k towards aggregation,
+    aggregation switches 1..k/2 down and k/2+1..k up, core port p+1 leads
+    to pod p."""
+    if k < 2 or k % 2:
+        raise ValueError("k must be even")
+    half = k // 2
+    topo = Topology('fattree-%d' % k)
+    core = list(range(1, half * half + 1))
+    agg = [[half * half + pod * half + i + 1 for i in range(half)] for pod in range(k)]
+    edge = [[half * half + k * half + pod * half + i + 1 for i in range(half)] for pod in range(k)]
+    for dpid in core:
+        topo.add_switch(dpid, 'core')
+    for pod in range(k):
+        for dpid in agg[pod]:
+            topo.add_switch(dpid, 'agg')
+    for pod in range(k):
+        for dpid in edge[pod]:
+            topo.add_switch(dpid, 'edge')
+            for _ in range(half):
+                topo.add_host(dpid)
+    for pod in range(k):
+        for e in edge[pod]:
+            for a in agg[pod]:
+                topo.add_link(e, a)
+    for pod in range(k):
+        for (i, a) in enumerate(agg[pod]):
+            for j in range(half):
+                topo.add_link(a, core[i * half + j])
+    return topo
+
+
+def leaf_spine(leaves, spines, hosts):
+    """Every leaf is connected to every spine and to `hosts` hosts. Spines
+    are dpids 1..spines, leaf ports 1..hosts lead to hosts and the next
+    ones to the spines in order."""
+    topo = Topology('leafspine-%d-%d-%d' % (leaves, spines, hosts))
+    for s in range(1, spines + 1):
+        topo.add_switch(s, 'spine')
+    for l in range(spines + 1, spines + leaves + 1):
+        topo.add_switch(l, 'leaf')
+        for _ in range(hosts):
+            topo.add_host(l)
+    for l in range(spines + 1, spines + leaves + 1):
+        for s in range(1, spines + 1):
+            topo.add_link(l, s)
+    return topo
+
+
+def jellyfish(switches, degree, hosts, seed=1):
+    """Random regular graph of switches with `degree` network ports each
+    (Singla et al., NSDI 2012), ports 1..hosts lead to hosts. The same seed
+    always gives the same wiring."""
+    if switches * degree % 2 or degree >= switches:
+        raise ValueError("no %d-regular graph on %d switches" % (degree, switches))
+    rnd = random.Random(seed)
+    nodes = list(range(1, switches + 1))
+    free = dict((s, degree) for s in nodes)
+    adj = dict((s, set()) for s in nodes)
+    # Switches with free ports, removed by swapping in the last one
+    open_switches = list(nodes)
+    position = dict((s, i) for (i, s) in enumerate(nodes))
+
+    def use_ports(s, n):
+        free[s] -= n
+        if not free[s]:
+            i = position.pop(s)
+            last = open_switches.pop()
+            if last != s:
+                open_switches[i] = last
+                position[last] = i
+
+    while open_switches:
+        if len(open_switches) > 1:
+            (a, b) = rnd.sample(open_switches, 2)
+            for _ in range(100):
+                if b not in adj[a]:
+                    break
+                (a, b) = rnd.sample(open_switches, 2)
+            if b not in adj[a]:
+                adj[a].add(b)
+                adj[b].add(a)
+                use_ports(a, 1)
+                use_ports(b, 1)
+                continue
+        # No two open switches can be joined: one with two free ports
+        # takes over both ends of a random cable (x, y)
+        a = max(open_switches, key=lambda s: (free[s], -s))
+        if free[a] < 2:
+            # A single free port stays unused
+            break
+        for _ in range(100):
+            x = rnd.choice(nodes)
+            if x == a or x in adj[a] or not adj[x]:
+                continue
+            y = rnd.choice(sorted(adj[x]))
+            if y != a and y not in adj[a]:
+                break
+        else:
+            break
+        adj[x].discard(y)
+        adj[y].discard(x)
+        for s in (x, y):
+            adj[a].add(s)
+            adj[s].add(a)
+        use_ports(a, 2)
+
+    topo = Topology('jellyfish-%d-%d-%d' % (switches, degree, hosts))
+    for s in sorted(adj):
+        topo.add_switch(s, 'tor')
+        for _ in range(hosts):
+            topo.add_host(s)
+    for a in sorted(adj):
+        for b in sorted(adj[a]):
+            if a < b:
+                topo.add_link(a, b)
+    return topo
+
+
+def populate(mn_topo, topo):
+    """Adds the switches, hosts and cables of topo to a Mininet Topo."""
+    names = {}
+    for dpid in topo.switches:
+        names[dpid] = mn_topo.addSwitch('s%d' % dpid, dpid='%016x' % dpid)
+    for (n, dpid, port) in topo.hosts:
+        h = mn_topo.addHost('h%d' % n, mac=host_mac(n), ip=host_ip(n) + '/8')
+        mn_topo.addLink(h, names[dpid], port1=0, port2=port)
+    for (a, pa, b, pb) in topo.links:
+        mn_topo.addLink(names[a], names[b], port1=pa, port2=pb)
+
+
+if Topo is not None:
+
+    class FatTreeTopo(Topo):
+
+        def build(self, k=4):
+            populate(self, fat_tree(int(k)))
+
+    class LeafSpineTopo(Topo):
+
+        def build(self, leaves=4, spines=2, hosts=2):
+            populate(self, leaf_spine(int(leaves), int(spines), int(hosts)))
+
+    class JellyfishTopo(Topo):
+
+        def build(self, switches=20, degree=4, hosts=1, seed=1):
+            populate(self, jellyfish(int(switches), int(degree), int(hosts), int(seed)))
+
+    # Allows the file to be used with `mn --custom topogen.py --topo fattree,4`
+    topos = {
+        'fattree': FatTreeTopo,
+        'leafspine': LeafSpineTopo,
+        'jellyfish': JellyfishTopo,
+    }